@@ -17,6 +17,7 @@ from math_model import Math_model
 from math_model_multiperiod import Math_model_multiperiod
 from networkDelanunay import networkDelanunay
 from alternateNetworkGeo import alternateNetworkGeo
+from surfaceOptions import costSurfaceOptions
 from input_data import InputData
 from typing import Dict
 import scenario_manager
@@ -108,6 +109,10 @@ with st.sidebar:
         num_periods_input = None
         target_mode = None
 
+    routing_mode = st.selectbox("Candidate Pipeline Routing", ("Exact", "Pyramid (approximate, faster)"))
+    routing = 'pyramid' if routing_mode.startswith("Pyramid") else 'dijkstra'
+    report_gap = st.checkbox("Report Routing Cost Gap Against Exact Routing", value=False) if routing == 'pyramid' else False
+
     showAlt = st.checkbox("Show Alternate Network on Final Solution", value=st.session_state.showAlt)
     
     solveButton = st.button("Solve Model")
@@ -149,9 +154,25 @@ if multiperiod:
     st.session_state.target_mode = target_mode
 
 
+def getRegionPoints(g, pipe_path, input_path):
+    #(lat, lon) of every source, sink and pipeline vertex, used to size the cost surface window,
+    #and of the sources and sinks only, whose spacing sets the window buffer
+    asset_points = []
+    if input_path:
+        data = InputData(input_path)
+        data._read_data()
+        asset_points += list(zip(data.source_df['Lat'], data.source_df['Lon']))
+        asset_points += list(zip(data.sink_df['Lat'], data.sink_df['Lon']))
+    region_points = list(asset_points)
+    if pipe_path:
+        region_points += g.get_pipeline_lat_long(pipe_path)
+    return region_points, asset_points
+
+
 #DEFINE SOLVE FUNCTION WITH CACHE
 @st.cache_data
-def solveModel(pipe_path, input_path, dur, tar, direction, tiein, point1, point2, exclusion, etype, onlyin, onlyout, showAlt, crf=0.01):
+def solveModel(pipe_path, input_path, dur, tar, direction, tiein, point1, point2, exclusion, etype, onlyin, onlyout, showAlt, crf=0.01,
+               routing='dijkstra', report_gap=False):
     model_solve_start_time = time.time()
     with st.sidebar:
         if point1[0] == "":
@@ -171,7 +192,9 @@ def solveModel(pipe_path, input_path, dur, tar, direction, tiein, point1, point2
 
             #Build graph  
             g = alternateNetworkGeo()
-            g.initialize_cost_surface()
+            region_points, asset_points = getRegionPoints(g, pipe_path, input_path)
+            g.initialize_cost_surface(costSurfaceOptions(region_points=region_points, asset_points=asset_points or None,
+                                                         raster=True, routing=routing, route_cache=True))
             
             #update progress bar
             time.sleep(3.6)
@@ -199,7 +222,7 @@ def solveModel(pipe_path, input_path, dur, tar, direction, tiein, point1, point2
             if tiein:
                 g.enforce_pipeline_tie_point(point1=point1, point2=point2, exclusion=exclusion, etype=etype, onlyin=onlyin, onlyout=onlyout)
             g.enforce_no_pipeline_diagonal_Xover()
-            g.get_all_source_sink_shortest_paths()
+            g.get_all_source_sink_shortest_paths(report_gap=report_gap)
             g.get_pipe_trans_nodes()
             g.get_trans_nodes()
             g.trans_node_post_process()
@@ -251,6 +274,9 @@ def solveModel(pipe_path, input_path, dur, tar, direction, tiein, point1, point2
         st.session_state.solved = True
         st.success('Optimization Complete!', icon="✅")
         st.write("Model Solve Time: %.2f seconds" % (time.time() - model_solve_start_time))
+        if g.routingGap:
+            st.write("Routing Cost Gap Against Exact: mean %.2f%%, max %.2f%%" % (100 * np.mean(list(g.routingGap.values())),
+                                                                                100 * np.max(list(g.routingGap.values()))))
     
     return fig1, fig2, fig3
 
@@ -286,7 +312,8 @@ def writeSolnMultiperiod(dur, target, crf, soln_arcs, soln_sources, soln_sinks,
 
 def solveModelMultiperiod(pipe_path, input_path, num_periods, tar, direction,
                           tiein, point1, point2, exclusion, etype, onlyin,
-                          onlyout, showAlt, target_mode, crf=0.01):
+                          onlyout, showAlt, target_mode, crf=0.01,
+                          routing='dijkstra', report_gap=False):
     model_solve_start_time = time.time()
     with st.sidebar:
         if point1[0] == "":
@@ -303,7 +330,9 @@ def solveModelMultiperiod(pipe_path, input_path, num_periods, tar, direction,
             my_bar.progress(counter, text=progress_text)
 
             g = alternateNetworkGeo()
-            g.initialize_cost_surface()
+            region_points, asset_points = getRegionPoints(g, pipe_path, input_path)
+            g.initialize_cost_surface(costSurfaceOptions(region_points=region_points, asset_points=asset_points or None,
+                                                         raster=True, routing=routing, route_cache=True))
 
             time.sleep(3.6)
             counter += 30
@@ -332,7 +361,7 @@ def solveModelMultiperiod(pipe_path, input_path, num_periods, tar, direction,
                                              exclusion=exclusion, etype=etype,
                                              onlyin=onlyin, onlyout=onlyout)
             g.enforce_no_pipeline_diagonal_Xover()
-            g.get_all_source_sink_shortest_paths()
+            g.get_all_source_sink_shortest_paths(report_gap=report_gap)
             g.get_pipe_trans_nodes()
             g.get_trans_nodes()
             g.trans_node_post_process()
@@ -395,6 +424,9 @@ def solveModelMultiperiod(pipe_path, input_path, num_periods, tar, direction,
         st.session_state.mp_solved = True
         st.success('Multiperiod Optimization Complete!', icon="✅")
         st.write("Model Solve Time: %.2f seconds" % (time.time() - model_solve_start_time))
+        if g.routingGap:
+            st.write("Routing Cost Gap Against Exact: mean %.2f%%, max %.2f%%" % (100 * np.mean(list(g.routingGap.values())),
+                                                                                100 * np.max(list(g.routingGap.values()))))
 
     return fig1, fig2, fig3
 
@@ -413,7 +445,8 @@ if solveButton:
             point1=st.session_state.point1, point2=st.session_state.point2,
             exclusion=st.session_state.exclusion, etype=st.session_state.etype,
             onlyin=st.session_state.onlyin, onlyout=st.session_state.onlyout,
-            showAlt=st.session_state.showAlt, target_mode=st.session_state.target_mode)
+            showAlt=st.session_state.showAlt, target_mode=st.session_state.target_mode,
+            routing=routing, report_gap=report_gap)
     else:
         fig1, fig2, fig3 = solveModel(
             pipe_path=st.session_state.PIPELINE_FILE, input_path=st.session_state.INPUT_FILE,
@@ -422,7 +455,7 @@ if solveButton:
             point1=st.session_state.point1, point2=st.session_state.point2,
             exclusion=st.session_state.exclusion, etype=st.session_state.etype,
             onlyin=st.session_state.onlyin, onlyout=st.session_state.onlyout,
-            showAlt=st.session_state.showAlt)
+            showAlt=st.session_state.showAlt, routing=routing, report_gap=report_gap)
         st.session_state.mp_solved = False
 
     st.session_state.p3_fig1 = fig1
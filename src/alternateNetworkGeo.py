@@ -1,21 +1,53 @@
 import time
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 from dummyCostSurface import dummyCostSurface
 from networkDelanunay import networkDelanunay
-from geotransformation import geoTransformation
+from geotransformation import geoTransformation, DEFAULT_TILE_SIZE
+from costTiles import costTileStore
+from compactCost import compactCostStore
+from rasterCost import rasterCostStore
+from routeCache import routeCache, routeKey
+from surfaceOptions import costSurfaceOptions
+from pipelineRegistry import pipelineRegistry, DEFAULT_INDEX_CELL
+from routingEngine import routingEngine, buildLandmarks, DEFAULT_CORRIDOR_SLACK, DEFAULT_CORRIDOR_BUFFER
 from networkx import DiGraph
-import networkx as nx
 from matplotlib import rcParams
 import matplotlib.pyplot as plt
 from itertools import combinations
 import plotly.express as px
 import plotly.graph_objects as go
 import random
+from collections import OrderedDict
 
 
 rcParams['figure.figsize'] = 10, 8
 
+SHARED_SURFACE_LIMIT = 2 #loaded cost stores kept for later solves on the same surface
+sharedSurfaces = OrderedDict()
+sharedRouters = {} #routing engines over the shared stores, keyed by the surface key and the routing settings
+sharedMemos = OrderedDict() #route memos of the last solve per surface key and routing settings
+
+
+def get_shared_surface(key, build):
+    #read-only cost store of a surface, built once and shared by every scenario through its own override view
+    if key is None:
+        return build()
+    if key in sharedSurfaces:
+        sharedSurfaces.move_to_end(key)
+        print("Reusing loaded cost surface.")
+        print("")
+    else:
+        sharedSurfaces[key] = build()
+        while len(sharedSurfaces) > SHARED_SURFACE_LIMIT:
+            evicted, _ = sharedSurfaces.popitem(last=False)
+            for routerKey in [routerKey for routerKey in sharedRouters if routerKey[0] == evicted]:
+                del sharedRouters[routerKey]
+    return sharedSurfaces[key].scenario()
+
+
 class alternateNetworkGeo(DiGraph):
     def __init__(self, width=100, height=100):
         super().__init__()
@@ -23,6 +55,9 @@ class alternateNetworkGeo(DiGraph):
         self.height = height
         self.existingPath = {}
         self.existingPathVertices = {}
+        self.existingPathVertexSets = {}
+        self.pipelineCells = {}
+        self.pipelineRegistry = None
         self.existingPathType = {}
         self.sources = {}
         self.sinks = {}
@@ -38,6 +73,26 @@ class alternateNetworkGeo(DiGraph):
         self.existingPathBounds = {}
         self.spathsLength = {}
         self.spathsWeight = {}
+        self.costStore = None
+        self.router = None
+        self.routing = 'dijkstra'
+        self.landmarkTable = None
+        self.landmarkCount = 0
+        self.routerKey = None
+        self.memoKey = None
+        self.routingWorkers = 1
+        self.corridor = (DEFAULT_CORRIDOR_SLACK, DEFAULT_CORRIDOR_BUFFER)
+        self.pyramidLevels = None
+        self.routeCache = None
+        self.surfaceKey = None
+        self.weightOverrides = {}
+        self.overrideFrames = []
+        self.overrideKey = None
+        self.routeMemo = {}
+        self.weightChanges = {}
+        #routes taken from the memo, searched, dropped as stale, the route cache counts its own hits and misses
+        self.routeReuse = {"reused": 0, "recomputed": 0, "invalidated": 0}
+        self.routingGap = None
         
         
     
@@ -47,18 +102,83 @@ class alternateNetworkGeo(DiGraph):
         
         self.add_nodes_from(C.get_vertices())
         self.add_edges_from(C.get_ebunch())
+        self.router = None
         
-    def initialize_cost_surface(self):
+    def initialize_cost_surface(self, options=None, **kwargs):
+        #options: costSurfaceOptions, or its keywords given directly (not both), see costSurfaceOptions
+        #region_points: (lat, lon) of the sources, sinks and pipeline vertices. When given only a
+        #buffered box (or hull) around them is loaded instead of the fixed default window
+        #asset_points: (lat, lon) of the sources and sinks only, the default buffer is buffer_factor times their
+        #mean nearest neighbour spacing (the spacing of region_points when not given)
+        #tiled: route on the out-of-core tile store instead of building the graph in memory
+        #workers: processes used to parse the cost csv when the cache is (re)built, None for all cores
+        #compact: 'float32' or 'uint16' keeps the window as a compactCostStore (each undirected edge
+        #stored once) instead of a networkx graph, see compactCostStore for the error bounds
+        #raster: keep the window as a dense (H, W, 8) rasterCostStore instead of a networkx graph
+        #routing: 'dijkstra', 'astar', 'corridor' or 'pyramid' for point to point queries of the routing engine (not the tile store)
+        #corridor_slack, corridor_buffer: first ellipse of the corridor search, widened to every cell whose lower bound can beat its route
+        #pyramid_factors: coarse levels written with the cost surface cache and refined down to full resolution
+        #when routing='pyramid', the routes are approximate, see get_routing_gap
+        #landmarks: number of ALT landmarks tightening the astar heuristic, their distance table is
+        #computed once per window and kept next to the cost surface cache
+        #routing_workers: processes routing the Delaunay lines over a shared memory copy of the surface, None for all cores
+        #route_cache: keep the routes on disk next to the cost surface cache, keyed by the surface, the routing
+        #settings and the weight overrides, route_cache_size routes at most
+        if options is None:
+            options = costSurfaceOptions(**kwargs)
+        elif kwargs:
+            raise TypeError("initialize_cost_surface takes options or keywords, not both")
+        tiled, compact, raster, routing = options.tiled, options.compact, options.raster, options.routing
+        pyramid_factors = options.pyramid_factors
+
+        self.routing = routing
+        self.routingWorkers = options.routing_workers
+        if routing == 'corridor':
+            self.corridor = (options.corridor_slack, options.corridor_buffer)
         self.gt = geoTransformation()
-        self.gt.processGeoCost()
+        self.gt.processGeoCost(regionPoints=options.region_points, bufferKm=options.buffer_km, bufferFactor=options.buffer_factor,
+                               regionShape=options.region_shape, tiled=tiled, tileSize=options.tile_size or DEFAULT_TILE_SIZE,
+                               workers=options.workers, pyramid=pyramid_factors, assetPoints=options.asset_points)
+        fingerprint = self.gt.getSurfaceFingerprint()
+        if options.route_cache and fingerprint is not None:
+            #the compact dtype rounds the weights, routes of one surface layout are not valid for another
+            settings = [fingerprint, tiled, compact, raster, routing,
+                        list(self.corridor) if routing == 'corridor' else None,
+                        list(pyramid_factors) if routing == 'pyramid' else None]
+            self.surfaceKey = hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+            self.routeCache = routeCache(self.gt.getRouteCachePath(), maxEntries=options.route_cache_size)
 
         self.width = self.gt.getWidth()
         self.height = self.gt.getHeight()
 
-        edges = self.gt.getEdegsDict()
-
-        cellsize = self.gt.getCellSize()
-
+        #the surface a later solve can share, and the routing settings its engine and route memo depend on
+        key = None
+        if tiled:
+            key = ("tiled", fingerprint, str(self.gt.getTilePath()), options.tile_size, options.max_tiles)
+        elif fingerprint is not None:
+            key = ("raster", fingerprint) if raster else ("compact", compact, fingerprint) if compact is not None \
+                else ("graph", fingerprint)
+        if key is not None:
+            self._attach_route_memo((key, routing, self.corridor, options.landmarks, pyramid_factors))
+
+        if tiled:
+            self.costStore = get_shared_surface(key, lambda: costTileStore(self.gt.getTilePath(), maxTiles=options.max_tiles))
+            return
+
+        #the landmark table is read (or built) with the first routing engine, see _get_router
+        self.landmarkCount = options.landmarks
+        if routing == 'pyramid':
+            self.pyramidLevels = self.gt.loadCostPyramid(pyramid_factors)
+
+        #the stores are read-only, a later solve on the same surface reuses the loaded one and its routing engine
+        if raster or (compact is not None):
+            if key is not None:
+                self.routerKey = self.memoKey
+            build = self._build_raster_store if raster else (lambda: self._build_compact_store(compact))
+            self.costStore = get_shared_surface(key, build)
+            return
+
+        src, dst, cost = self.gt.getEdgeArrays()
 
         start_time = time.time()
         print("Adding graph vertices...")
@@ -66,28 +186,223 @@ class alternateNetworkGeo(DiGraph):
         print("Added Vertices. Time Taken: %s seconds" %(time.time() - start_time))
         print("")
 
-        # self.add_edges_from(self.gt.getEdgesList())
-
+        #edge lengths are looked up from the per-row length table instead of stored on every edge
         start_time = time.time()
         print("Adding graph Edges...")
-        diagonal_l = np.sqrt(2)*(cellsize/0.008333)
-        for key in edges.keys():
-            # print(key[0], key[1], edges[key])
-            if (abs(key[0] - key[1]) == self.width+1) or (abs(key[0] - key[1]) == self.width-1):
-                # approx_l = self.gt._getDistance(key[0], key[1]) #km only cal for diagonals TODO: Too time consurming to compute actual diagonal distance
-                approx_l = diagonal_l
-            else:
-                approx_l = cellsize/0.008333 #km
-            self.add_edge(key[0], key[1], weight=edges[key], length=approx_l)
+        self.add_weighted_edges_from(zip(src.tolist(), dst.tolist(), cost.tolist()))
         print("Added Edges. Time Taken: %s seconds" %(time.time() - start_time))
         print("")
     
     
+    def _build_raster_store(self):
+        start_time = time.time()
+        print("Building raster cost surface...")
+        store = rasterCostStore(self.gt)
+        self.gt.clearEdgeArrays()
+        print("Raster cost surface: %s bytes. Time Taken: %s seconds" %(store.nbytes(), time.time() - start_time))
+        print("")
+        return store
+
+    def _build_compact_store(self, compact):
+        start_time = time.time()
+        print("Encoding compact cost surface...")
+        store = compactCostStore(self.gt, dtype=compact)
+        self.gt.clearEdgeArrays()
+        print("Compact cost surface: %s bytes, max relative error %s. Time Taken: %s seconds"
+              %(store.nbytes(), store.maxRelativeError, time.time() - start_time))
+        print("")
+        return store
+
+    def _has_edge(self, u, v):
+        if self.costStore is not None:
+            return self.costStore.has_edge(u, v)
+        return ((u, v) in self.weightOverrides) or self.has_edge(u, v)
+
+    def _edge_weight(self, u, v):
+        if self.costStore is not None:
+            return self.costStore.get_weight(u, v)
+        if (u, v) in self.weightOverrides:
+            return self.weightOverrides[(u, v)]
+        return self.edges[u, v]['weight']
+
+    def _record_weight_change(self, u, v):
+        if self.routeMemo and ((u, v) not in self.weightChanges):
+            #weight the memoised routes were found with
+            self.weightChanges[(u, v)] = self._edge_weight(u, v) if self._has_edge(u, v) else np.inf
+
+    def _set_edge_weight(self, u, v, weight):
+        #override the weight of an edge, adding the edge if it does not exist yet. The loaded surface
+        #(networkx edges or cost store) is never written, the override layer is consulted on top of it
+        self._record_weight_change(u, v)
+        if self.overrideFrames and ((u, v) not in self.overrideFrames[-1]):
+            self.overrideFrames[-1][(u, v)] = self.weightOverrides.get((u, v))
+        if self.costStore is not None:
+            self.costStore.set_weight(u, v, weight)
+        if self.router is not None:
+            self.router.set_weight(u, v, weight)
+        self.weightOverrides[(u, v)] = weight
+        self.overrideKey = None
+
+    def _set_edge_weights(self, edges, weights):
+        #_set_edge_weight of many edges, the routing engine looks them all up at once
+        router, self.router = self.router, None
+        for (u, v), weight in zip(edges, weights):
+            self._set_edge_weight(u, v, weight)
+        self.router = router
+        if (router is not None) and len(edges):
+            src, dst = zip(*edges)
+            router.set_weights(src, dst, [self.weightOverrides[edge] for edge in edges])
+
+    def push_overrides(self):
+        #open an override frame, pop_overrides() restores every edge weight overridden after it
+        self.overrideFrames.append({})
+
+    def pop_overrides(self):
+        #undo the weight overrides made since the matching push_overrides
+        frame = self.overrideFrames.pop()
+        for (u, v), previous in frame.items():
+            self._record_weight_change(u, v)
+            if previous is None:
+                del self.weightOverrides[(u, v)]
+                if self.costStore is not None:
+                    self.costStore.reset_weight(u, v)
+            else:
+                self.weightOverrides[(u, v)] = previous
+                if self.costStore is not None:
+                    self.costStore.set_weight(u, v, previous)
+            if self.router is not None:
+                if self._has_edge(u, v):
+                    self.router.set_weight(u, v, self._edge_weight(u, v))
+                else:
+                    #the engine cannot drop an edge, it is rebuilt on the next query
+                    self.router = None
+        self.overrideKey = None
+
+    def get_override_key(self):
+        #sha1 of the override layer (zero cost pipelines, tie-in blocks, one way penalties), used as a cache key
+        if self.overrideKey is None:
+            overrides = np.array([(u, v, w) for (u, v), w in sorted(self.weightOverrides.items())], dtype=np.float64)
+            self.overrideKey = hashlib.sha1(overrides.tobytes()).hexdigest()
+        return self.overrideKey
+
+    def _validate_route_memo(self):
+        #drop the memoised routes the weight changes since they were found can affect, the rest stay shortest
+        if self.weightChanges:
+            router = self._get_router()
+            if router is None:
+                stale = set(self.routeMemo)
+            else:
+                stale = router.affected_routes({pair: (route[1], route[0]) for pair, route in self.routeMemo.items()},
+                                               self.weightChanges)
+            for pair in stale:
+                del self.routeMemo[pair]
+            self.routeReuse["invalidated"] += len(stale)
+            #cleared in place, a shared memo entry refers to this dict
+            self.weightChanges.clear()
+
+    def _attach_route_memo(self, key):
+        #take over the route memo of the last solve on the same surface and routing settings. Its routes were
+        #shortest under the weight overrides of that solve, every edge it overrode (or changed since its last
+        #validation) counts as changed here, with the weight the routes were found with
+        self.memoKey = key
+        entry = sharedMemos.get(key)
+        if entry is not None:
+            sharedMemos.move_to_end(key)
+            for edge in set(entry["overrides"]) | set(entry["changes"]):
+                self.weightChanges[edge] = entry["changes"][edge] if edge in entry["changes"] else entry["overrides"][edge]
+            self.routeMemo = entry["routes"]
+        sharedMemos[key] = {"routes": self.routeMemo, "overrides": self.weightOverrides, "changes": self.weightChanges}
+        while len(sharedMemos) > SHARED_SURFACE_LIMIT:
+            sharedMemos.popitem(last=False)
+
+    def _memo_route(self, pair):
+        route = self.routeMemo.get(pair)
+        if route is None:
+            return None
+        self.routeReuse["reused"] += 1
+        return list(route[0]), route[1], route[2]
+
+    def _route_key(self, source, destination):
+        return routeKey(self.surfaceKey, self.get_override_key(), source, destination)
+
+    def _get_router(self):
+        #CSR routing engine over the in-memory surface, built on the first query.
+        #The out-of-core tile store routes on its own and has no engine
+        if (self.router is None) and (not isinstance(self.costStore, costTileStore)):
+            gridWidth = self.gt.getWidth() if hasattr(self, 'gt') else None
+            if self.landmarkCount and (self.landmarkTable is None) and (self.routerKey not in sharedRouters):
+                self.landmarkTable = self._get_landmarks(self.landmarkCount)
+            if (self.costStore is not None) and (self.routerKey is not None):
+                #the engine of the shared store is built once, every scenario routes on a copy of its weights
+                if self.routerKey not in sharedRouters:
+                    sharedRouters[self.routerKey] = routingEngine(*sharedSurfaces[self.routerKey[0]].edge_arrays(),
+                                                                  gridWidth=gridWidth, method=self.routing,
+                                                                  landmarks=self.landmarkTable, corridorSlack=self.corridor[0],
+                                                                  corridorBuffer=self.corridor[1], pyramid=self.pyramidLevels)
+                self.router = sharedRouters[self.routerKey].scenario()
+                src, dst, weight = self.costStore.override_arrays()
+                if len(src):
+                    self.router.set_weights(src, dst, weight)
+            elif self.costStore is not None:
+                self.router = routingEngine(*self.costStore.edge_arrays(), gridWidth=gridWidth, method=self.routing,
+                                            landmarks=self.landmarkTable, corridorSlack=self.corridor[0],
+                                            corridorBuffer=self.corridor[1], pyramid=self.pyramidLevels)
+            else:
+                #overrides come after the loaded edges, the engine keeps the last weight of an edge
+                edges = list(self.edges(data='weight')) + [(u, v, w) for (u, v), w in self.weightOverrides.items()]
+                edges = np.array(edges, dtype=np.float64).reshape(-1, 3)
+                self.router = routingEngine(edges[:, 0], edges[:, 1], edges[:, 2], nodes=list(self.nodes), gridWidth=gridWidth,
+                                            method=self.routing, landmarks=self.landmarkTable, corridorSlack=self.corridor[0],
+                                            corridorBuffer=self.corridor[1], pyramid=self.pyramidLevels)
+        return self.router
+
+    def _get_landmarks(self, k):
+        #landmark table of the base surface (before any pipeline or tie-in edge), loaded when a current one is on disk
+        src, dst, cost = self.gt.getEdgeArrays()
+        nodes = np.unique(np.concatenate((src, dst)))
+        table = self.gt.loadLandmarks(k, nodes)
+        if table is None:
+            start_time = time.time()
+            print("Preprocessing %s routing landmarks..." %(k))
+            table = buildLandmarks(src, dst, cost, k=k)
+            self.gt.saveLandmarks(k, table)
+            print("Routing landmarks ready. Time Taken: %s seconds" %(time.time() - start_time))
+            print("")
+        return table
+
+    def get_routing_stats(self):
+        #pairs, settled nodes and seconds of every search of the routing engine, point to point or endpoint group
+        if self.router is None:
+            return []
+        return self.router.queryStats
+
+    def get_routing_gap(self, pairs):
+        #relative gap of the weights in spathsWeight against exact routing of the same pairs, {pair: gap}
+        router = self._get_router()
+        if router is None:
+            return {(pair[0], pair[1]): 0.0 for pair in pairs}
+        exact = router.shortest_paths(pairs, workers=self.routingWorkers, exact=True)
+        return {pair: (self.spathsWeight[pair] - weight) / weight if weight > 0 else 0.0
+                for pair, (weight, path) in exact.items()}
+
+    def _tie_in_candidate_edges(self, vertices):
+        #every tie-in rule needs one end of the edge on the pipeline or at a tie-in point,
+        #so only the in/out edges of those vertices are enumerated (about 8 each)
+        vertices = set(vertices)
+        if self.costStore is not None:
+            return self.costStore.edges_touching(vertices)
+        nodes = [vertex for vertex in vertices if self.has_node(vertex)]
+        edges = set(self.out_edges(nodes)) | set(self.in_edges(nodes))
+        edges.update(edge for edge in self.weightOverrides if (edge[0] in vertices) or (edge[1] in vertices))
+        return edges
+    
     def add_vertices_from_list(self, vertices):
         self.add_nodes_from(vertices)
+        self.router = None
         
     def add_edges_from_list(self, edgelist):
         self.add_edges_from(edgelist)
+        self.router = None
         
         
     def import_pipeline(self, input_dir, pathname, flowtype='bidirectional'):
@@ -106,111 +421,111 @@ class alternateNetworkGeo(DiGraph):
         self.existingPathBounds[pathname] = [lower_bound, upper_bound]
 
 
+    def get_pipeline_lat_long(self, input_dir):
+        pipeline = pd.read_excel(input_dir)
+        return list(zip(pipeline["Lat"], pipeline["Long"]))
+
     def import_pipeline_lat_long(self, input_dir, flowtype='bidirectional'):
         print("Importing Pipeline...")
         pipeline = pd.read_excel(input_dir)
-        pipe_nodes = []
-        start_nodes = []
-        end_nodes = []
-        
-        pathname = pipeline["Name"][0]
-        lower_bound = pipeline['Lower Cap'].values[0]
-        upper_bound = pipeline['Upper Cap'].values[0]
-        
-        for i in range(len(pipeline["Lat"])):
-            cell = self.gt._latlonToCell(pipeline["Lat"][i], pipeline["Long"][i])
-            if i == 0:
-                start_nodes.append(cell)
-            elif i == len(pipeline["Lat"])-1:
-                end_nodes.append(cell)
-            else:
-                start_nodes.append(cell)
-                end_nodes.append(cell)
-    
-        for i in range(len(start_nodes)):
-            if start_nodes[i] != end_nodes[i]:
-                pipe_nodes.append((start_nodes[i], end_nodes[i]))
-
-        # print("PIPE NODES")
-        # print(pipe_nodes)
-
-        edges = [edge for edge in self.edges]
-        # print(edges)
-        pipe_nodes_mod = []
-        for nodepair in pipe_nodes:
-            if nodepair in edges:
-                pipe_nodes_mod.append(nodepair)
-            else:
-                start_list = []
-                end_list = []
-                s_p = nx.shortest_path(self, nodepair[0], nodepair[1], weight='weight')
-                for i in range(len(s_p)):
-                    if i == 0:
-                        start_list.append(s_p[i])
-                    elif i == len(s_p) - 1:
-                        end_list.append(s_p[i])
-                    else:
-                        start_list.append(s_p[i])
-                        end_list.append(s_p[i])
-                
-                for i in range(len(start_list)):
-                    pipe_nodes_mod.append((start_list[i], end_list[i]))
-        
-        # print("PIPE NODE MOD: ", pipe_nodes_mod)
-
-        print("Embedding zero cost path...")
-        self.add_existing_zero_cost_path(pathname, pipe_nodes_mod, flowtype)
-        self.existingPathType[pathname] = flowtype
-        self.existingPathBounds[pathname] = [lower_bound, upper_bound]
+        self._embed_pipeline(pipeline["Name"][0], pipeline["Lat"].values, pipeline["Long"].values,
+                             pipeline['Lower Cap'].values[0], pipeline['Upper Cap'].values[0], flowtype)
         print("Finished Adding Pipeline.")
         print("")
 
-        
-
-        
+    def import_pipelines(self, input_dir, flowtype='bidirectional', index_cell=DEFAULT_INDEX_CELL):
+        #every pipeline of a csv, xlsx, parquet or GeoJSON file (see pipelineRegistry) whose bounding
+        #box meets the loaded region, the others are never rasterised
+        print("Importing Pipelines...")
+        start_time = time.time()
+        self.pipelineRegistry = pipelineRegistry(index_cell).read(input_dir)
+        names = self.pipelineRegistry.query(self.gt.south, self.gt.west, self.gt.north, self.gt.east)
+        embedded = []
+        for name in names:
+            pipeline = self.pipelineRegistry.pipelines[name]
+            embedded += self._embed_pipeline(name, pipeline["Lat"], pipeline["Long"],
+                                             pipeline["Lower Cap"], pipeline["Upper Cap"], flowtype)
+        print("Imported %s of %s pipelines as %s paths. Time Taken: %s seconds"
+              %(len(names), len(self.pipelineRegistry), len(embedded), time.time() - start_time))
+        print("")
+        return embedded
+
+    def _free_pathname(self, pathname):
+        #export_network splits node names on '_', a name already embedded gets the next free -k suffix
+        pathname = str(pathname).replace("_", "-")
+        name, k = pathname, 1
+        while name in self.existingPath:
+            k += 1
+            name = "%s-%s" %(pathname, k)
+        return name
+
+    def _embed_pipeline(self, pathname, lat, lon, lower_bound, upper_bound, flowtype):
+        #snap the polyline to the grid, consecutive cells are 8-neighbours
+        start_time = time.time()
+        cells = self.gt._rasterizePolyline(self.gt._latlonToCellArray(lat, lon))
+
+        #the pipeline is cut where it leaves the window, every stretch inside is a path of its own
+        inside = self.gt._windowMask(cells) if hasattr(self.gt, 'rowMin') else np.ones(len(cells), dtype=bool)
+        cuts = np.flatnonzero(np.diff(inside.astype(np.int8))) + 1
+        runs = [run.tolist() for run, keep in zip(np.split(cells, cuts), np.split(inside, cuts)) if keep[0] and len(run) > 1]
+
+        names = []
+        for run in runs:
+            name = self._free_pathname(pathname)
+            pipe_nodes = list(zip(run[:-1], run[1:]))
+
+            #a step onto a cell without an edge (no data) follows the least cost route instead.
+            #The gap fill is searched directly, it is not a route of the network and stays out of the memo and cache
+            pipe_nodes_mod = []
+            for nodepair in pipe_nodes:
+                if self._has_edge(nodepair[0], nodepair[1]):
+                    pipe_nodes_mod.append(nodepair)
+                else:
+                    _, s_p = self._search_route(nodepair[0], nodepair[1])
+                    pipe_nodes_mod += list(zip(s_p[:-1], s_p[1:]))
+
+            print("Embedding zero cost path...")
+            self.add_existing_zero_cost_path(name, pipe_nodes_mod, flowtype)
+            self.existingPathType[name] = flowtype
+            self.existingPathBounds[name] = [lower_bound, upper_bound]
+            names.append(name)
+        print("Embedded %s pipeline edges. Time Taken: %s seconds"
+              %(sum(len(self.existingPath[name]) for name in names), time.time() - start_time))
+        return names
 
-        
     def add_existing_zero_cost_path(self, pathname, path_nodes, flowtype):
-        existingPathVertices = {}
+        #pipelines accumulate, a pathname given again extends its path
+        if not path_nodes:
+            raise ValueError("pipeline %s has no edges" %(pathname))
+        existingPathVertices = []
         np = 0
-        edges = [edge for edge in self.edges]
+        edges = []
+        weights = []
         for nodepair in path_nodes:
-            # self.edges[nodepair[0], nodepair[1]]['weight'] = 0
             if flowtype == 'bidirectional':
-                if (nodepair[0], nodepair[1]) in edges:
-                    self.edges[nodepair[0], nodepair[1]]['weight'] = 0
-                else:
-                    self.add_edge(nodepair[0], nodepair[1], weight=0)
-
-                if (nodepair[1], nodepair[0]) in edges:
-                    self.edges[nodepair[1], nodepair[0]]['weight'] = 0
-                else:
-                    self.add_edge(nodepair[1], nodepair[0], weight=0)
+                edges += [(nodepair[0], nodepair[1]), (nodepair[1], nodepair[0])]
+                weights += [0, 0]
             elif flowtype == 'unidirectional':
-                if (nodepair[0], nodepair[1]) in edges:
-                    self.edges[nodepair[0], nodepair[1]]['weight'] = 0
-                else:
-                    self.add_edge(nodepair[0], nodepair[1], weight=0)
-
-                if (nodepair[1], nodepair[0]) in edges:
-                    self.edges[nodepair[1], nodepair[0]]['weight'] = 1e9
-                else:
-                    self.add_edge(nodepair[1], nodepair[0], weight=1e9)
+                edges += [(nodepair[0], nodepair[1]), (nodepair[1], nodepair[0])]
+                weights += [0, 1e9]
             
             if pathname in self.existingPath:
                 self.existingPath[pathname].append(nodepair)
             else:
                 self.existingPath[pathname] = [nodepair]
             
-            if pathname in existingPathVertices:
-                existingPathVertices[pathname].append(nodepair[0])
-            else:
-                existingPathVertices[pathname] = [nodepair[0]]
-                
+            existingPathVertices.append(nodepair[0])
             np = nodepair[1]
         
-        existingPathVertices[pathname].append(np)
-        self.existingPathVertices = existingPathVertices
+        existingPathVertices.append(np)
+        self.existingPathVertices.setdefault(pathname, []).extend(existingPathVertices)
+        self._set_edge_weights(edges, weights)
+        #set index of the pipeline vertices for the tie-in rules, cell -> pipelines index for transshipment detection
+        self.existingPathVertexSets.setdefault(pathname, set()).update(existingPathVertices)
+        for cell in existingPathVertices:
+            names = self.pipelineCells.setdefault(cell, [])
+            if pathname not in names:
+                names.append(pathname)
         
     def get_existing_zero_cost_path(self):
         return self.existingPath
@@ -235,32 +550,36 @@ class alternateNetworkGeo(DiGraph):
 
         # print("POINT1 & 2: ", point1, point2)
 
+        #without a pathname the tie-in point picks its pipeline from the cell index, the first pipeline otherwise
         if pathname is None:
-            keys = [key for key in self.existingPath.keys()]
-            pathname = keys[0]
+            names = self.pipelineCells.get(point1) or self.pipelineCells.get(point2)
+            pathname = names[0] if names else next(iter(self.existingPath))
         
         
+        #membership tests below go against sets, the edges come from the adjacency of the pipeline
+        pathset = self.existingPathVertexSets[pathname]
+
         #case 1: 2 tie in points with all exclusion
         if point1 and point2 and (not exclusion):
             print("case 1: 2 tie in points with all exclusion")
-            for edge in self.edges:
+            for edge in self._tie_in_candidate_edges(self.existingPathVertices[pathname] + [point1, point2]):
                 #in
-                if (edge[1] in self.existingPathVertices[pathname]) and (edge[0] not in self.existingPathVertices[pathname]) \
+                if (edge[1] in pathset) and (edge[0] not in pathset) \
                     and (edge[1] != point1) and (edge[1] != point2):
-                    self.edges[edge]['weight'] = 1e9
+                    self._set_edge_weight(edge[0], edge[1], 1e9)
                     
                 #out
-                if (edge[0] in self.existingPathVertices[pathname]) and (edge[1] not in self.existingPathVertices[pathname]) \
+                if (edge[0] in pathset) and (edge[1] not in pathset) \
                     and (edge[0] != point1) and (edge[0] != point2):
-                    self.edges[edge]['weight'] = 1e9
+                    self._set_edge_weight(edge[0], edge[1], 1e9)
 
                 if onlyin:
-                    if ((edge[0] == point1) or (edge[0] == point2)) and (edge[1] not in self.existingPathVertices[pathname]):
-                        self.edges[edge]['weight'] = 1e9
+                    if ((edge[0] == point1) or (edge[0] == point2)) and (edge[1] not in pathset):
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
 
                 if onlyout:
-                    if ((edge[1] == point1) or (edge[1] == point2)) and (edge[0] not in self.existingPathVertices[pathname]):
-                        self.edges[edge]['weight'] = 1e9
+                    if ((edge[1] == point1) or (edge[1] == point2)) and (edge[0] not in pathset):
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
                 
             
         #case 2: 2 tie in points with exclusion at ends
@@ -270,27 +589,27 @@ class alternateNetworkGeo(DiGraph):
             pathvertices = self.existingPathVertices[pathname].copy()
             minidx, maxidx = map(pathvertices.index, (point1, point2))
             minidx, maxidx = min(minidx, maxidx), max(minidx, maxidx)
-            not_excluded = pathvertices[minidx:maxidx+1]
-            exclusion_list = [i for i in pathvertices if i not in not_excluded]
+            not_excluded = set(pathvertices[minidx:maxidx+1])
+            exclusion_list = pathset - not_excluded
             
-            for edge in self.edges:
+            for edge in self._tie_in_candidate_edges(pathvertices + [point1, point2]):
                 #in
-                if (edge[1] in exclusion_list) and (edge[0] not in pathvertices) \
+                if (edge[1] in exclusion_list) and (edge[0] not in pathset) \
                     and (edge[1] != point1) and (edge[1] != point2):
-                    self.edges[edge]['weight'] = 1e9
+                    self._set_edge_weight(edge[0], edge[1], 1e9)
                 
                 #out
-                if (edge[0] in exclusion_list) and (edge[1] not in pathvertices) \
+                if (edge[0] in exclusion_list) and (edge[1] not in pathset) \
                     and (edge[0] != point1) and (edge[0] != point2):
-                    self.edges[edge]['weight'] = 1e9
+                    self._set_edge_weight(edge[0], edge[1], 1e9)
 
                 if onlyin:
-                    if (edge[0] in not_excluded) and (edge[1] not in self.existingPathVertices[pathname]):
-                        self.edges[edge]['weight'] = 1e9
+                    if (edge[0] in not_excluded) and (edge[1] not in pathset):
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
 
                 if onlyout:
-                    if (edge[1] in not_excluded) and (edge[0] not in self.existingPathVertices[pathname]):
-                        self.edges[edge]['weight'] = 1e9
+                    if (edge[1] in not_excluded) and (edge[0] not in pathset):
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
                     
         
         else:
@@ -302,29 +621,29 @@ class alternateNetworkGeo(DiGraph):
                 if pathvertices[0] > pathvertices[-1]: #make the path always read from left to right
                     pathvertices.reverse()
                 if etype == 'before':
-                    exclusion_list = pathvertices[:-1] #means source/sink is at end of path
+                    exclusion_list = set(pathvertices[:-1]) #means source/sink is at end of path
                 else:
-                    exclusion_list = pathvertices[1:] #means source/sink is at begining of path
+                    exclusion_list = set(pathvertices[1:]) #means source/sink is at begining of path
                 
-                for edge in self.edges:
+                for edge in self._tie_in_candidate_edges(pathvertices + [point]):
                     #in
-                    if (edge[1] in exclusion_list) and (edge[0] not in pathvertices) \
+                    if (edge[1] in exclusion_list) and (edge[0] not in pathset) \
                         and (edge[1] != point):
-                        self.edges[edge]['weight'] = 1e9
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
                     #out    
-                    if (edge[0] in exclusion_list) and (edge[1] not in pathvertices) \
+                    if (edge[0] in exclusion_list) and (edge[1] not in pathset) \
                         and (edge[0] != point):
-                        self.edges[edge]['weight'] = 1e9
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
 
                     #enforce onlyin
                     if onlyin:
-                        if (edge[0] == point) and (edge[1] not in pathvertices):
-                            self.edges[edge]['weight'] = 1e9
+                        if (edge[0] == point) and (edge[1] not in pathset):
+                            self._set_edge_weight(edge[0], edge[1], 1e9)
 
                     #enforce onlyin
                     if onlyout:
-                        if (edge[1] == point) and (edge[0] not in pathvertices):
-                            self.edges[edge]['weight'] = 1e9
+                        if (edge[1] == point) and (edge[0] not in pathset):
+                            self._set_edge_weight(edge[0], edge[1], 1e9)
 
                 
             
@@ -336,87 +655,83 @@ class alternateNetworkGeo(DiGraph):
                 if pathvertices[0] > pathvertices[-1]: #make the path always read from left to right
                     pathvertices.reverse()
                 if etype == 'before':
-                    exclusion_list = pathvertices[:pathvertices.index(point)]
+                    exclusion_list = set(pathvertices[:pathvertices.index(point)])
                 else:
-                    exclusion_list = pathvertices[pathvertices.index(point)+1:]
+                    exclusion_list = set(pathvertices[pathvertices.index(point)+1:])
 
                 end1 = pathvertices[0]
                 end2 = pathvertices[-1]
                     
-                for edge in self.edges:
+                for edge in self._tie_in_candidate_edges(pathvertices + [point]):
                     #in
-                    if (edge[1] in exclusion_list) and (edge[0] not in pathvertices) \
+                    if (edge[1] in exclusion_list) and (edge[0] not in pathset) \
                         and (edge[1] != point):
-                        self.edges[edge]['weight'] = 1e9
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
                     
                     #out
-                    if (edge[0] in exclusion_list) and (edge[1] not in pathvertices) \
+                    if (edge[0] in exclusion_list) and (edge[1] not in pathset) \
                         and (edge[0] != point):
-                        self.edges[edge]['weight'] = 1e9
+                        self._set_edge_weight(edge[0], edge[1], 1e9)
 
                     
                     if onlyin:
-                        if (edge[0] in pathvertices) and (edge[0] not in exclusion_list) \
-                            and (edge[0] != end2) and (edge[0] != end1) and (edge[1] not in pathvertices):
-                            self.edges[edge]['weight'] = 1e9
+                        if (edge[0] in pathset) and (edge[0] not in exclusion_list) \
+                            and (edge[0] != end2) and (edge[0] != end1) and (edge[1] not in pathset):
+                            self._set_edge_weight(edge[0], edge[1], 1e9)
                     
                     if onlyout:
-                        if (edge[1] in pathvertices) and (edge[1] not in exclusion_list) \
-                            and (edge[1] != end2) and (edge[1] != end1) and (edge[0] not in pathvertices):
-                            self.edges[edge]['weight'] = 1e9
+                        if (edge[1] in pathset) and (edge[1] not in exclusion_list) \
+                            and (edge[1] != end2) and (edge[1] != end1) and (edge[0] not in pathset):
+                            self._set_edge_weight(edge[0], edge[1], 1e9)
         print("")
                 
 
     
     def enforce_no_pipeline_diagonal_Xover(self):
         print("Enforcing no diagonal pipeline crossing...")
-        edges = [edge for edge in self.edges]
-
         for pathname in self.existingPath.keys():
             for nodepair in self.existingPath[pathname]:
                 if abs(nodepair[0] - nodepair[1]) == self.width+2:
                     lower_diag = min(nodepair) + 1
                     upper_diag = max(nodepair) - 1
                     
-                    if (lower_diag, upper_diag) in edges:
-                        self.edges[(lower_diag, upper_diag)]['weight'] = 1e9
-                    if (upper_diag, lower_diag) in edges:
-                        self.edges[(upper_diag, lower_diag)]['weight'] = 1e9
+                    if self._has_edge(lower_diag, upper_diag):
+                        self._set_edge_weight(lower_diag, upper_diag, 1e9)
+                    if self._has_edge(upper_diag, lower_diag):
+                        self._set_edge_weight(upper_diag, lower_diag, 1e9)
                     
                 elif abs(nodepair[0] - nodepair[1]) == self.width:
                     lower_diag = min(nodepair) - 1
                     upper_diag = max(nodepair) + 1
                     
-                    if (lower_diag, upper_diag) in edges:
-                        self.edges[(lower_diag, upper_diag)]['weight'] = 1e9
-                    if (upper_diag, lower_diag) in edges:
-                        self.edges[(upper_diag, lower_diag)]['weight'] = 1e9
+                    if self._has_edge(lower_diag, upper_diag):
+                        self._set_edge_weight(lower_diag, upper_diag, 1e9)
+                    if self._has_edge(upper_diag, lower_diag):
+                        self._set_edge_weight(upper_diag, lower_diag, 1e9)
         print('No pipeline diaginal crossing enforced')
         print("")
         return
     
     def enforce_no_path_diagonal_Xover(self, path_tup):
         print("Enforcing no diagonal path crossing...")
-        edges = [edge for edge in self.edges]
-
         for nodepair in path_tup:
             if abs(nodepair[0] - nodepair[1]) == self.width+2:
                 lower_diag = min(nodepair) + 1
                 upper_diag = max(nodepair) - 1
                     
-                if (lower_diag, upper_diag) in edges:
-                    self.edges[(lower_diag, upper_diag)]['weight'] = 1e9
-                if (upper_diag, lower_diag) in edges:
-                    self.edges[(upper_diag, lower_diag)]['weight'] = 1e9
+                if self._has_edge(lower_diag, upper_diag):
+                    self._set_edge_weight(lower_diag, upper_diag, 1e9)
+                if self._has_edge(upper_diag, lower_diag):
+                    self._set_edge_weight(upper_diag, lower_diag, 1e9)
                     
             elif abs(nodepair[0] - nodepair[1]) == self.width:
                 lower_diag = min(nodepair) - 1
                 upper_diag = max(nodepair) + 1
                     
-                if (lower_diag, upper_diag) in edges:
-                    self.edges[(lower_diag, upper_diag)]['weight'] = 1e9
-                if (upper_diag, lower_diag) in edges:
-                    self.edges[(upper_diag, lower_diag)]['weight'] = 1e9
+                if self._has_edge(lower_diag, upper_diag):
+                    self._set_edge_weight(lower_diag, upper_diag, 1e9)
+                if self._has_edge(upper_diag, lower_diag):
+                    self._set_edge_weight(upper_diag, lower_diag, 1e9)
         print('No pipeline diaginal crossing enforced')
         print("")
         return
@@ -505,26 +820,130 @@ class alternateNetworkGeo(DiGraph):
     def weight_func(self, distance, time):
         return distance * time
     
+    def get_shortest_route(self, source, destination):
+        #one search for the path, its summed weight and its summed length (km)
+        self._validate_route_memo()
+        route = self._memo_route((source, destination))
+        if route is not None:
+            return route
+        if self.routeCache is not None:
+            cached = self.routeCache.get(self._route_key(source, destination))
+            if cached is not None:
+                self.routeMemo[(source, destination)] = cached
+                return list(cached[0]), cached[1], cached[2]
+        self.routeReuse["recomputed"] += 1
+        weight, path = self._search_route(source, destination)
+        length = float(self.gt._getEdgeLengthArray(path[:-1], path[1:]).sum())
+        if self.routeCache is not None:
+            self.routeCache.put(self._route_key(source, destination), path, weight, length)
+        self.routeMemo[(source, destination)] = (list(path), weight, length)
+        return path, weight, length
+
+    def _search_route(self, source, destination):
+        #(weight, path) of one search, nothing is memoized, cached or counted
+        router = self._get_router()
+        if router is None:
+            return self.costStore.shortest_path(source, destination)
+        return router.shortest_path(source, destination)
+
+    def get_shortest_routes(self, pairs):
+        #(path, weight, length) of every (source, destination) pair, pairs sharing an endpoint share one search.
+        #Pairs still valid in the route memo or found in the route cache are not searched again
+        pairs = [(pair[0], pair[1]) for pair in pairs]
+        self._validate_route_memo()
+        routes = {}
+        for pair in pairs:
+            route = self._memo_route(pair)
+            if route is not None:
+                routes[pair] = route
+        if self.routeCache is not None:
+            for pair in pairs:
+                if pair in routes:
+                    continue
+                cached = self.routeCache.get(self._route_key(*pair))
+                if cached is not None:
+                    routes[pair] = cached
+        missing = [pair for pair in pairs if pair not in routes]
+        self.routeReuse["recomputed"] += len(set(missing))
+        router = self._get_router()
+        if router is None:
+            for pair in missing:
+                weight, path = self.costStore.shortest_path(*pair)
+                routes[pair] = (path, weight, float(self.gt._getEdgeLengthArray(path[:-1], path[1:]).sum()))
+        elif len(missing):
+            for pair, (weight, path) in router.shortest_paths(missing, workers=self.routingWorkers).items():
+                routes[pair] = (path, weight, float(self.gt._getEdgeLengthArray(path[:-1], path[1:]).sum()))
+        for pair in missing:
+            if self.routeCache is not None and pair in routes:
+                self.routeCache.put(self._route_key(*pair), *routes[pair])
+        if self.routeCache is not None:
+            self.routeCache.save()
+        for pair in pairs:
+            if pair not in self.routeMemo:
+                self.routeMemo[pair] = (list(routes[pair][0]), routes[pair][1], routes[pair][2])
+        return {pair: routes[pair] for pair in pairs}
+
     def get_shortest_path_and_length(self, source, destination):
         # slength = nx.shortest_path_length(self, source, destination, weight=lambda u, v, d: self.weight_func(d['weight'], d['length']))
         # spath = nx.shortest_path(self, source, destination, weight=lambda u, v, d: self.weight_func(d['weight'], d['length']))
-        slength = nx.shortest_path_length(self, source, destination, weight='weight')
-        spath = nx.shortest_path(self, source, destination, weight='weight')
-        return slength, spath
+        path, weight, _ = self.get_shortest_route(source, destination)
+        return weight, path
+
+    def _path_weight_and_length(self, path):
+        #summed weight and length of a sub path, edge weights are looked up without a search
+        router = self._get_router()
+        if router is None:
+            weights = np.array([self._edge_weight(path[i], path[i+1]) for i in range(len(path)-1)])
+        else:
+            weights = router.path_weights(path)
+        weight = float(np.cumsum(weights)[-1]) if len(weights) else 0
+        length = float(self.gt._getEdgeLengthArray(path[:-1], path[1:]).sum())
+        return weight, length
+
+    def _set_spath(self, key, path, weight, length, cost=None):
+        #cost is the arc cost used by the model, it defaults to the path weight
+        self.spaths[key] = path
+        self.spathsCost[key] = weight if cost is None else cost
+        self.spathsWeight[key] = weight
+        self.spathsLength[key] = length
+
+    def _del_spath(self, key):
+        for paths in (self.spaths, self.spathsCost, self.spathsWeight, self.spathsLength):
+            if key in paths:
+                del paths[key]
     
-    def get_all_source_sink_shortest_paths(self):
+    def get_all_source_sink_shortest_paths(self, report_gap=False):
+        #report_gap: also route the lines exactly and print the cost gap of the routing method
         print('Generating all Delaunay pair shortest path...')
         self.lines = self.D.getDelaunayNetwork()
+        routes = self.get_shortest_routes(self.lines)
         for line in self.lines:
-            cost, path = self.get_shortest_path_and_length(line[0], line[1])
-            self.spathsCost[(line[0], line[1])] = cost
-            self.spaths[(line[0], line[1])] = path
+            path, weight, length = routes[(line[0], line[1])]
+            self._set_spath((line[0], line[1]), path, weight, length)
             self.initial_pipe_spaths[(line[0], line[1])] = path
             
             path_tup = [(path[i], path[i+1]) for i in range(len(path)-1)]
             # self.enforce_no_path_diagonal_Xover(path_tup)
         
         self._generate_assetsPT()
+        stats = self.get_routing_stats()
+        if len(stats):
+            print("%s routing: %s routes in %s searches, %s nodes settled, %s seconds" %(self.routing,
+                  sum(stat["pairs"] for stat in stats), len(stats), sum(stat["settled"] for stat in stats),
+                  sum(stat["seconds"] for stat in stats)))
+            widened = [stat["expansions"] for stat in stats if stat.get("expansions")]
+            if self.routing in ('corridor', 'pyramid'):
+                print("%s widened for %s of %s queries, %s expansions" %(self.routing, len(widened), len(stats), sum(widened)))
+        if self.routeCache is not None:
+            print("Route cache: %s hits, %s misses" %(self.routeCache.hits, self.routeCache.misses))
+        if self.routeReuse["reused"] or self.routeReuse["invalidated"]:
+            print("Incremental routing: %s reused, %s recomputed, %s invalidated" %(self.routeReuse["reused"],
+                  self.routeReuse["recomputed"], self.routeReuse["invalidated"]))
+        if report_gap:
+            self.routingGap = self.get_routing_gap(self.lines)
+            gap = list(self.routingGap.values())
+            if len(gap):
+                print("Cost gap against exact routing: mean %s, max %s" %(float(np.mean(gap)), float(np.max(gap))))
         print('Done generating shortest paths.')
         print("")
             
@@ -558,22 +977,12 @@ class alternateNetworkGeo(DiGraph):
         
         #plot the shortest paths between nodes
         for key in self.spaths.keys():
-            xs = []
-            ys = []
-            for pt in self.spaths[key]:
-                xy = self.gt._cellToXY(pt)
-                xs.append(xy[0])
-                ys.append(xy[1])
+            xs, ys = self.gt._cellToXYArray(self.spaths[key])
             plt.plot(xs, ys, label=f"path between {self.assetNameFromPT[key[0]]} and {self.assetNameFromPT[key[1]]}", lw = 5)
         
         #plot all existing pipelines
         for key in self.existingPathVertices.keys():
-            xp = []
-            yp = []
-            for pt in self.existingPathVertices[key]:
-                xy = self.gt._cellToXY(pt)
-                xp.append(xy[0])
-                yp.append(xy[1])
+            xp, yp = self.gt._cellToXYArray(self.existingPathVertices[key])
             plt.plot(xp, yp, 'red', lw=6, alpha=0.5)
         
         
@@ -606,63 +1015,55 @@ class alternateNetworkGeo(DiGraph):
         existingPathVertices = self.existingPathVertices.copy()       
         spaths = self.spaths.copy()
         
+        #one walk per path finds its first stretch on every pipeline it touches through the cell -> pipelines
+        #index, trans_nodes[(pathname, nodepair)] = [entry cell, exit cell]
         trans_nodes = {}
+        for nodepair, path in spaths.items():
+            active = []
+            for i, cell in enumerate(path):
+                for pathname in active[:]:
+                    if cell not in self.existingPathVertexSets[pathname]:
+                        trans_nodes[(pathname, nodepair)].append(path[i-1])
+                        active.remove(pathname)
+                for pathname in self.pipelineCells.get(cell, ()):
+                    if (pathname, nodepair) not in trans_nodes:
+                        trans_nodes[(pathname, nodepair)] = [cell]
+                        active.append(pathname)
+            for pathname in active:
+                trans_nodes[(pathname, nodepair)].append(path[-1])
+
+        #same order as a pipeline by pipeline pass over the paths
+        pipelineOrder = {pathname: i for i, pathname in enumerate(existingPathVertices)}
+        pathOrder = {nodepair: i for i, nodepair in enumerate(spaths)}
         conn_to_del = []
-        for pathname in existingPathVertices.keys():
-            for nodepair in spaths.keys():
-                entry = False
-                start = self.spaths[nodepair][0]
-                end = self.spaths[nodepair][-1]
-                for i in range(len(spaths[nodepair])):
-                    if (entry == False) and (spaths[nodepair][i] in existingPathVertices[pathname]):
-                        entry = True
-                        trans_nodes[(pathname, nodepair)] = [spaths[nodepair][i]]
-                    if (entry == True) and (spaths[nodepair][i] not in existingPathVertices[pathname]):
-                        trans_nodes[(pathname, nodepair)].append(spaths[nodepair][i-1])
-                        break
-                
-                if (entry == True) and (len(trans_nodes[(pathname, nodepair)]) == 1):
-                    trans_nodes[(pathname, nodepair)].append(spaths[nodepair][-1])
-                
-                if entry == True:
-                    node1 = trans_nodes[(pathname, nodepair)][0]
-                    node2 = trans_nodes[(pathname, nodepair)][1]
-                    idx1 = spaths[nodepair].index(node1)
-                    idx2 = spaths[nodepair].index(node2)
-                    
-                    self._generate_assetsPT()
-                                    
+        for pathname, nodepair in sorted(trans_nodes, key=lambda key: (pipelineOrder[key[0]], pathOrder[key[1]])):
+            start = self.spaths[nodepair][0]
+            end = self.spaths[nodepair][-1]
+            node1 = trans_nodes[(pathname, nodepair)][0]
+            node2 = trans_nodes[(pathname, nodepair)][1]
+            idx1 = spaths[nodepair].index(node1)
+            idx2 = spaths[nodepair].index(node2)
+            
+            self._generate_assetsPT()
+                            
  
-                    self.spaths[(node1, node2)] = self.spaths[nodepair][idx1:idx2+1]
-                    self.spaths[(start, node1)] = self.spaths[nodepair][0:idx1+1]
-                    self.spaths[(node2, end)] = self.spaths[nodepair][idx2:]
-                    
-                    
-                    cost_1 = 0
-                    cost_2 = 0
-                    for i in range(len(self.spaths[(start, node1)])-1):
-                        cost_1 += self.edges[self.spaths[(start, node1)][i], self.spaths[(start, node1)][i+1]]['weight']
-                    for i in range(len(self.spaths[(node2, end)])-1):
-                        cost_2 += self.edges[self.spaths[(node2, end)][i], self.spaths[((node2, end))][i+1]]['weight']
-                    
-                    
-                    self.spathsCost[(node1, node2)] = 0
-                    self.spathsCost[(start, node1)] = cost_1
-                    self.spathsCost[(node2, end)] = cost_2
-                    
-                    
-                    
-                    from_name = self.assetNameFromPT[nodepair[0]]
-                    to_name = self.assetNameFromPT[nodepair[1]]
-                    
-                    self.assetsXY[pathname + f" from {from_name} to {to_name} node1"] = self.gt._cellToXY(node1)
-                    self.assetsXY[pathname + f" from {from_name} to {to_name} node2"] = self.gt._cellToXY(node2)
-                    
-                    conn_to_del.append((start, end))
+            path = self.spaths[nodepair]
+            self._set_spath((node1, node2), path[idx1:idx2+1], *self._path_weight_and_length(path[idx1:idx2+1]), cost=0)
+            self._set_spath((start, node1), path[0:idx1+1], *self._path_weight_and_length(path[0:idx1+1]))
+            self._set_spath((node2, end), path[idx2:], *self._path_weight_and_length(path[idx2:]))
+            
+            
+            
+            from_name = self.assetNameFromPT[nodepair[0]]
+            to_name = self.assetNameFromPT[nodepair[1]]
+            
+            self.assetsXY[pathname + f" from {from_name} to {to_name} node1"] = self.gt._cellToXY(node1)
+            self.assetsXY[pathname + f" from {from_name} to {to_name} node2"] = self.gt._cellToXY(node2)
+            
+            conn_to_del.append((start, end))
         
         for conn in conn_to_del:            
-            del self.spaths[conn]
-            del self.spathsCost[conn]
+            self._del_spath(conn)
                         
         print('Pipeline Transshipment Nodes generated.')
         print('')            
@@ -673,11 +1074,14 @@ class alternateNetworkGeo(DiGraph):
         print("Post processing Pipeline Paths...")
         self._generate_assetsPT() 
         
+        #assets on each pipeline from the cell -> pipelines index
+        assets_on_pipe = {}
+        for key in self.assetNameFromPT.keys():
+            for pathname in self.pipelineCells.get(key, ()):
+                assets_on_pipe.setdefault(pathname, []).append((key, self.existingPathVertices[pathname].index(key)))
+
         for pathname in self.existingPath.keys():
-            nodes_on_pipe = []
-            for key in self.assetNameFromPT.keys():
-                if key in self.existingPathVertices[pathname]:
-                    nodes_on_pipe.append((key, self.existingPathVertices[pathname].index(key)))
+            nodes_on_pipe = assets_on_pipe.get(pathname, [])
             nodes_on_pipe = list(set(nodes_on_pipe))
             nodes_on_pipe.sort(key=lambda x: x[1])
             nodes_on_pipe = [i for (i, j) in nodes_on_pipe]
@@ -694,17 +1098,13 @@ class alternateNetworkGeo(DiGraph):
             
             #remove redundant edges
             for edge in edges_to_remove:
-                if edge in self.spaths.keys():
-                    del self.spaths[edge]
-                if edge in self.spathsCost.keys():
-                    del self.spathsCost[edge]
+                self._del_spath(edge)
             
             
             #add edges with cost
+            routes = self.get_shortest_routes(joints)
             for edge in joints:
-                slength, spath = self.get_shortest_path_and_length(edge[0], edge[1])
-                self.spaths[edge] = spath
-                self.spathsCost[edge] = slength
+                self._set_spath(edge, *routes[edge])
                 
         self._generate_assetsPT()
         print("Pipeline post process complete.")
@@ -757,28 +1157,16 @@ class alternateNetworkGeo(DiGraph):
                 
 
                         if start != node1: #if the start node and the entry point are not the same
-                            self.spaths[(start, node1)] = self.spaths[nodepair][0:idx1+1] #add new spath such from start to entry
-                            cost_1 = 0
-                            for i in range(len(self.spaths[(start, node1)])-1): #generate cost from start to entry
-                                cost_1 += \
-                                self.edges[self.spaths[(start, node1)][i], self.spaths[(start, node1)][i+1]]['weight']
-                            self.spathsCost[(start, node1)] = cost_1 #add spath costs for the path from start to entry
+                            path = self.spaths[nodepair][0:idx1+1] #add new spath such from start to entry
+                            self._set_spath((start, node1), path, *self._path_weight_and_length(path))
                         
                         if node1 != node2: #Redundant IF, node1 cannot be node2 (i.e. entry=exit) as it has already been checked above however codeblock is relevant
-                            self.spaths[(node1, node2)] = self.spaths[nodepair][idx1:idx2+1] #add new path from entry to exit
-                            cost_2 = 0
-                            for i in range(len(self.spaths[(node1, node2)])-1):#generate cost of path from entry to exit
-                                cost_2 += \
-                                self.edges[self.spaths[(node1, node2)][i], self.spaths[((node1, node2))][i+1]]['weight']
-                            self.spathsCost[(node1, node2)] = cost_2 #add path costs from entry to exit
+                            path = self.spaths[nodepair][idx1:idx2+1] #add new path from entry to exit
+                            self._set_spath((node1, node2), path, *self._path_weight_and_length(path))
                         
                         if node2 != end:
-                            self.spaths[(node2, end)] = self.spaths[nodepair][idx2:]#add new path from exit to end of original path
-                            cost_3 = 0
-                            for i in range(len(self.spaths[(node2, end)])-1): #generat cost of path from exit to end
-                                cost_3 += \
-                                self.edges[self.spaths[(node2, end)][i], self.spaths[((node2, end))][i+1]]['weight']
-                            self.spathsCost[(node2, end)] = cost_3 #add new cost to spaths
+                            path = self.spaths[nodepair][idx2:] #add new path from exit to end of original path
+                            self._set_spath((node2, end), path, *self._path_weight_and_length(path))
                         
                         from_name = self.assetNameFromPT[nodepair[0]] #get asset name of the start point in the shortest path for nodepair under this loop
                         to_name = self.assetNameFromPT[nodepair[1]] #get asset name of the end point in the shortest path for nodepair under this loop
@@ -808,8 +1196,7 @@ class alternateNetworkGeo(DiGraph):
 
         
         for conn in list(set(conn_to_del)):            
-            del self.spaths[conn]
-            del self.spathsCost[conn]
+            self._del_spath(conn)
                         
         print('pipe transshipment nodes generated.')
         print('')                
@@ -844,17 +1231,13 @@ class alternateNetworkGeo(DiGraph):
             
             #remove redundant edges
             for edge in edges_to_remove:
-                if edge in self.spaths.keys():
-                    del self.spaths[edge]
-                if edge in self.spathsCost.keys():
-                    del self.spathsCost[edge]
+                self._del_spath(edge)
             
             
             #add edges with cost
+            routes = self.get_shortest_routes(joints)
             for edge in joints:
-                slength, spath = self.get_shortest_path_and_length(edge[0], edge[1])
-                self.spaths[edge] = spath
-                self.spathsCost[edge] = slength
+                self._set_spath(edge, *routes[edge])
                 
         self._generate_assetsPT()
         print('path transhipment nodes processing done.')
@@ -894,16 +1277,9 @@ class alternateNetworkGeo(DiGraph):
                 
         self.spaths = spaths.copy()
         self.spathsCost = spathsCost.copy()
-
-        for key in spaths.keys():
-            t_length = 0
-            t_weight = 0
-            for i in range(len(spaths[key]) - 1):
-                nodelist = spaths[key]
-                t_weight += self.edges[(nodelist[i], nodelist[i+1])]['weight']
-                t_length += self.edges[(nodelist[i], nodelist[i+1])]['length']
-            self.spathsWeight[key] = t_weight
-            self.spathsLength[key] = t_length
+        #weights and lengths were recorded with each path, only the dropped reverse paths go
+        self.spathsWeight = {key: self.spathsWeight[key] for key in spaths.keys()}
+        self.spathsLength = {key: self.spathsLength[key] for key in spaths.keys()}
         
         print('shortest paths post processing completed.')
         print('')
@@ -916,10 +1292,9 @@ class alternateNetworkGeo(DiGraph):
                 "Lon": [],
                 "Type": []}
 
-        for key in self.assetsXY.keys():
-            x = self.assetsXY[key][0]
-            y = self.assetsXY[key][1]
-            lat, lon = self.gt._xyToLatLon(x, y)
+        xy = np.array([self.assetsXY[key][:2] for key in self.assetsXY.keys()]).reshape(-1, 2)
+        lats, lons = self.gt._xyToLatLonArray(xy[:, 0], xy[:, 1])
+        for key, lat, lon in zip(self.assetsXY.keys(), lats.tolist(), lons.tolist()):
             assets_df["Name"].append(key)
             assets_df["Lat"].append(lat)
             assets_df["Lon"].append(lon)
@@ -938,11 +1313,10 @@ class alternateNetworkGeo(DiGraph):
                         "Lon": []}
 
         for key in self.spaths.keys():
-            for pt in self.spaths[key]:
-                lat, lon = self.gt._cellToLatLon(pt)
-                pipelines_df["Name"].append(key)
-                pipelines_df["Lat"].append(lat)
-                pipelines_df["Lon"].append(lon)
+            lats, lons = self.gt._cellToLatLonArray(self.spaths[key])
+            pipelines_df["Name"] += [key] * len(lats)
+            pipelines_df["Lat"] += lats.tolist()
+            pipelines_df["Lon"] += lons.tolist()
 
         self.pipelines_df = pd.DataFrame(pipelines_df)
 
@@ -954,11 +1328,10 @@ class alternateNetworkGeo(DiGraph):
                         "Lon": []}
         
         for key in self.existingPathVertices.keys():
-            for pt in self.existingPathVertices[key]:
-                lat, lon = self.gt._cellToLatLon(pt)
-                existing_path_df["Name"].append(key)
-                existing_path_df["Lat"].append(lat)
-                existing_path_df["Lon"].append(lon)
+            lats, lons = self.gt._cellToLatLonArray(self.existingPathVertices[key])
+            existing_path_df["Name"] += [key] * len(lats)
+            existing_path_df["Lat"] += lats.tolist()
+            existing_path_df["Lon"] += lons.tolist()
 
         self.existing_path_df = pd.DataFrame(existing_path_df)
         
@@ -1115,13 +1488,10 @@ class alternateNetworkGeo(DiGraph):
         resultdict2 = {}
         for solnkey in solnkeys:
             path = self.spaths[(solnkey[0], solnkey[1])]
-            path_geo = []
-            length_act = 0
-            for i in range(len(path)-1):
-                lat1, lon1 = self.gt._cellToLatLon(path[i])
-                lat2, lon2 = self.gt._cellToLatLon(path[i+1])
-                path_geo.append(((lat1, lon1), (lat2, lon2)))
-                length_act += self.gt._getDistance(path[i], path[i+1])
+            lats, lons = self.gt._cellToLatLonArray(path)
+            points = list(zip(lats.tolist(), lons.tolist()))
+            path_geo = list(zip(points[:-1], points[1:]))
+            length_act = float(self.gt._getPathDistances(path).sum())
             length1 = self.spathsLength[(solnkey[0], solnkey[1])]
             length = length_act
             if solnkey[2] == 'n':
@@ -1141,7 +1511,9 @@ class alternateNetworkGeo(DiGraph):
         pipe_idx = 1
         for key,value in self.assetNameFromPT.items():
             for pipeline in self.existingPath.keys():
-                if pipeline in value:
+                #transshipment nodes are named "<pipeline> from <asset> to <asset> node1|2", an exact prefix
+                #keeps "Line-1" from claiming the nodes of "Line-10" or "Line-1-2"
+                if value.startswith(pipeline + " from "):
                     self.nodesdict[key] = f'{pipeline}_TS'+str(pipe_idx)
                     nodenames.append(f'{pipeline}_TS'+str(pipe_idx))
                     pipe_idx+=1
@@ -0,0 +1,146 @@
+import numpy as np
+from costTiles import cellCostStore
+from geotransformation import NEIGHBOR_OFFSETS, windowLocalIndex
+
+
+COMPACT_DTYPES = ('float32', 'uint16')
+UINT16_MISSING = np.iinfo(np.uint16).max #code reserved for a missing edge, costs use 0..65534
+FORWARD_SLOTS = [4, 5, 6, 7] #(0,1), (1,-1), (1,0), (1,1), the reverse of slot k is slot 7-k
+
+
+class compactCostStore(cellCostStore):
+    """Resident cost surface of the subset window with each undirected 8-neighbour edge stored once.
+
+    Every window cell owns the 4 edges towards its east, south-west, south and south-east
+    neighbours, kept as float32 or as uint16 codes with a linear scale and offset. Directed
+    edges whose cost differs from the shared value (asymmetric or one way edges) go to a sorted
+    side table of exact float32 costs.
+
+    Maximum relative error of a stored cost:
+        float32: 2**-24 (~6e-8)
+        uint16:  scale / 2 / cost, at most (max - min) / (2 * 65534 * min) for the cheapest edge
+    The error measured on the loaded surface is kept in maxRelativeError.
+    About 16 (float32) or 8 (uint16) bytes per cell plus 12 per side table entry, against 192 for
+    the int64/int64/float64 edge arrays of an interior cell.
+    """
+    def __init__(self, gt, dtype='float32'):
+        if dtype not in COMPACT_DTYPES:
+            raise ValueError("compact dtype must be one of %s, got %s" %(COMPACT_DTYPES, dtype))
+        super().__init__(gt.gridWidth, gt.gridHeight)
+        self.dtype = dtype
+        self.rowMin = gt.rowMin
+        self.colMin = gt.colMin
+        self.windowWidth = gt.windowWidth
+        self.windowHeight = gt.windowHeight
+        self.windowCellMask = gt.windowCellMask
+        self.scale = 1.0
+        self.offset = 0.0
+        self._encode(gt, *gt.getEdgeArrays())
+        for array in (self.costs, self.sideKeys, self.sideValues):
+            array.flags.writeable = False
+
+    def _localIndex(self, rows, cols):
+        return windowLocalIndex(rows, cols, self.rowMin, self.colMin, self.windowHeight, self.windowWidth, self.windowCellMask)
+
+    def _encode(self, gt, src, dst, cost):
+        nLocal = self.windowWidth * self.windowHeight
+        srcRow, srcCol = gt._cellToRowCol(src)
+        dstRow, dstCol = gt._cellToRowCol(dst)
+        slot = gt._edgeSlots(src, dst)
+        srcLocal = self._localIndex(srcRow, srcCol)
+        dstLocal = self._localIndex(dstRow, dstCol)
+        keep = (slot >= 0) & (srcLocal >= 0) & (dstLocal >= 0)
+        slot, srcLocal, dstLocal, cost = slot[keep], srcLocal[keep], dstLocal[keep], cost[keep]
+
+        #the owner of an edge is its end in the north-west, a forward edge is stored by its source
+        forward = slot >= 4
+        owner = np.where(forward, srcLocal, dstLocal)
+        column = np.where(forward, slot - 4, 3 - slot)
+        shared = np.full((nLocal, 4), np.nan)
+        shared[owner[~forward], column[~forward]] = cost[~forward]
+        shared[owner[forward], column[forward]] = cost[forward]
+        present = ~np.isnan(shared)
+
+        if self.dtype == 'float32':
+            self.costs = shared.astype(np.float32)
+        else:
+            low = float(shared[present].min()) if present.any() else 0.0
+            high = float(shared[present].max()) if present.any() else 0.0
+            self.offset = low
+            self.scale = (high - low) / (UINT16_MISSING - 1) if high > low else 1.0
+            codes = np.full(shared.shape, UINT16_MISSING, dtype=np.uint16)
+            codes[present] = np.rint((shared[present] - low) / self.scale).astype(np.uint16)
+            self.costs = codes
+
+        #directed edges that do not match the exact shared value, plus the missing reverse of one way edges
+        differs = cost != shared[owner, column]
+        reverseMissing = np.ones((nLocal, 4), dtype=bool)
+        reverseMissing[owner[~forward], column[~forward]] = False
+        forwardMissing = np.ones((nLocal, 4), dtype=bool)
+        forwardMissing[owner[forward], column[forward]] = False
+        oneWayOwner, oneWayColumn = np.nonzero(present & (reverseMissing | forwardMissing))
+        missingForward = forwardMissing[oneWayOwner, oneWayColumn]
+        neighbourLocal = self._neighbourLocal(oneWayOwner, oneWayColumn + 4)
+        missingKeys = np.where(missingForward, oneWayOwner * 8 + oneWayColumn + 4, neighbourLocal * 8 + 3 - oneWayColumn)
+
+        keys = np.concatenate((srcLocal[differs] * 8 + slot[differs], missingKeys))
+        values = np.concatenate((cost[differs], np.full(len(missingKeys), np.inf)))
+        order = np.argsort(keys, kind='stable')
+        self.sideKeys = keys[order]
+        self.sideValues = values[order].astype(np.float32)
+
+        decoded = self._decode(self.costs[owner, column])
+        exact = np.where(differs, cost.astype(np.float32), decoded)
+        nonzero = cost != 0
+        self.maxRelativeError = float(np.max(np.abs(exact[nonzero] - cost[nonzero]) / np.abs(cost[nonzero]))) \
+            if nonzero.any() else 0.0
+
+    def _neighbourLocal(self, local, slots):
+        dr = np.array([offset[0] for offset in NEIGHBOR_OFFSETS])[slots]
+        dc = np.array([offset[1] for offset in NEIGHBOR_OFFSETS])[slots]
+        row, col = np.divmod(local, self.windowWidth)
+        return self._localIndex(row + dr + self.rowMin, col + dc + self.colMin)
+
+    def _decode(self, values):
+        if self.dtype == 'float32':
+            return np.where(np.isnan(values), np.inf, values.astype(np.float64))
+        return np.where(values == UINT16_MISSING, np.inf, self.offset + values.astype(np.float64) * self.scale)
+
+    def nbytes(self):
+        return self.costs.nbytes + self.sideKeys.nbytes + self.sideValues.nbytes
+
+    def _decodeAll(self):
+        #(nLocal, 8) outgoing costs of every window cell, the array form of _cellCosts
+        costs = np.full((self.windowWidth * self.windowHeight, 8), np.inf)
+        costs[:, FORWARD_SLOTS] = self._decode(self.costs)
+        local = np.arange(len(costs))
+        for slot in range(4):
+            neighbour = self._neighbourLocal(local, np.full(len(local), slot))
+            inside = neighbour >= 0
+            costs[inside, slot] = self._decode(self.costs[neighbour[inside], 3 - slot])
+        costs.reshape(-1)[self.sideKeys] = self.sideValues
+        return costs
+
+    def _baseEdgeArrays(self):
+        costs = self._decodeAll()
+        local, slots = np.nonzero(np.isfinite(costs))
+        row, col = np.divmod(local, self.windowWidth)
+        src = (row + self.rowMin) * self.gridWidth + (col + self.colMin) + 1
+        return src, src + np.array(self.cellOffsets)[slots], costs[local, slots]
+
+    def _cellCosts(self, cell):
+        row, col = divmod(cell - 1, self.gridWidth)
+        local = int(self._localIndex(np.int64(row), np.int64(col)))
+        if local < 0:
+            return None
+        costs = np.full(8, np.inf)
+        costs[FORWARD_SLOTS] = self._decode(self.costs[local])
+        for slot in range(4):
+            dr, dc = NEIGHBOR_OFFSETS[slot]
+            neighbour = int(self._localIndex(np.int64(row + dr), np.int64(col + dc)))
+            if neighbour >= 0:
+                costs[slot] = self._decode(self.costs[neighbour, 3 - slot])
+
+        lo, hi = np.searchsorted(self.sideKeys, [local * 8, local * 8 + 8])
+        costs[self.sideKeys[lo:hi] - local * 8] = self.sideValues[lo:hi]
+        return costs
@@ -0,0 +1,213 @@
+import copy
+import json
+import numpy as np
+import networkx as nx
+from abc import ABC, abstractmethod
+from heapq import heappush, heappop
+from collections import OrderedDict
+from pathlib import Path
+from geotransformation import NEIGHBOR_OFFSETS
+
+
+DEFAULT_MAX_TILES = 64 #resident tiles kept by the LRU, 64 tiles of 512x512 float64 costs ~ 1 GB
+
+
+class cellCostStore(ABC):
+    """Graph view over 8-neighbour cell costs that are not held in networkx. Subclasses provide
+    _cellCosts(cell), the 8 outgoing slot costs of a cell in NEIGHBOR_OFFSETS order with inf for
+    missing edges. The stored costs are never written, weight overrides (pipelines, tie-in blocks)
+    are kept in memory on top, so one store can back several scenarios through scenario()."""
+    def __init__(self, gridWidth, gridHeight):
+        self.gridWidth = gridWidth
+        self.gridHeight = gridHeight
+        self.overrides = {}
+        self.extraEdges = {}
+        self.extraSources = {} #reverse index of extraEdges, target -> sources
+        self.cellOffsets = [dr*self.gridWidth + dc for (dr, dc) in NEIGHBOR_OFFSETS]
+        self.slotFromOffset = {offset: slot for slot, offset in enumerate(self.cellOffsets)}
+
+    @abstractmethod
+    def _cellCosts(self, cell):
+        #the 8 outgoing slot costs of a cell, None when the store holds no edges for it
+        pass
+
+    @abstractmethod
+    def _baseEdgeArrays(self):
+        #(src, dst, cost) of every stored 8-neighbour edge, without the overrides
+        pass
+
+    def edge_arrays(self):
+        #all directed edges as (src, dst, weight) arrays, overrides and extra edges come after
+        #the stored edges so a consumer that keeps the last weight per edge sees the current one
+        src, dst, weight = self._baseEdgeArrays()
+        extraSrc, extraDst, extraWeight = self.override_arrays()
+        if not len(extraSrc):
+            return src, dst, weight
+        return np.concatenate((src, extraSrc)), np.concatenate((dst, extraDst)), np.concatenate((weight, extraWeight))
+
+    def override_arrays(self):
+        #(src, dst, weight) arrays of the overrides and extra edges of this view only
+        extra = [(u, v, w) for (u, v), w in self.overrides.items()]
+        extra += [(u, v, w) for u, targets in self.extraEdges.items() for v, w in targets.items()]
+        extra = np.array(extra, dtype=np.float64).reshape(-1, 3)
+        return extra[:, 0].astype(np.int64), extra[:, 1].astype(np.int64), extra[:, 2]
+
+    def _slotCost(self, u, v):
+        slot = self.slotFromOffset.get(v - u)
+        if slot is None:
+            return np.inf
+        costs = self._cellCosts(u)
+        if costs is None:
+            return np.inf
+        return float(costs[slot])
+
+    def has_edge(self, u, v):
+        return (v in self.extraEdges.get(u, {})) or np.isfinite(self._slotCost(u, v))
+
+    def get_weight(self, u, v):
+        if (u, v) in self.overrides:
+            return self.overrides[(u, v)]
+        if v in self.extraEdges.get(u, {}):
+            return self.extraEdges[u][v]
+        weight = self._slotCost(u, v)
+        if not np.isfinite(weight):
+            raise KeyError((u, v))
+        return weight
+
+    def set_weight(self, u, v, weight):
+        #edges outside the 8-neighbour raster (e.g. pipeline jumps) are kept as extra edges
+        if np.isfinite(self._slotCost(u, v)):
+            self.overrides[(u, v)] = weight
+        else:
+            self.extraEdges.setdefault(u, {})[v] = weight
+            self.extraSources.setdefault(v, set()).add(u)
+
+    def reset_weight(self, u, v):
+        #drop the override of an edge, back to the stored cost (or no edge)
+        self.overrides.pop((u, v), None)
+        targets = self.extraEdges.get(u)
+        if (targets is not None) and (v in targets):
+            del targets[v]
+            if not targets:
+                del self.extraEdges[u]
+            self.extraSources[v].discard(u)
+            if not self.extraSources[v]:
+                del self.extraSources[v]
+
+    def scenario(self):
+        #view sharing the stored costs (and resident tiles) with no overrides of its own
+        view = copy.copy(self)
+        view.overrides = {}
+        view.extraEdges = {}
+        view.extraSources = {}
+        return view
+
+    def out_edges(self, u):
+        costs = self._cellCosts(u)
+        if costs is not None:
+            for slot, offset in enumerate(self.cellOffsets):
+                if np.isfinite(costs[slot]):
+                    v = u + offset
+                    yield v, self.overrides.get((u, v), float(costs[slot]))
+        for v, weight in self.extraEdges.get(u, {}).items():
+            yield v, weight
+
+    def in_edges(self, v):
+        for offset in self.cellOffsets:
+            u = v - offset
+            if self.has_edge(u, v):
+                yield u, self.get_weight(u, v)
+        for u in self.extraSources.get(v, ()):
+            if v - u not in self.slotFromOffset:
+                yield u, self.extraEdges[u][v]
+
+    def edges_touching(self, vertices):
+        edges = set()
+        for vertex in set(vertices):
+            edges.update((vertex, v) for v, _ in self.out_edges(vertex))
+            edges.update((u, vertex) for u, _ in self.in_edges(vertex))
+        return edges
+
+    def shortest_path(self, source, target):
+        #plain Dijkstra, tiles are pulled in as the frontier reaches them
+        dist = {source: 0.0}
+        pred = {source: None}
+        settled = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u == target:
+                break
+            for v, weight in self.out_edges(u):
+                nd = d + weight
+                if nd < dist.get(v, np.inf):
+                    dist[v] = nd
+                    pred[v] = u
+                    heappush(heap, (nd, v))
+
+        if target not in settled:
+            raise nx.NetworkXNoPath("No path between %s and %s." %(source, target))
+        path = [target]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return dist[target], path
+
+
+class costTileStore(cellCostStore):
+    """Out-of-core view of a tiled cost surface written by geoTransformation._buildCostTiles.
+    Tiles are loaded the first time the search touches them and evicted least recently used
+    once more than maxTiles are resident."""
+    def __init__(self, tilePath, maxTiles=DEFAULT_MAX_TILES):
+        self.tilePath = Path(tilePath)
+        self.maxTiles = maxTiles
+        self.tiles = OrderedDict()
+        self.tileLoads = 0
+
+        with open(self.tilePath.joinpath("index.json"), 'r') as read_obj:
+            index = json.load(read_obj)
+        super().__init__(index["gridWidth"], index["gridHeight"])
+        self.tileSize = index["tileSize"]
+        self.available = set(tuple(tile) for tile in index["tiles"])
+
+    def _getTile(self, tileRow, tileCol):
+        key = (tileRow, tileCol)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if key not in self.available:
+            return None
+
+        tile = np.load(self.tilePath.joinpath("tile_%s_%s.npy" %(tileRow, tileCol)))
+        tile.flags.writeable = False
+        self.tiles[key] = tile
+        self.tileLoads += 1
+        if len(self.tiles) > self.maxTiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def _cellCosts(self, cell):
+        #the 8 outgoing slot costs of a cell, None when its tile holds no edges
+        row, col = divmod(cell - 1, self.gridWidth)
+        if (row < 0) or (row >= self.gridHeight):
+            return None
+        tile = self._getTile(row // self.tileSize, col // self.tileSize)
+        if tile is None:
+            return None
+        return tile[row % self.tileSize, col % self.tileSize]
+
+    def _baseEdgeArrays(self):
+        #tiles are read straight from disk, one at a time, so the resident LRU is left as it is
+        offsets = np.array(self.cellOffsets)
+        src, dst, cost = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+        for tileRow, tileCol in sorted(self.available):
+            tile = np.load(self.tilePath.joinpath("tile_%s_%s.npy" %(tileRow, tileCol)))
+            rows, cols, slots = np.nonzero(np.isfinite(tile))
+            cells = (rows + tileRow*self.tileSize) * self.gridWidth + (cols + tileCol*self.tileSize) + 1
+            src.append(cells)
+            dst.append(cells + offsets[slots])
+            cost.append(tile[rows, cols, slots])
+        return np.concatenate(src), np.concatenate(dst), np.concatenate(cost)
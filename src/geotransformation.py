@@ -2,27 +2,147 @@ import pandas as pd
 import numpy as np
 from csv import reader
 import time
+import os
+import json
+import shutil
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+from multiprocessing import shared_memory, resource_tracker
 from geopy.point import Point
 from geopy.distance import distance
-from bisect import bisect_left, bisect_right
+from scipy.spatial import ConvexHull, Delaunay, cKDTree
 from pathlib import Path
 
 ROOT_PATH = Path(__file__).parent.parent.resolve()
 # FILE_PATH = ROOT_PATH.joinpath("Construction Costs.csv")
 FILE_PATH = ROOT_PATH.joinpath("construction-costs-subset.csv")
+CACHE_VERSION = 1
+COST_BLOCK_SIZE = 1 << 26 #bytes read per block when parsing the cost file
+POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+EARTH_RADIUS_KM = 6371.0088
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+KM_PER_DEG_LAT = 111.32
+DEFAULT_TILE_SIZE = 512 #cells per side of a cost surface tile
+DEFAULT_PYRAMID_FACTORS = (16, 4) #coarse levels of the cost pyramid, cells per side of a coarse cell
+PYRAMID_BAND_BLOCKS = 64 #coarse rows aggregated per pass over the cached surface
+NEIGHBOR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)] #(row, col) of the 8 edge slots
+REGION_BUFFER_FACTOR = 1.0 #default region buffer as a multiple of the mean nearest asset spacing
+MIN_REGION_BUFFER_KM = 10.0
+MIN_RANGE_SIZE = 1 << 22 #smallest byte range handed to an ingest worker
+RANGES_PER_WORKER = 4
 
 
+def haversine(lat1, lon1, lat2, lon2):
+    #great circle distance in km, works element wise on arrays
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def windowLocalIndex(rows, cols, rowMin, colMin, windowHeight, windowWidth, cellMask=None):
+    #dense 0-based row-major index of (row, col) in the window box, -1 outside it or outside the cellMask (hull) of the box
+    inside = (rows >= rowMin) & (rows < rowMin + windowHeight) & (cols >= colMin) & (cols < colMin + windowWidth)
+    local = np.where(inside, (rows - rowMin) * windowWidth + (cols - colMin), -1)
+    if cellMask is not None:
+        local = np.where(cellMask[np.maximum(local, 0)], local, -1)
+    return local
+
+
+def lambertDistance(lat1, lon1, lat2, lon2):
+    #Lambert's ellipsoidal correction of the great circle on WGS84, within ~10 m of the
+    #geodesic up to thousands of km and far below 0.1% on cell sized segments
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    dLon = np.radians(np.asarray(lon2, dtype=np.float64) - lon1)
+    h = np.sin((beta2 - beta1) / 2)**2 + np.cos(beta1) * np.cos(beta2) * np.sin(dLon / 2)**2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+    P = (beta1 + beta2) / 2
+    Q = (beta2 - beta1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        X = (sigma - np.sin(sigma)) * np.sin(P)**2 * np.cos(Q)**2 / np.cos(sigma / 2)**2
+        Y = (sigma + np.sin(sigma)) * np.cos(P)**2 * np.sin(Q)**2 / np.sin(sigma / 2)**2
+        dist = WGS84_A_KM * (sigma - WGS84_F / 2 * (X + Y))
+    return np.where(sigma > 0, dist, 0.0)
+
+
+def _sharedEdgeArrays(block, nEdges):
+    #src and dst as int64 followed by cost as float64 in one shared memory block
+    src = np.ndarray(nEdges, dtype=np.int64, buffer=block.buf)
+    dst = np.ndarray(nEdges, dtype=np.int64, buffer=block.buf, offset=8 * nEdges)
+    cost = np.ndarray(nEdges, dtype=np.float64, buffer=block.buf, offset=16 * nEdges)
+    return src, dst, cost
+
+
+def _parseCostRangeWorker(state, byteRange, subset, blockSize):
+    #runs in an ingest worker: parse one byte range and hand the edges back in a shared memory block
+    gt = geoTransformation()
+    gt.__dict__.update(state)
+    src, dst, cost = gt._parseCostRange(subset, blockSize, byteRange)
+    nEdges = len(src)
+    block = shared_memory.SharedMemory(create=True, size=max(nEdges * 24, 1))
+    sharedSrc, sharedDst, sharedCost = _sharedEdgeArrays(block, nEdges)
+    sharedSrc[:] = src
+    sharedDst[:] = dst
+    sharedCost[:] = cost
+    del sharedSrc, sharedDst, sharedCost
+    name = block.name
+    block.close()
+    #the parent unlinks the block once it has copied the edges, so this process must not track it
+    resource_tracker.unregister(block._name, "shared_memory")
+    return name, nEdges, gt.costListEnded
+
+
+def _rawToNpy(rawPath, npyPath, dtype, count):
+    #prepend the .npy header to a raw array file, copied in blocks so the array is never held in memory
+    with open(rawPath, 'rb') as raw, open(npyPath, 'wb') as out:
+        np.lib.format.write_array_header_1_0(out, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                   "fortran_order": False, "shape": (int(count),)})
+        shutil.copyfileobj(raw, out, COST_BLOCK_SIZE)
+    os.remove(rawPath)
+
+
+def _readSharedEdges(name, nEdges):
+    block = shared_memory.SharedMemory(name=name)
+    shared = _sharedEdgeArrays(block, nEdges)
+    src, dst, cost = [array.copy() for array in shared]
+    del shared
+    block.close()
+    block.unlink()
+    return src, dst, cost
+
+
+def _releaseSharedEdges(name):
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
 
 class geoTransformation:
     def __init__(self) -> None:
         self.costFilePath = FILE_PATH
+        self.cachePath = None
         self.gridcost = {}
+        self.edgeSrc = None
+        self.edgeDst = None
+        self.edgeCost = None
+        self.windowPending = False
         self.gridCostList = []
         self.gridTranslated = False
         self.north = 40.422261
         self.south = 33.615165
         self.east = -92.284113
         self.west = -103.665777
+        self.regionHull = None
+        self.windowCellMask = None
+        self.edgeLengthTable = None
+        self.cacheHeader = None
 
     def _loadgeogrid(self) -> None:
         with open(self.costFilePath, 'r') as read_obj:
@@ -40,26 +160,605 @@ class geoTransformation:
 
         self.gridVertices = [i for i in range(1, ((self.gridWidth*self.gridHeight) + 1))]
 
-                
+
+    def _getCachePath(self):
+        #binary cache lives next to the cost file, e.g. construction-costs-subset.cache/
+        if self.cachePath is None:
+            return Path(self.costFilePath).with_suffix(".cache")
+        return Path(self.cachePath)
+
+    def _hashCostFile(self):
+        sha1 = hashlib.sha1()
+        with open(self.costFilePath, 'rb') as read_obj:
+            for block in iter(lambda: read_obj.read(1 << 24), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def _sourceFingerprint(self, withHash=False):
+        stat = os.stat(self.costFilePath)
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if withHash:
+            fingerprint["sha1"] = self._hashCostFile()
+        return fingerprint
+
+    def _buildCostCache(self, workers=1):
+        """Convert the CostMAP csv into CSR arrays (indptr, indices, data) saved as .npy files.
+        Row i of the CSR holds the outgoing edges of cell i+1. The file lists the cells in order, so
+        every parsed block is appended to the arrays on disk as it comes and only the per cell edge
+        counts are held in memory. A file out of cell order is parsed a second time and every edge
+        written to the next free slot of its row."""
+        cachePath = self._getCachePath()
+        fingerprint = self._sourceFingerprint(withHash=True)
+        self._loadgeogrid()
+        nCells = self.gridWidth * self.gridHeight
+
+        #write into a temporary folder first so an interrupted build never leaves a half written cache
+        tmpPath = cachePath.with_name(cachePath.name + ".tmp")
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        tmpPath.mkdir(parents=True)
+
+        counts = np.zeros(nCells, dtype=np.int64)
+        nEdges = 0
+        ordered = True
+        lastSrc = 0
+        with open(tmpPath.joinpath("indices.raw"), 'wb') as indicesRaw, open(tmpPath.joinpath("data.raw"), 'wb') as dataRaw:
+            for src, dst, cost in self._iterCostChunks(workers=workers):
+                src, dst, cost = self._validCostEdges(src, dst, cost, nCells)
+                if not len(src):
+                    continue
+                ordered = ordered and (src[0] >= lastSrc) and bool((src[1:] >= src[:-1]).all())
+                lastSrc = src[-1]
+                cells, cellCounts = np.unique(src, return_counts=True)
+                counts[cells - 1] += cellCounts
+                nEdges += len(src)
+                dst.astype(np.int32).tofile(indicesRaw)
+                cost.astype(np.float64).tofile(dataRaw)
+
+        indptr = np.zeros(nCells + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        del counts
+        np.save(tmpPath.joinpath("indptr.npy"), indptr)
+        if ordered:
+            _rawToNpy(tmpPath.joinpath("indices.raw"), tmpPath.joinpath("indices.npy"), np.int32, nEdges)
+            _rawToNpy(tmpPath.joinpath("data.raw"), tmpPath.joinpath("data.npy"), np.float64, nEdges)
+        else:
+            os.remove(tmpPath.joinpath("indices.raw"))
+            os.remove(tmpPath.joinpath("data.raw"))
+            self._scatterCostRows(tmpPath, indptr, workers)
+
+        header = {"version": CACHE_VERSION,
+                  "gridWidth": self.gridWidth,
+                  "gridHeight": self.gridHeight,
+                  "lowerLeftX": self.lowerLeftX,
+                  "lowerLeftY": self.lowerLeftY,
+                  "cellSize": self.cellSize,
+                  "noDataValue": self.noDataValue,
+                  "numEdges": int(nEdges),
+                  "source": fingerprint}
+        with open(tmpPath.joinpath("header.json"), 'w') as write_obj:
+            json.dump(header, write_obj, indent=2)
+        shutil.rmtree(cachePath, ignore_errors=True)
+        os.replace(tmpPath, cachePath)
+
+    def _validCostEdges(self, src, dst, cost, nCells):
+        valid = (src >= 1) & (src <= nCells) & (dst >= 1) & (dst <= nCells)
+        return src[valid], dst[valid], cost[valid]
+
+    def _scatterCostRows(self, tmpPath, indptr, workers=1):
+        #second pass over a file out of cell order, the edges of a row keep their order in the file
+        nCells = len(indptr) - 1
+        indices = np.lib.format.open_memmap(tmpPath.joinpath("indices.npy"), mode='w+', dtype=np.int32, shape=(int(indptr[-1]),))
+        data = np.lib.format.open_memmap(tmpPath.joinpath("data.npy"), mode='w+', dtype=np.float64, shape=(int(indptr[-1]),))
+        cursor = indptr[:-1].copy()
+        for src, dst, cost in self._iterCostChunks(workers=workers):
+            src, dst, cost = self._validCostEdges(src, dst, cost, nCells)
+            order = np.argsort(src, kind='stable')
+            src, dst, cost = src[order], dst[order], cost[order]
+            cells, first, cellCounts = np.unique(src, return_index=True, return_counts=True)
+            rank = np.arange(len(src)) - np.repeat(first, cellCounts)
+            position = cursor[src - 1] + rank
+            indices[position] = dst
+            data[position] = cost
+            cursor[cells - 1] += cellCounts
+        indices.flush()
+        data.flush()
+        del indices, data
+
+    def _cacheIsCurrent(self):
+        headerPath = self._getCachePath().joinpath("header.json")
+        if not headerPath.exists():
+            return False
+        with open(headerPath, 'r') as read_obj:
+            header = json.load(read_obj)
+        if header.get("version") != CACHE_VERSION:
+            return False
+
+        stored = header["source"]
+        current = self._sourceFingerprint()
+        if stored["size"] != current["size"]:
+            return False
+        if stored["mtime"] == current["mtime"]:
+            return True
+
+        #file was touched, only rebuild if the content actually changed
+        if self._hashCostFile() != stored["sha1"]:
+            return False
+        stored["mtime"] = current["mtime"]
+        with open(headerPath, 'w') as write_obj:
+            json.dump(header, write_obj, indent=2)
+        return True
+
+    def _loadCostCache(self):
+        cachePath = self._getCachePath()
+        with open(cachePath.joinpath("header.json"), 'r') as read_obj:
+            header = json.load(read_obj)
+        self.gridWidth = header["gridWidth"]
+        self.gridHeight = header["gridHeight"]
+        self.lowerLeftX = header["lowerLeftX"]
+        self.lowerLeftY = header["lowerLeftY"]
+        self.cellSize = header["cellSize"]
+        self.noDataValue = header["noDataValue"]
+        self.cacheHeader = header
+
+        self.costIndptr = np.load(cachePath.joinpath("indptr.npy"), mmap_mode='r')
+        self.costIndices = np.load(cachePath.joinpath("indices.npy"), mmap_mode='r')
+        self.costData = np.load(cachePath.joinpath("data.npy"), mmap_mode='r')
+
+    def _loadCostWindow(self):
+        #slice the memory mapped CSR one grid row at a time, each row of the window is a contiguous cell range
+        indptr = self.costIndptr
+        srcs = []
+        dsts = []
+        costs = []
+        for row in range(self.rowMin, self.rowMax + 1):
+            left = row * self.gridWidth + self.colMin + 1
+            right = row * self.gridWidth + self.colMax + 1
+            cells = np.arange(left, right + 1, dtype=np.int64)
+            srcs.append(np.repeat(cells, np.diff(indptr[left - 1:right + 1])))
+            dsts.append(np.asarray(self.costIndices[indptr[left - 1]:indptr[right]], dtype=np.int64))
+            costs.append(np.asarray(self.costData[indptr[left - 1]:indptr[right]]))
+
+        if srcs:
+            src, dst, cost = np.concatenate(srcs), np.concatenate(dsts), np.concatenate(costs)
+        else:
+            src, dst, cost = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        #the rows cover the window box, sources outside its hull are dropped like the targets
+        keep = self._windowMask(src) & self._windowMask(dst)
+        self.edgeSrc = src[keep]
+        self.edgeDst = dst[keep]
+        self.edgeCost = cost[keep]
+        self.gridcost = {}
+        self.windowPending = False
     
-    def _loadcost(self):
-        
-        with open(self.costFilePath, 'r') as read_obj:
-            csv_reader = reader(read_obj)
-            i = 0
-            while i < 8:
-                next(csv_reader)
-                i += 1
-            edgeConn = next(csv_reader)
-            while edgeConn != ['']:
-                edgeCost = next(csv_reader)
-                startnode = int(edgeConn[0])
-                for i in range(len(edgeCost)):
-                    key = (startnode, int(edgeConn[i+1]))
-                    if self._checkBound(key):
-                        self.gridcost[key] =  float(edgeCost[i])
-                edgeConn = read_obj.readline().split(",")
-                edgeConn[-1] = edgeConn[-1].split("\n")[0]
+    def getTilePath(self):
+        return self._getCachePath().joinpath("tiles")
+
+    def _tilesAreCurrent(self, tileSize):
+        indexPath = self.getTilePath().joinpath("index.json")
+        if not indexPath.exists():
+            return False
+        with open(indexPath, 'r') as read_obj:
+            index = json.load(read_obj)
+        return (index["tileSize"] == tileSize) and (index["source"] == self.cacheHeader["source"]["sha1"])
+
+    def _buildCostTiles(self, tileSize=DEFAULT_TILE_SIZE):
+        """Split the cached surface into tileSize x tileSize tiles of dense (rows, cols, 8) outgoing costs,
+        one slot per NEIGHBOR_OFFSETS direction and inf where there is no edge. Tiles without any edge
+        are not written. index.json lists the tiles that exist."""
+        tilePath = self.getTilePath()
+        tmpPath = tilePath.with_name(tilePath.name + ".tmp")
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        tmpPath.mkdir(parents=True)
+
+        width = self.gridWidth
+        tiles = []
+        for r0 in range(0, self.gridHeight, tileSize):
+            #one band of tile rows at a time, the band is a contiguous slice of the CSR
+            r1 = min(r0 + tileSize, self.gridHeight)
+            band = np.full((r1 - r0, width, len(NEIGHBOR_OFFSETS)), np.inf)
+            indptr = np.asarray(self.costIndptr[r0*width:r1*width + 1])
+            src = np.repeat(np.arange(r0*width + 1, r1*width + 1), np.diff(indptr))
+            dst = np.asarray(self.costIndices[indptr[0]:indptr[-1]], dtype=np.int64)
+            cost = np.asarray(self.costData[indptr[0]:indptr[-1]])
+
+            srcRow, srcCol = self._cellToRowCol(src)
+            slot = self._edgeSlots(src, dst)
+            keep = slot >= 0
+            band[srcRow[keep] - r0, srcCol[keep], slot[keep]] = cost[keep]
+
+            for c0 in range(0, width, tileSize):
+                tile = band[:, c0:c0 + tileSize]
+                if np.isfinite(tile).any():
+                    tileRow, tileCol = r0 // tileSize, c0 // tileSize
+                    np.save(tmpPath.joinpath("tile_%s_%s.npy" %(tileRow, tileCol)), tile)
+                    tiles.append([tileRow, tileCol])
+
+        index = {"gridWidth": self.gridWidth,
+                 "gridHeight": self.gridHeight,
+                 "tileSize": tileSize,
+                 "tiles": tiles,
+                 "source": self.cacheHeader["source"]["sha1"]}
+        with open(tmpPath.joinpath("index.json"), 'w') as write_obj:
+            json.dump(index, write_obj)
+        shutil.rmtree(tilePath, ignore_errors=True)
+        os.replace(tmpPath, tilePath)
+
+    def getPyramidPath(self):
+        return self._getCachePath().joinpath("pyramid")
+
+    def _pyramidIsCurrent(self, factors):
+        indexPath = self.getPyramidPath().joinpath("index.json")
+        if not indexPath.exists():
+            return False
+        with open(indexPath, 'r') as read_obj:
+            index = json.load(read_obj)
+        return set(factors) <= set(index["factors"]) and (index["source"] == self.cacheHeader["source"]["sha1"])
+
+    def _buildCostPyramid(self, factors=DEFAULT_PYRAMID_FACTORS):
+        """Downsample the cached surface into one dense (rows, cols, 8) level per factor. A coarse cell
+        covers factor x factor cells, the cost of its edge in a NEIGHBOR_OFFSETS direction is the mean
+        cost of the fine steps in that direction inside it times factor (about one block crossed).
+        Current levels of other factors already on disk are kept, only missing factors are built."""
+        pyramidPath = self.getPyramidPath()
+        tmpPath = pyramidPath.with_name(pyramidPath.name + ".tmp")
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        tmpPath.mkdir(parents=True)
+
+        kept = []
+        indexPath = pyramidPath.joinpath("index.json")
+        if indexPath.exists():
+            with open(indexPath, 'r') as read_obj:
+                index = json.load(read_obj)
+            if index["source"] == self.cacheHeader["source"]["sha1"]:
+                kept = index["factors"]
+        for factor in kept:
+            shutil.copyfile(pyramidPath.joinpath("level_%s.npy" %(factor)), tmpPath.joinpath("level_%s.npy" %(factor)))
+
+        width = self.gridWidth
+        for factor in [factor for factor in factors if factor not in kept]:
+            coarseHeight, coarseWidth = -(-self.gridHeight // factor), -(-width // factor)
+            sums = np.zeros(coarseHeight * coarseWidth * 8)
+            counts = np.zeros(coarseHeight * coarseWidth * 8)
+            bandRows = factor * PYRAMID_BAND_BLOCKS
+            for r0 in range(0, self.gridHeight, bandRows):
+                #whole coarse rows at a time, the band is a contiguous slice of the CSR
+                r1 = min(r0 + bandRows, self.gridHeight)
+                indptr = np.asarray(self.costIndptr[r0*width:r1*width + 1])
+                src = np.repeat(np.arange(r0*width + 1, r1*width + 1), np.diff(indptr))
+                dst = np.asarray(self.costIndices[indptr[0]:indptr[-1]], dtype=np.int64)
+                cost = np.asarray(self.costData[indptr[0]:indptr[-1]])
+
+                srcRow, srcCol = self._cellToRowCol(src)
+                slot = self._edgeSlots(src, dst)
+                keep = slot >= 0
+                first = (r0 // factor) * coarseWidth * 8
+                key = ((srcRow[keep] // factor) * coarseWidth + srcCol[keep] // factor) * 8 + slot[keep] - first
+                size = (-(-r1 // factor) - r0 // factor) * coarseWidth * 8
+                sums[first:first + size] += np.bincount(key, weights=cost[keep], minlength=size)
+                counts[first:first + size] += np.bincount(key, minlength=size)
+
+            level = np.full(coarseHeight * coarseWidth * 8, np.inf)
+            present = counts > 0
+            level[present] = factor * sums[present] / counts[present]
+            level = level.reshape(coarseHeight, coarseWidth, 8)
+            rows, cols = np.arange(coarseHeight)[:, None], np.arange(coarseWidth)[None, :]
+            for slot, (dr, dc) in enumerate(NEIGHBOR_OFFSETS):
+                outside = (rows + dr < 0) | (rows + dr >= coarseHeight) | (cols + dc < 0) | (cols + dc >= coarseWidth)
+                level[..., slot][outside] = np.inf
+            np.save(tmpPath.joinpath("level_%s.npy" %(factor)), level)
+
+        index = {"factors": kept + [factor for factor in factors if factor not in kept],
+                 "source": self.cacheHeader["source"]["sha1"]}
+        with open(tmpPath.joinpath("index.json"), 'w') as write_obj:
+            json.dump(index, write_obj)
+        shutil.rmtree(pyramidPath, ignore_errors=True)
+        os.replace(tmpPath, pyramidPath)
+
+    def loadCostPyramid(self, factors=DEFAULT_PYRAMID_FACTORS):
+        """(factor, coarseWidth, src, dst, cost) of every pyramid level, restricted to the coarse cells
+        covering the subset window. Coarse cells are 1-based and row-major like the fine ones."""
+        levels = []
+        for factor in factors:
+            level = np.load(self.getPyramidPath().joinpath("level_%s.npy" %(factor)), mmap_mode='r')
+            coarseWidth = level.shape[1]
+            r0, r1 = self.rowMin // factor, self.rowMax // factor
+            c0, c1 = self.colMin // factor, self.colMax // factor
+            window = np.asarray(level[r0:r1 + 1, c0:c1 + 1])
+            rows, cols, slots = np.nonzero(np.isfinite(window))
+            dr = np.array([offset[0] for offset in NEIGHBOR_OFFSETS])[slots]
+            dc = np.array([offset[1] for offset in NEIGHBOR_OFFSETS])[slots]
+            inside = (rows + dr >= 0) & (rows + dr <= r1 - r0) & (cols + dc >= 0) & (cols + dc <= c1 - c0)
+            rows, cols, slots, dr, dc = rows[inside], cols[inside], slots[inside], dr[inside], dc[inside]
+            src = (rows + r0) * coarseWidth + (cols + c0) + 1
+            levels.append((factor, coarseWidth, src, src + dr * coarseWidth + dc, window[rows, cols, slots]))
+        return levels
+
+    def getRouteCachePath(self):
+        return self._getCachePath().joinpath("routes")
+
+    def getSurfaceFingerprint(self):
+        """sha1 of the cost file content and the subset window (box and region mask) when there is
+        one, None when the surface was not loaded through the cache."""
+        if self.cacheHeader is None:
+            return None
+        sha1 = hashlib.sha1(self.cacheHeader["source"]["sha1"].encode())
+        if hasattr(self, 'rowMin'):
+            sha1.update(np.array([self.rowMin, self.rowMax, self.colMin, self.colMax], dtype=np.int64).tobytes())
+        if self.windowCellMask is not None:
+            sha1.update(np.packbits(self.windowCellMask).tobytes())
+        return sha1.hexdigest()
+
+    def getLandmarkPath(self):
+        return self._getCachePath().joinpath("landmarks")
+
+    def _getLandmarkFile(self, k):
+        #one table per subset window and landmark count
+        return self.getLandmarkPath().joinpath("landmarks_r%s_%s_c%s_%s_k%s.npz"
+                                               %(self.rowMin, self.rowMax, self.colMin, self.colMax, k))
+
+    def loadLandmarks(self, k, nodes):
+        """Landmark table saved for this window, None when there is none or it was built from
+        another cost file or another set of window cells."""
+        if self.cacheHeader is None:
+            return None
+        landmarkFile = self._getLandmarkFile(k)
+        if not landmarkFile.exists():
+            return None
+        with np.load(landmarkFile) as stored:
+            if (str(stored["source"]) != self.cacheHeader["source"]["sha1"]) or (not np.array_equal(stored["nodes"], nodes)):
+                return None
+            return {key: stored[key] for key in ("landmarks", "nodes", "fromLandmark", "toLandmark")}
+
+    def saveLandmarks(self, k, table):
+        #written next to the cost surface cache, the surface loaded without the cache has no table on disk
+        if self.cacheHeader is None:
+            return
+        landmarkFile = self._getLandmarkFile(k)
+        landmarkFile.parent.mkdir(parents=True, exist_ok=True)
+        tmpFile = landmarkFile.with_name(landmarkFile.stem + ".tmp.npz")
+        np.savez(tmpFile, source=self.cacheHeader["source"]["sha1"], **table)
+        os.replace(tmpFile, landmarkFile)
+
+    def _iterCostBlocks(self, blockSize=COST_BLOCK_SIZE, byteRange=None):
+        #yield byte blocks holding only whole neighbour/cost line pairs, byteRange=(start, stop)
+        #limits the read to a range that starts on a neighbour line (see _splitCostRanges).
+        #costListEnded is set once the blank line closing the edge list has been seen
+        self.costListEnded = False
+        with open(self.costFilePath, 'rb') as read_obj:
+            if byteRange is None:
+                for _ in range(8):
+                    read_obj.readline()
+                remaining = None
+            else:
+                read_obj.seek(byteRange[0])
+                remaining = byteRange[1] - byteRange[0]
+            leftover = b''
+            finished = False
+            while not finished:
+                if remaining is None:
+                    chunk = read_obj.read(blockSize)
+                else:
+                    chunk = read_obj.read(min(blockSize, remaining))
+                    remaining -= len(chunk)
+                finished = not chunk
+                data = leftover + chunk.replace(b'\r', b'')
+                if finished and data and not data.endswith(b'\n'):
+                    data += b'\n'
+
+                #a blank line ends the edge list
+                if data.startswith(b'\n'):
+                    data = b''
+                    finished = True
+                    self.costListEnded = True
+                stop = data.find(b'\n\n')
+                if stop >= 0:
+                    data = data[:stop + 1]
+                    finished = True
+                    self.costListEnded = True
+
+                #cut after the last complete neighbour/cost pair
+                cut = data.rfind(b'\n') + 1
+                if data.count(b'\n') % 2 == 1:
+                    cut = data.rfind(b'\n', 0, cut - 1) + 1
+                if cut == 0:
+                    leftover = data
+                    continue
+                yield data[:cut]
+                leftover = data[cut:]
+
+    def _parseIntTokens(self, buf, starts, stops):
+        #vectorised int() of the digit runs buf[starts[i]:stops[i]]
+        lengths = stops - starts
+        if len(lengths) == 0:
+            return np.zeros(0, dtype=np.int64)
+        offsets = np.arange(lengths.max())
+        valid = offsets < lengths[:, None]
+        digits = buf[np.minimum(starts[:, None] + offsets, len(buf) - 1)].astype(np.int64) - ord('0')
+        powers = POWERS_OF_TEN[np.where(valid, lengths[:, None] - 1 - offsets, 0)]
+        return (np.where(valid, digits, 0) * powers).sum(axis=1)
+
+    def _parseCostBlock(self, block, subset=False):
+        #parse whole line pairs at once: "cell,n1,..,nk" followed by "c1,..,ck"
+        buf = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(buf == ord('\n'))
+        starts = np.concatenate(([0], ends[:-1] + 1))
+
+        if subset:
+            #only the leading cell of a neighbour line is needed to drop pairs outside the window,
+            #so the bulk of a national file is never converted to numbers
+            nbrStarts = starts[0::2]
+            head = buf[np.minimum(nbrStarts[:, None] + np.arange(12), len(buf) - 1)]
+            isDigit = (head >= ord('0')) & (head <= ord('9'))
+            cells = self._parseIntTokens(buf, nbrStarts, nbrStarts + np.argmin(isDigit, axis=1))
+            keepPair = self._windowMask(cells)
+            if not keepPair.any():
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+            if not keepPair.all():
+                #kept pairs come in runs (one per window row), copy each run as one slice
+                edges = np.diff(np.concatenate(([0], keepPair.view(np.int8), [0])))
+                runStarts = starts[0::2][np.flatnonzero(edges == 1)]
+                runEnds = ends[1::2][np.flatnonzero(edges == -1) - 1] + 1
+                block = b''.join([block[i:j] for i, j in zip(runStarts, runEnds)])
+                buf = np.frombuffer(block, dtype=np.uint8)
+                ends = np.flatnonzero(buf == ord('\n'))
+                starts = np.concatenate(([0], ends[:-1] + 1))
+        ntokens = np.add.reduceat(buf == ord(','), starts, dtype=np.int64) + 1
+        values = np.fromstring(block[:-1].replace(b'\n', b','), dtype=np.float64, sep=',')
+
+        nbrTokens = ntokens[0::2]
+        costTokens = ntokens[1::2]
+        if (len(values) != ntokens.sum()) or (not np.array_equal(costTokens, nbrTokens - 1)):
+            raise ValueError("Malformed cost file: neighbour and cost lines do not line up in %s" %(self.costFilePath))
+
+        isCostToken = np.repeat(np.arange(len(ntokens)) % 2 == 1, ntokens)
+        nbrValues = values[~isCostToken]
+        isStart = np.zeros(len(nbrValues), dtype=bool)
+        isStart[np.cumsum(nbrTokens) - nbrTokens] = True
+
+        src = np.repeat(nbrValues[isStart].astype(np.int64), nbrTokens - 1)
+        dst = nbrValues[~isStart].astype(np.int64)
+        cost = values[isCostToken]
+        return src, dst, cost
+    
+    def _iterParsedBlocks(self, subset=True, blockSize=COST_BLOCK_SIZE, byteRange=None):
+        #block wise ingest of the cost file, the subset window is applied to each block as a whole
+        for block in self._iterCostBlocks(blockSize, byteRange):
+            src, dst, cost = self._parseCostBlock(block, subset=subset)
+            if subset:
+                keep = self._windowMask(dst)
+                src, dst, cost = src[keep], dst[keep], cost[keep]
+            yield src, dst, cost
+
+    def _parseCostRange(self, subset=True, blockSize=COST_BLOCK_SIZE, byteRange=None):
+        srcs = []
+        dsts = []
+        costs = []
+        for src, dst, cost in self._iterParsedBlocks(subset, blockSize, byteRange):
+            srcs.append(src)
+            dsts.append(dst)
+            costs.append(cost)
+
+        if srcs:
+            return np.concatenate(srcs), np.concatenate(dsts), np.concatenate(costs)
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    def _isNeighbourLine(self, line, nextLine):
+        #a neighbour line is all ints, one token longer than the cost line after it, and only
+        #lists cells adjacent to its leading cell
+        if (not line) or (b'.' in line) or (line.count(b',') != nextLine.count(b',') + 1):
+            return False
+        try:
+            cells = [int(token) for token in line.split(b',')]
+        except ValueError:
+            return False
+        return all(abs(cell - cells[0]) <= self.gridWidth + 1 for cell in cells[1:])
+
+    def _alignRangeStart(self, read_obj, offset, dataStart, fileSize):
+        #move offset forward to the start of the next neighbour line, or onto the blank line
+        #that closes the edge list. Returns fileSize when no further pair starts after offset
+        if offset <= dataStart:
+            return dataStart
+        read_obj.seek(offset - 1)
+        window = read_obj.read(1 << 16)
+        first = window.find(b'\n')
+        if first < 0:
+            return fileSize
+        position = offset + first
+        rawLines = window[first + 1:].split(b'\n')[:-1]
+        lines = [line.rstrip(b'\r') for line in rawLines]
+        for parity in (0, 1):
+            if parity < len(lines) and lines[parity] == b'':
+                return position
+            if len(lines) < parity + 3:
+                return fileSize
+            nextPairOk = (lines[parity + 2] == b'') or (len(lines) > parity + 3
+                                                       and self._isNeighbourLine(lines[parity + 2], lines[parity + 3]))
+            if self._isNeighbourLine(lines[parity], lines[parity + 1]) and nextPairOk:
+                return position
+            position += len(rawLines[parity]) + 1
+        #no alignment found, the parser of this range reports the malformed file
+        return offset + first
+
+    def _splitCostRanges(self, workers, rangeSize=None):
+        #cut the edge list into byte ranges that each start on a neighbour line
+        with open(self.costFilePath, 'rb') as read_obj:
+            for _ in range(8):
+                read_obj.readline()
+            dataStart = read_obj.tell()
+            fileSize = os.fstat(read_obj.fileno()).st_size
+            if rangeSize is None:
+                rangeSize = max(MIN_RANGE_SIZE, (fileSize - dataStart) // (workers * RANGES_PER_WORKER) + 1)
+            starts = [self._alignRangeStart(read_obj, offset, dataStart, fileSize)
+                      for offset in range(dataStart, fileSize, rangeSize)]
+        bounds = sorted(set(starts + [fileSize]))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _getWindowState(self):
+        #attributes a worker needs to parse and window a byte range
+        keys = ["costFilePath", "gridWidth", "gridHeight", "rowMin", "rowMax", "colMin", "colMax",
+                "windowWidth", "windowHeight", "windowCellMask"]
+        return {key: getattr(self, key) for key in keys if hasattr(self, key)}
+
+    def _loadcost(self, subset=True, blockSize=COST_BLOCK_SIZE, workers=1, rangeSize=None):
+        #workers > 1 parses aligned byte ranges in parallel processes, results come back through shared memory
+        if workers > 1:
+            src, dst, cost = self._loadcostParallel(subset, blockSize, workers, rangeSize)
+        else:
+            src, dst, cost = self._parseCostRange(subset, blockSize)
+        if subset:
+            self.edgeSrc = src
+            self.edgeDst = dst
+            self.edgeCost = cost
+            self.gridcost = {}
+        return src, dst, cost
+
+    def _iterCostChunks(self, subset=False, blockSize=COST_BLOCK_SIZE, workers=1, rangeSize=None):
+        #edges of the cost file in file order, one parsed block (or byte range with workers > 1) at a time
+        if workers > 1:
+            yield from self._iterCostRangesParallel(subset, blockSize, workers, rangeSize)
+        else:
+            yield from self._iterParsedBlocks(subset, blockSize)
+
+    def _iterCostRangesParallel(self, subset, blockSize, workers, rangeSize=None):
+        #edges of every byte range in file order, at most RANGES_PER_WORKER ranges per worker parsed ahead
+        ranges = iter(self._splitCostRanges(workers, rangeSize))
+        state = self._getWindowState()
+        futures = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for byteRange in islice(ranges, workers * RANGES_PER_WORKER):
+                    futures.append(executor.submit(_parseCostRangeWorker, state, byteRange, subset, blockSize))
+                while futures:
+                    name, nEdges, ended = futures.popleft().result()
+                    edges = _readSharedEdges(name, nEdges)
+                    if ended:
+                        #ranges past the blank line are not part of the edge list
+                        for pending in futures:
+                            pending.cancel()
+                        yield edges
+                        break
+                    byteRange = next(ranges, None)
+                    if byteRange is not None:
+                        futures.append(executor.submit(_parseCostRangeWorker, state, byteRange, subset, blockSize))
+                    yield edges
+        finally:
+            #the executor has shut down, free the blocks that were never read back
+            for future in futures:
+                if future.done() and (not future.cancelled()) and (future.exception() is None):
+                    _releaseSharedEdges(future.result()[0])
+
+    def _loadcostParallel(self, subset, blockSize, workers, rangeSize=None):
+        srcs = []
+        dsts = []
+        costs = []
+        for src, dst, cost in self._iterCostRangesParallel(subset, blockSize, workers, rangeSize):
+            srcs.append(src)
+            dsts.append(dst)
+            costs.append(cost)
+
+        if srcs:
+            return np.concatenate(srcs), np.concatenate(dsts), np.concatenate(costs)
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
 
 
 
@@ -155,13 +854,104 @@ class geoTransformation:
         x = int((lon - self.lowerLeftX) / self.cellSize) + 1
         return [x,y]
     
+    def _latlonToXYArray(self, lat, lon):
+        #array versions of the scalar transforms above, int() truncation is kept as np.trunc
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        y = self.gridHeight - np.trunc((lat - self.lowerLeftY) / self.cellSize).astype(np.int64)
+        x = np.trunc((lon - self.lowerLeftX) / self.cellSize).astype(np.int64) + 1
+        return x, y
+
+    def _xyToCellArray(self, x, y):
+        return (np.asarray(y, dtype=np.int64) - 1) * self.gridWidth + np.asarray(x, dtype=np.int64)
+
+    def _latlonToCellArray(self, lat, lon):
+        x, y = self._latlonToXYArray(lat, lon)
+        return self._xyToCellArray(x, y)
+
+    def _cellToXYArray(self, cells):
+        rows, cols = self._cellToRowCol(cells)
+        return cols + 1, rows + 1
+
+    def _xyToLatLonArray(self, x, y):
+        lat = (self.gridHeight - (np.asarray(y, dtype=np.float64) - .5)) * self.cellSize + self.lowerLeftY
+        lon = (np.asarray(x, dtype=np.float64) - .5) * self.cellSize + self.lowerLeftX
+        return lat, lon
+
+    def _cellToLatLonArray(self, cells):
+        x, y = self._cellToXYArray(cells)
+        return self._xyToLatLonArray(x, y)
+
+    def _rasterizePolyline(self, cells):
+        #8-connected cells along the straight segments between consecutive cells, one cell per step
+        #of the longer axis, the shorter axis rounded half up. Repeated vertices are dropped
+        rows, cols = self._cellToRowCol(cells)
+        dr, dc = np.diff(rows), np.diff(cols)
+        steps = np.maximum(np.abs(dr), np.abs(dc))
+        segment = np.repeat(np.arange(len(steps)), steps)
+        step = np.arange(int(steps.sum())) - np.repeat(np.cumsum(steps) - steps, steps) + 1
+        fraction = step / np.maximum(steps[segment], 1)
+        lineRows = rows[segment] + np.floor(fraction * dr[segment] + 0.5).astype(np.int64)
+        lineCols = cols[segment] + np.floor(fraction * dc[segment] + 0.5).astype(np.int64)
+        lineRows = np.concatenate((rows[:1], lineRows))
+        lineCols = np.concatenate((cols[:1], lineCols))
+        return lineRows * self.gridWidth + lineCols + 1
+    
     def _getDistance(self, cell1, cell2):
         lat1, lon1 = self._cellToLatLon(cell1)
         lat2, lon2 = self._cellToLatLon(cell2)
-        point1 = Point(lat1, lon1)
-        point2 = Point(lat2, lon2)
-        dist = distance(point1, point2).kilometers
-        return dist
+        return float(lambertDistance(lat1, lon1, lat2, lon2))
+
+    def _getPathDistances(self, cells, ellipsoidal=True):
+        #km between consecutive cells of a path, haversine only when ellipsoidal is False
+        lat, lon = self._cellToLatLonArray(cells)
+        if ellipsoidal:
+            return lambertDistance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        return haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    def _getCumulativeLength(self, cells, ellipsoidal=True):
+        #prefix sums of the path length, the length from cell i to cell j is cum[j] - cum[i]
+        return np.concatenate(([0.0], np.cumsum(self._getPathDistances(cells, ellipsoidal))))
+
+    def _buildEdgeLengthTable(self):
+        #longitude spacing only depends on latitude, so every 8-neighbour edge length is one of
+        #three values per row: east-west along row r, north-south and diagonal between rows r and r+1
+        lat, lon = self._cellToLatLonArray(np.arange(self.gridHeight, dtype=np.int64) * self.gridWidth + 1)
+        self.edgeLengthTable = {
+            "ew": lambertDistance(lat, lon, lat, lon + self.cellSize),
+            "ns": lambertDistance(lat[:-1], lon[:-1], lat[1:], lon[1:]),
+            "diag": lambertDistance(lat[:-1], lon[:-1], lat[1:], lon[1:] + self.cellSize),
+        }
+
+    def _getEdgeLengthArray(self, src, dst):
+        #km length of each src -> dst edge, cells that are not 8-neighbours (e.g. pipeline
+        #jumps) fall back to the distance between the cell centres
+        if self.edgeLengthTable is None:
+            self._buildEdgeLengthTable()
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        srcRow, srcCol = self._cellToRowCol(src)
+        dstRow, dstCol = self._cellToRowCol(dst)
+        dRow = np.abs(dstRow - srcRow)
+        dCol = np.abs(dstCol - srcCol)
+        upper = np.clip(np.minimum(srcRow, dstRow), 0, max(self.gridHeight - 2, 0))
+
+        length = np.empty(src.shape, dtype=np.float64)
+        ew = (dRow == 0) & (dCol == 1)
+        ns = (dRow == 1) & (dCol == 0)
+        diag = (dRow == 1) & (dCol == 1)
+        length[ew] = self.edgeLengthTable["ew"][srcRow[ew]]
+        length[ns] = self.edgeLengthTable["ns"][upper[ns]]
+        length[diag] = self.edgeLengthTable["diag"][upper[diag]]
+        other = ~(ew | ns | diag)
+        if other.any():
+            lat1, lon1 = self._cellToLatLonArray(src[other])
+            lat2, lon2 = self._cellToLatLonArray(dst[other])
+            length[other] = lambertDistance(lat1, lon1, lat2, lon2)
+        return length
+
+    def _getEdgeLength(self, u, v):
+        return float(self._getEdgeLengthArray([u], [v])[0])
 
     
     def _xyToLatLon(self, x, y):
@@ -175,10 +965,69 @@ class geoTransformation:
         return self.gridCostList
     
     def getEdegsDict(self):
+        #the dict is only materialised on request when the edges came from the binary cache
+        if not self.gridcost:
+            src, dst, cost = self.getEdgeArrays()
+            if src is not None:
+                self.gridcost = dict(zip(zip(src.tolist(), dst.tolist()), cost.tolist()))
         return self.gridcost
+
+    def getEdgeArrays(self):
+        #the window of the cache is sliced on first use, a solve reusing a loaded cost store never reads it
+        if self.windowPending:
+            self._loadCostWindow()
+        return self.edgeSrc, self.edgeDst, self.edgeCost
+
+    def clearEdgeArrays(self):
+        #drop the window edges once another structure (e.g. a compactCostStore) holds them,
+        #a window of the cache is sliced again if they are asked for later
+        self.edgeSrc = None
+        self.edgeDst = None
+        self.edgeCost = None
+        self.gridcost = {}
+        self.windowPending = self.cacheHeader is not None and hasattr(self, 'rowMin')
     
-    def processGeoCost(self):
+    def processGeoCost(self, useCache=True, regionPoints=None, bufferKm=None, bufferFactor=REGION_BUFFER_FACTOR, regionShape='bbox',
+                       tiled=False, tileSize=DEFAULT_TILE_SIZE, workers=1, pyramid=None, assetPoints=None):
+        #workers: processes used to parse the csv, os.cpu_count() when None
+        #pyramid: factors of the coarse cost levels kept with the cache, the cache is always used when given
+        #assetPoints: (lat, lon) of the sources and sinks, the default buffer follows their spacing
+        if workers is None:
+            workers = os.cpu_count() or 1
         start_time = time.time()
+        if regionPoints is not None and len(regionPoints) > 0:
+            self._setRegionOfInterest(regionPoints, bufferKm=bufferKm, bufferFactor=bufferFactor, regionShape=regionShape,
+                                      assetPoints=assetPoints)
+        if useCache or tiled or pyramid:
+            print("Loading cost surface cache...")
+            if not self._cacheIsCurrent():
+                print("Cost surface cache missing or out of date, converting %s..." %(self.costFilePath))
+                self._buildCostCache(workers=workers)
+                print("Cost surface cache written. Time Elapsed: %s seconds" %(time.time() - start_time))
+            self._loadCostCache()
+            print("loaded cost surface cache. Time Elapsed: %s seconds" %(time.time() - start_time))
+            print("")
+            if tiled:
+                #tiles are read on demand by the router, nothing is subset or loaded here
+                if not self._tilesAreCurrent(tileSize):
+                    print("Writing cost surface tiles...")
+                    self._buildCostTiles(tileSize)
+                    print("Cost surface tiles written. Time Elapsed: %s seconds" %(time.time() - start_time))
+                    print("")
+                return
+            print("Subsetting Cost grid...")
+            self._subsetGrid()
+            self.clearEdgeArrays()
+            print("Subset window: %s x %s cells" %(self.windowHeight, self.windowWidth))
+            print("Subsetting cost grid completed. Time Elapsed: %s seconds" %(time.time() - start_time))
+            print("")
+            if pyramid and not self._pyramidIsCurrent(pyramid):
+                print("Writing cost surface pyramid...")
+                self._buildCostPyramid(pyramid)
+                print("Cost surface pyramid written. Time Elapsed: %s seconds" %(time.time() - start_time))
+                print("")
+            return
+
         print("Loading geo grid...")
         self._loadgeogrid()
         print("loaded geogrid. Time Elapsed: %s seconds" %(time.time() - start_time))
@@ -188,56 +1037,113 @@ class geoTransformation:
         print("Subsetting cost grid completed. Time Elapsed: %s seconds" %(time.time() - start_time))
         print("")
         print("Loading cost...")
-        self._loadcost()
+        self._loadcost(workers=workers)
         print("loaded cost. Time Elapsed: %s seconds" %(time.time() - start_time))
         print("")
         
     
 
-    def _subsetGrid(self):
-        # nrows = self.gridHeight
-        ncols = self.gridWidth
+    def _meanAssetSpacing(self, points):
+        #mean distance (km) from each point to its nearest neighbour, on an equirectangular projection
+        #around the mean latitude (close to the geodesic at asset spacings)
+        if len(points) < 2:
+            return 0.0
+        xy = np.column_stack([points[:, 1] * np.cos(np.radians(points[:, 0].mean())), points[:, 0]]) * KM_PER_DEG_LAT
+        dist, _ = cKDTree(xy).query(xy, k=2)
+        return float(dist[:, 1].mean())
 
-        sw = self._latlonToCell(self.south, self.west)
-        se = self._latlonToCell(self.south, self.east)
-        nw = self._latlonToCell(self.north, self.west)
-        ne = self._latlonToCell(self.north, self.east)
+    def _setRegionOfInterest(self, regionPoints, bufferKm=None, bufferFactor=REGION_BUFFER_FACTOR, regionShape='bbox',
+                             assetPoints=None):
+        """Replace the fixed north/south/east/west box with a buffered box (or convex hull) around
+        regionPoints, a sequence of (lat, lon) for the assets and pipeline vertices.
+        The buffer is bufferKm if given, otherwise bufferFactor times the mean nearest asset spacing
+        of assetPoints (the sources and sinks only), or of regionPoints when they are not given,
+        but at least MIN_REGION_BUFFER_KM."""
+        points = np.asarray(regionPoints, dtype=np.float64).reshape(-1, 2)
+        if bufferKm is None:
+            spacingPoints = points if assetPoints is None else np.asarray(assetPoints, dtype=np.float64).reshape(-1, 2)
+            #a derived buffer never drops under the floor, an explicit bufferKm is used as given
+            bufferKm = max(bufferFactor * self._meanAssetSpacing(spacingPoints), MIN_REGION_BUFFER_KM)
 
-        inputdata = [sw, se, nw, ne]
+        dLat = bufferKm / KM_PER_DEG_LAT
+        widestLat = min(np.abs(points[:, 0]).max() + dLat, 89.0)
+        dLon = bufferKm / (KM_PER_DEG_LAT * np.cos(np.radians(widestLat)))
 
+        self.north = points[:, 0].max() + dLat
+        self.south = points[:, 0].min() - dLat
+        self.east = points[:, 1].max() + dLon
+        self.west = points[:, 1].min() - dLon
 
-        newWidth = max((inputdata[1] - inputdata[0]), (inputdata[3] - inputdata[2]))+1
-        newHeight = max(abs(inputdata[2] - inputdata[0]), abs(inputdata[3] - inputdata[1]))+ncols
-        
-        
-        start = inputdata[0]
+        self.regionHull = None
+        if regionShape == 'hull':
+            #buffer every point with a ring so the hull keeps the same margin as the box
+            angles = np.linspace(0, 2*np.pi, 16, endpoint=False)
+            ring = np.stack([points[:, 0, None] + dLat*np.sin(angles), points[:, 1, None] + dLon*np.cos(angles)], axis=-1)
+            ring = ring.reshape(-1, 2)
+            self.regionHull = Delaunay(ring[ConvexHull(ring).vertices])
+        elif regionShape != 'bbox':
+            raise ValueError("regionShape must be 'bbox' or 'hull', got %s" %(regionShape))
+
+    def _subsetGrid(self):
+        #window as an inclusive (row, col) box, 0-based with row 0 on the northern edge of the grid
+        westX, southY = self._latlonToXY(self.south, self.west)
+        eastX, northY = self._latlonToXY(self.north, self.east)
 
-        n_nrows = round(newHeight/ncols)
+        self.rowMin = max(northY - 1, 0)
+        self.rowMax = min(southY - 1, self.gridHeight - 1)
+        self.colMin = max(westX - 1, 0)
+        self.colMax = min(eastX - 1, self.gridWidth - 1)
+        self.windowWidth = max(self.colMax - self.colMin + 1, 0)
+        self.windowHeight = max(self.rowMax - self.rowMin + 1, 0)
 
-        
+        self.windowCellMask = None
+        if self.regionHull is not None:
+            rows, cols = np.divmod(np.arange(self.windowWidth * self.windowHeight), self.windowWidth)
+            lat = (self.gridHeight - (rows + self.rowMin + 0.5)) * self.cellSize + self.lowerLeftY
+            lon = (cols + self.colMin + 0.5) * self.cellSize + self.lowerLeftX
+            self.windowCellMask = self.regionHull.find_simplex(np.column_stack([lat, lon])) >= 0
 
-        self.leftbounds = []
-        self.rightbounds = []
-        for i in range(n_nrows):
-            start_x = start - (i*ncols)
-            self.leftbounds.append(start_x)
-            self.rightbounds.append(start_x + newWidth - 1)
+        #only the cells of the window become graph vertices
+        local = np.arange(self.windowWidth * self.windowHeight)
+        if self.windowCellMask is not None:
+            local = local[self.windowCellMask]
+        self.gridVertices = self._toGlobalCell(local).tolist()
 
-        self.leftbounds.reverse()
-        self.rightbounds.reverse()
+    def _cellToRowCol(self, cells):
+        return np.divmod(np.asarray(cells, dtype=np.int64) - 1, self.gridWidth)
 
+    def _edgeSlots(self, src, dst):
+        #NEIGHBOR_OFFSETS slot of each src -> dst edge, -1 when the cells are not 8-neighbours
+        slotLookup = np.full(9, -1, dtype=np.int64)
+        for slot, (dr, dc) in enumerate(NEIGHBOR_OFFSETS):
+            slotLookup[(dr + 1)*3 + (dc + 1)] = slot
+        srcRow, srcCol = self._cellToRowCol(src)
+        dstRow, dstCol = self._cellToRowCol(dst)
+        dr = dstRow - srcRow
+        dc = dstCol - srcCol
+        adjacent = (np.abs(dr) <= 1) & (np.abs(dc) <= 1)
+        return slotLookup[np.where(adjacent, (dr + 1)*3 + (dc + 1), 4)]
 
-    
-    def _checkBound(self, data):
-        n = len(self.leftbounds)
-        left_idx = bisect_right(self.leftbounds, data[0]) - 1
-        right_idx = bisect_left(self.rightbounds, data[1])
+    def _windowMask(self, cells):
+        #boolean mask of the cells that fall inside the subset window
+        return self._toLocalIndex(cells) >= 0
 
-        validLeft = (left_idx >= 0 and self.leftbounds[left_idx] <= data[0] <= self.rightbounds[left_idx])
-        validRight = (right_idx < n and self.leftbounds[right_idx] <= data[1] <= self.rightbounds[right_idx])
+    def _toLocalIndex(self, cells):
+        #dense 0-based row-major numbering of the window cells, -1 for cells outside the window (or its hull)
+        cells = np.asarray(cells, dtype=np.int64)
+        rows, cols = self._cellToRowCol(cells)
+        local = windowLocalIndex(rows, cols, self.rowMin, self.colMin, self.windowHeight, self.windowWidth, self.windowCellMask)
+        return np.where(cells >= 1, local, -1)
+
+    def _toGlobalCell(self, local):
+        rows, cols = np.divmod(np.asarray(local, dtype=np.int64), self.windowWidth)
+        return (rows + self.rowMin) * self.gridWidth + (cols + self.colMin) + 1
+
+    def _checkBound(self, data):
+        return bool(self._windowMask(data[0])) and bool(self._windowMask(data[1]))
 
-        valid = validLeft and validRight
-        return valid
+    def getWindowShape(self):
+        return self.windowHeight, self.windowWidth
 
     def getHeight(self):
         return self.gridHeight
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+DEFAULT_INDEX_CELL = 0.5 #degrees per side of a spatial index bucket
+
+
+class pipelineRegistry:
+    """Existing pipelines read from one file, with a grid index over their bounding boxes.
+    Csv, xlsx and parquet files hold one row per vertex in path order with the columns of the
+    pipeline template (Name, Lat, Long, Lower Cap, Upper Cap), like the template the Name and
+    capacities may be given on the first row of a pipeline only. GeoJSON holds LineString or MultiLineString features with the same names as properties,
+    every part of a MultiLineString becomes its own pipeline."""
+    def __init__(self, indexCell=DEFAULT_INDEX_CELL):
+        self.indexCell = indexCell
+        self.pipelines = {}
+        self.bounds = {}
+        self.order = {}
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.pipelines)
+
+    def _bucketRange(self, south, west, north, east):
+        rows = range(int(np.floor(south / self.indexCell)), int(np.floor(north / self.indexCell)) + 1)
+        cols = range(int(np.floor(west / self.indexCell)), int(np.floor(east / self.indexCell)) + 1)
+        return [(row, col) for row in rows for col in cols]
+
+    def add(self, name, lat, lon, lowerCap=0, upperCap=np.inf):
+        if name in self.pipelines:
+            raise ValueError("pipeline %s is already registered" %(name))
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if len(lat) < 2:
+            raise ValueError("pipeline %s needs at least 2 vertices, got %s" %(name, len(lat)))
+        self.pipelines[name] = {"Lat": lat, "Long": lon, "Lower Cap": lowerCap, "Upper Cap": upperCap}
+        self.order[name] = len(self.order)
+        self.bounds[name] = (float(lat.min()), float(lon.min()), float(lat.max()), float(lon.max()))
+        for bucket in self._bucketRange(*self.bounds[name]):
+            self.buckets.setdefault(bucket, []).append(name)
+
+    def read(self, path):
+        #register every pipeline of a csv, xlsx, parquet or GeoJSON file
+        path = Path(path)
+        suffix = path.suffix.lower()
+        if suffix in ('.geojson', '.json'):
+            self._readGeoJson(path)
+            return self
+        if suffix == '.csv':
+            table = pd.read_csv(path)
+        elif suffix == '.parquet':
+            table = pd.read_parquet(path)
+        elif suffix in ('.xlsx', '.xls'):
+            table = pd.read_excel(path)
+        else:
+            raise ValueError("pipeline file must be csv, xlsx, parquet or geojson, got %s" %(path.name))
+        #the template fills Name and the capacities on the first vertex of every pipeline only
+        table[["Name", "Lower Cap", "Upper Cap"]] = table[["Name", "Lower Cap", "Upper Cap"]].ffill()
+        for name, rows in table.groupby("Name", sort=False):
+            self.add(name, rows["Lat"].values, rows["Long"].values, rows["Lower Cap"].values[0], rows["Upper Cap"].values[0])
+        return self
+
+    def _readGeoJson(self, path):
+        with open(path, 'r') as read_obj:
+            features = json.load(read_obj)["features"]
+        for feature in features:
+            geometry = feature["geometry"]
+            properties = feature.get("properties") or {}
+            if geometry["type"] == 'LineString':
+                parts = [geometry["coordinates"]]
+            elif geometry["type"] == 'MultiLineString':
+                parts = geometry["coordinates"]
+            else:
+                continue
+            for k, part in enumerate(parts):
+                name = properties["Name"] if len(parts) == 1 else "%s-%s" %(properties["Name"], k + 1)
+                #GeoJSON positions are (lon, lat)
+                part = np.asarray(part, dtype=np.float64)
+                self.add(name, part[:, 1], part[:, 0], properties.get("Lower Cap", 0), properties.get("Upper Cap", np.inf))
+
+    def query(self, south, west, north, east):
+        #names of the pipelines whose bounding box intersects the box, in registration order
+        found = set()
+        for bucket in self._bucketRange(south, west, north, east):
+            for name in self.buckets.get(bucket, ()):
+                s, w, n, e = self.bounds[name]
+                if (s <= north) and (n >= south) and (w <= east) and (e >= west):
+                    found.add(name)
+        return sorted(found, key=self.order.get)
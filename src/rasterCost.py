@@ -0,0 +1,44 @@
+import numpy as np
+from costTiles import cellCostStore
+from geotransformation import windowLocalIndex
+
+
+class rasterCostStore(cellCostStore):
+    """In-memory 8-neighbour raster graph of the subset window.
+    Costs live in a dense (windowHeight, windowWidth, 8) float64 array in NEIGHBOR_OFFSETS slot
+    order with inf for missing edges, neighbours are derived from the cell number, so no
+    per-node or per-edge Python objects are created."""
+    def __init__(self, gt):
+        super().__init__(gt.gridWidth, gt.gridHeight)
+        self.rowMin = gt.rowMin
+        self.colMin = gt.colMin
+        self.windowWidth = gt.windowWidth
+        self.windowHeight = gt.windowHeight
+        self.windowCellMask = gt.windowCellMask
+        self.costs = np.full((self.windowHeight, self.windowWidth, 8), np.inf)
+        self._scatter(gt, *gt.getEdgeArrays())
+        self.costs.flags.writeable = False
+
+    def _scatter(self, gt, src, dst, cost):
+        srcRow, srcCol = gt._cellToRowCol(src)
+        dstRow, dstCol = gt._cellToRowCol(dst)
+        slot = gt._edgeSlots(src, dst)
+        keep = (slot >= 0) & (self._localIndex(srcRow, srcCol) >= 0) & (self._localIndex(dstRow, dstCol) >= 0)
+        self.costs[srcRow[keep] - self.rowMin, srcCol[keep] - self.colMin, slot[keep]] = cost[keep]
+
+    def _localIndex(self, rows, cols):
+        return windowLocalIndex(rows, cols, self.rowMin, self.colMin, self.windowHeight, self.windowWidth, self.windowCellMask)
+
+    def nbytes(self):
+        return self.costs.nbytes
+
+    def _baseEdgeArrays(self):
+        rows, cols, slots = np.nonzero(np.isfinite(self.costs))
+        src = (rows + self.rowMin) * self.gridWidth + (cols + self.colMin) + 1
+        return src, src + np.array(self.cellOffsets)[slots], self.costs[rows, cols, slots]
+
+    def _cellCosts(self, cell):
+        row, col = divmod(cell - 1, self.gridWidth)
+        if self._localIndex(row, col) < 0:
+            return None
+        return self.costs[row - self.rowMin, col - self.colMin]
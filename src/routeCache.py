@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+
+
+DEFAULT_MAX_ROUTES = 20000 #routes kept on disk before the least recently used are evicted
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def routeKey(surfaceKey, overrideKey, start, end):
+    #file name of a route: the surface and override fingerprints plus the start and end cell
+    return hashlib.sha1(("%s|%s|%s|%s" %(surfaceKey, overrideKey, start, end)).encode()).hexdigest()
+
+
+class routeCache:
+    """On-disk shortest path cache with least recently used eviction.
+    Every route is one .npy file of its cells (int32 unless a cell number needs more), index.json
+    keeps the weight and length of every route in use order, oldest first. The index is written
+    by save(), route files are written and evicted immediately."""
+    def __init__(self, cachePath, maxEntries=DEFAULT_MAX_ROUTES):
+        self.cachePath = Path(cachePath)
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.index = OrderedDict()
+        indexPath = self.cachePath.joinpath("index.json")
+        if indexPath.exists():
+            with open(indexPath, 'r') as read_obj:
+                self.index = OrderedDict(json.load(read_obj))
+
+    def _routePath(self, name):
+        return self.cachePath.joinpath("%s.npy" %(name))
+
+    def get(self, key):
+        #(path, weight, length) of a cached route, None on a miss
+        entry = self.index.get(key)
+        if entry is not None:
+            try:
+                path = np.load(self._routePath(key)).tolist()
+            except FileNotFoundError:
+                del self.index[key]
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.index.move_to_end(key)
+        self.hits += 1
+        return path, entry["weight"], entry["length"]
+
+    def put(self, key, path, weight, length):
+        self.cachePath.mkdir(parents=True, exist_ok=True)
+        cells = np.asarray(path, dtype=np.int64)
+        if len(cells) == 0 or cells.max() <= INT32_MAX:
+            cells = cells.astype(np.int32)
+        np.save(self._routePath(key), cells)
+        self.index[key] = {"weight": float(weight), "length": float(length)}
+        self.index.move_to_end(key)
+        while len(self.index) > self.maxEntries:
+            name, _ = self.index.popitem(last=False)
+            self._routePath(name).unlink(missing_ok=True)
+
+    def save(self):
+        if not self.cachePath.exists():
+            return
+        tmpPath = self.cachePath.joinpath("index.json.tmp")
+        with open(tmpPath, 'w') as write_obj:
+            json.dump(list(self.index.items()), write_obj)
+        os.replace(tmpPath, self.cachePath.joinpath("index.json"))
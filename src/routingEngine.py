@@ -0,0 +1,756 @@
+import os
+import copy
+import time
+import numpy as np
+import networkx as nx
+from heapq import heappush, heappop
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+ROUTING_METHODS = ('dijkstra', 'astar', 'corridor', 'pyramid')
+DEFAULT_LANDMARKS = 8
+DEFAULT_CORRIDOR_SLACK = 0.25 #ellipse around the endpoints: summed distance to them up to (1 + slack) times their distance
+DEFAULT_CORRIDOR_BUFFER = 10 #cells added to the ellipse, so short and degenerate pairs still get room
+DEFAULT_PYRAMID_BUFFER = 2 #coarse cells kept on each side of the coarse route when refining
+BLOCKED_WEIGHT = 1e9 #tie-in and diagonal crossover blocks, a route at or above it crosses one
+HEURISTIC_TARGETS = 16 #targets whose A* heuristic is kept until the weights change
+BATCHES_PER_WORKER = 4 #endpoint groups are dealt into this many batches per routing worker
+
+
+def buildLandmarks(src, dst, weight, k=DEFAULT_LANDMARKS):
+    """Pick k landmark cells by farthest point selection and return their distance table
+    {"landmarks", "nodes", "fromLandmark", "toLandmark"}: fromLandmark[i, j] is the distance from
+    landmark i to nodes[j], toLandmark[i, j] the distance from nodes[j] to landmark i.
+    The first landmark is the cell farthest from the middle cell, every next one the cell farthest
+    from the landmarks already chosen."""
+    engine = routingEngine(src, dst, weight)
+    n = len(engine.cells)
+    k = min(k, n)
+    fromLandmark = np.zeros((k, n))
+    toLandmark = np.zeros((k, n))
+    landmarks = np.zeros(k, dtype=np.int64)
+    reverse = engine.graph.T.tocsr()
+    nearest = dijkstra(engine.graph, directed=True, indices=n // 2)
+    for i in range(k):
+        reached = np.where(np.isfinite(nearest), nearest, -1)
+        landmarks[i] = int(np.argmax(reached))
+        fromLandmark[i] = dijkstra(engine.graph, directed=True, indices=landmarks[i])
+        toLandmark[i] = dijkstra(reverse, directed=True, indices=landmarks[i])
+        nearest = fromLandmark[i].copy() if i == 0 else np.minimum(nearest, fromLandmark[i])
+        nearest[landmarks[:i + 1]] = -1
+    return {"landmarks": engine.cells[landmarks], "nodes": engine.cells,
+            "fromLandmark": fromLandmark, "toLandmark": toLandmark}
+
+
+class routingEngine:
+    """Shortest paths over the cost surface with scipy.sparse.csgraph.dijkstra.
+    The directed edges are held once as a CSR adjacency over a dense renumbering of the cells.
+    Weight changes to existing edges are written into the CSR in place, new edges are queued
+    and merged on the next query. The search tree of the last source is kept so further
+    targets from the same source need no new search. Explicit zero weights (pipelines) are
+    kept as edges by csgraph.
+    gridWidth (cells are 1-based and row-major) lets batched searches start with a distance
+    limit from the grid distance to their targets instead of exploring the whole surface, and
+    enables method='astar', 'corridor' and 'pyramid' for point to point queries. A landmark table
+    from buildLandmarks tightens the A* heuristic with the ALT triangle inequality bounds, the
+    (factor, coarseWidth, src, dst, weight) levels of geoTransformation.loadCostPyramid drive the
+    pyramid search. Every search, a point to point query or the bounded tree of an endpoint group
+    (method 'tree'), appends the pairs it routed, its settled node count and wall time to queryStats."""
+    def __init__(self, src, dst, weight, nodes=None, gridWidth=None, method='dijkstra', landmarks=None,
+                 corridorSlack=DEFAULT_CORRIDOR_SLACK, corridorBuffer=DEFAULT_CORRIDOR_BUFFER, pyramid=None,
+                 pyramidBuffer=DEFAULT_PYRAMID_BUFFER):
+        if method not in ROUTING_METHODS:
+            raise ValueError("routing method must be one of %s, got %s" %(ROUTING_METHODS, method))
+        self.pending = {}
+        self.treeSource = None
+        self.searches = 0
+        self.gridWidth = gridWidth
+        self.method = method if gridWidth is not None else 'dijkstra'
+        if method == 'pyramid' and not pyramid:
+            self.method = 'dijkstra'
+        self.queryStats = []
+        self.stepMin = None
+        self.landmarkTable = landmarks
+        self.corridorSlack = corridorSlack
+        self.corridorBuffer = corridorBuffer
+        self.pyramidBuffer = pyramidBuffer
+        #coarsest level first
+        self.pyramid = sorted(pyramid or [], key=lambda level: -level[0])
+        self._build(np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64),
+                    np.asarray(weight, dtype=np.float64), nodes)
+
+    def _build(self, src, dst, weight, nodes=None):
+        cells = [src, dst]
+        if nodes is not None:
+            cells.append(np.asarray(nodes, dtype=np.int64))
+        self.cells = np.unique(np.concatenate(cells))
+        n = len(self.cells)
+        row = np.searchsorted(self.cells, src)
+        col = np.searchsorted(self.cells, dst)
+
+        #one entry per (row, col), the last weight given for an edge wins
+        order = np.lexsort((np.arange(len(row)), col, row))
+        row, col, weight = row[order], col[order], weight[order]
+        last = np.ones(len(row), dtype=bool)
+        last[:-1] = (row[1:] != row[:-1]) | (col[1:] != col[:-1])
+        row, col, weight = row[last], col[last], weight[last]
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row, minlength=n), out=indptr[1:])
+        self._setGraph(self.cells, csr_matrix((weight, col.astype(np.int32), indptr), shape=(n, n)))
+        if self.gridWidth is not None:
+            self._setStepBounds(row, col, weight)
+        if self.landmarkTable is not None:
+            self._setLandmarkBounds(row, col)
+
+    def _setGraph(self, cells, graph):
+        self.cells = cells
+        self.graph = graph
+        #rows are sorted and columns sorted within a row, so row * n + col is a sorted edge key
+        row = np.repeat(np.arange(len(cells), dtype=np.int64), np.diff(graph.indptr))
+        self.edgeKeys = row * len(cells) + graph.indices
+        self.reverseGraph = None
+        self.treeSource = None
+        #blocked edges are not steps a route takes, they would inflate the distance limit of the bounded search
+        positive = graph.data[(graph.data > 0) & (graph.data < BLOCKED_WEIGHT)]
+        self.meanStepCost = float(positive.mean()) if len(positive) else 1.0
+        self.heuristicBase = None
+        self.heuristics = OrderedDict()
+        self.pyramidLevels = None
+
+    def _setLandmarkBounds(self, row, col):
+        #landmark distances of the engine cells, nan for cells the table does not know. landmarkBound
+        #is the largest potential difference across each edge, an edge cheaper than it (or touching an
+        #unknown cell) was changed after preprocessing and is a portal for the heuristic. landmarkSlack
+        #absorbs the rounding of the summed distances so unchanged edges are never taken for portals
+        nodes = self.landmarkTable["nodes"]
+        position = np.minimum(np.searchsorted(nodes, self.cells), len(nodes) - 1)
+        known = nodes[position] == self.cells
+        self.fromLandmark = np.where(known, self.landmarkTable["fromLandmark"][:, position], np.nan)
+        self.toLandmark = np.where(known, self.landmarkTable["toLandmark"][:, position], np.nan)
+        with np.errstate(invalid='ignore'):
+            bound = np.fmax(self.fromLandmark[:, col] - self.fromLandmark[:, row],
+                            self.toLandmark[:, row] - self.toLandmark[:, col])
+        bound = np.where(np.isnan(bound), -np.inf, bound).max(axis=0, initial=-np.inf)
+        self.landmarkBound = np.where(known[row] & known[col], bound, np.inf)
+        finite = np.concatenate((self.fromLandmark[np.isfinite(self.fromLandmark)], self.toLandmark[np.isfinite(self.toLandmark)]))
+        self.landmarkSlack = 1e-9 * float(finite.max()) if len(finite) else 0.0
+
+    def _setStepBounds(self, row, col, weight):
+        #lower bound of every stored edge: the cheapest straight or diagonal step of the surface as first
+        #loaded, 0 for any other edge. Edges cheaper than their bound (pipelines, jumps) are portals
+        srcRow, srcCol = np.divmod(self.cells[row] - 1, self.gridWidth)
+        dstRow, dstCol = np.divmod(self.cells[col] - 1, self.gridWidth)
+        dr, dc = np.abs(dstRow - srcRow), np.abs(dstCol - srcCol)
+        straight = (dr + dc == 1)
+        diagonal = (dr == 1) & (dc == 1)
+        if self.stepMin is None:
+            straightCosts = weight[straight & (weight > 0)]
+            diagonalCosts = weight[diagonal & (weight > 0)]
+            self.stepMin = (float(straightCosts.min()) if len(straightCosts) else 0.0,
+                            float(diagonalCosts.min()) if len(diagonalCosts) else 0.0)
+        self.stepBound = np.where(straight, self.stepMin[0], np.where(diagonal, self.stepMin[1], 0.0))
+
+    def _edgeArrays(self):
+        row = np.repeat(np.arange(len(self.cells)), np.diff(self.graph.indptr))
+        return self.cells[row], self.cells[self.graph.indices], self.graph.data
+
+    def _nodeIndex(self, cell):
+        index = int(np.searchsorted(self.cells, cell))
+        if (index >= len(self.cells)) or (self.cells[index] != cell):
+            raise nx.NodeNotFound("Node %s not in the routing graph." %(cell))
+        return index
+
+    def _edgePositions(self, src, dst):
+        #positions of the src -> dst edges in the CSR data, -1 where an edge is not stored
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        row = np.minimum(np.searchsorted(self.cells, src), len(self.cells) - 1)
+        col = np.minimum(np.searchsorted(self.cells, dst), len(self.cells) - 1)
+        known = (self.cells[row] == src) & (self.cells[col] == dst)
+        keys = row * len(self.cells) + col
+        position = np.minimum(np.searchsorted(self.edgeKeys, keys), max(len(self.edgeKeys) - 1, 0))
+        found = known & (len(self.edgeKeys) > 0)
+        found[found] = self.edgeKeys[position[found]] == keys[found]
+        return np.where(found, position, -1)
+
+    def _edgePosition(self, u, v):
+        position = int(self._edgePositions([u], [v])[0])
+        return None if position < 0 else position
+
+    def has_node(self, cell):
+        position = np.searchsorted(self.cells, cell)
+        return bool(position < len(self.cells) and self.cells[position] == cell)
+
+    def has_edge(self, u, v):
+        return ((u, v) in self.pending) or (self._edgePosition(u, v) is not None)
+
+    def set_weight(self, u, v, weight):
+        self.set_weights([u], [v], [weight])
+
+    def set_weights(self, src, dst, weights):
+        #many set_weight calls with one vectorised edge lookup, the last weight of a repeated edge wins
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        position = self._edgePositions(src, dst)
+        for i in np.flatnonzero(position < 0).tolist():
+            self.pending[(int(src[i]), int(dst[i]))] = float(weights[i])
+        stored = np.flatnonzero(position >= 0)
+        #keep the last occurrence of every stored edge before the scatter
+        last = np.unique(position[stored][::-1], return_index=True)[1]
+        stored = stored[::-1][last]
+        self.graph.data[position[stored]] = weights[stored]
+        self.reverseGraph = None
+        self.heuristicBase = None
+        self.heuristics = OrderedDict()
+        self.pyramidLevels = None
+        self.treeSource = None
+
+    def scenario(self):
+        #engine sharing the CSR structure and the search bounds, with weights and query state of its own
+        self._flush()
+        view = copy.copy(self)
+        view.graph = csr_matrix((self.graph.data.copy(), self.graph.indices, self.graph.indptr), shape=self.graph.shape)
+        view.pending = {}
+        view.queryStats = []
+        view.searches = 0
+        view.reverseGraph = None
+        view.heuristicBase = None
+        view.heuristics = OrderedDict()
+        view.pyramidLevels = None
+        view.treeSource = None
+        return view
+
+    def _flush(self):
+        if not self.pending:
+            return
+        src, dst, weight = self._edgeArrays()
+        extra = np.array(list(self.pending.keys()), dtype=np.int64).reshape(-1, 2)
+        self._build(np.concatenate((src, extra[:, 0])), np.concatenate((dst, extra[:, 1])),
+                    np.concatenate((weight, list(self.pending.values()))), self.cells)
+        self.pending = {}
+
+    def path_weights(self, path):
+        #weight of each consecutive edge of a path, without a search
+        self._flush()
+        position = self._edgePositions(path[:-1], path[1:])
+        if (position < 0).any():
+            missing = int(np.flatnonzero(position < 0)[0])
+            raise KeyError((path[missing], path[missing + 1]))
+        return self.graph.data[position]
+
+    def affected_routes(self, routes, changes):
+        """Pairs of routes ({pair: (weight, path)}) that may no longer be shortest after the edge weight
+        changes ({(u, v): old weight}, inf for a new edge), the engine already holding the new weights.
+        A route is kept when none of its edges changed and, for every edge that got cheaper, a lower
+        bound of the shortest path through it, bound(source, u) + weight + bound(v, target) on the
+        octile and portal bounds of the new surface, is no less than the route weight. Any other path
+        costs at least what it did, so a kept route is still shortest. The approximate pyramid method
+        keeps only routes with no changed edge while no edge got cheaper."""
+        self._flush()
+        if not changes or not routes:
+            return set()
+        changed = np.array(list(changes.keys()), dtype=np.int64).reshape(-1, 2)
+        old = np.array(list(changes.values()), dtype=np.float64)
+        position = self._edgePositions(changed[:, 0], changed[:, 1])
+        new = np.where(position >= 0, self.graph.data[np.maximum(position, 0)], np.inf)
+        moved = new != old
+        changed, old, new = changed[moved], old[moved], new[moved]
+        if len(changed) == 0:
+            return set()
+        cheaper = new < old
+        changedKeys = np.sort((changed[:, 0] << 32) + changed[:, 1])
+
+        bounded = self.method in ('dijkstra', 'astar', 'corridor') and self.gridWidth is not None
+        if bounded and cheaper.any():
+            toPortal, fromPortal, _ = self._getHeuristicBase()
+            cheapSrc = np.searchsorted(self.cells, changed[cheaper, 0])
+            cheapDst = np.searchsorted(self.cells, changed[cheaper, 1])
+            cheapWeight = new[cheaper]
+
+        affected = set()
+        for pair, (weight, path) in routes.items():
+            path = np.asarray(path, dtype=np.int64)
+            edgeKeys = (path[:-1] << 32) + path[1:]
+            hit = np.searchsorted(changedKeys, edgeKeys)
+            if (changedKeys[np.minimum(hit, len(changedKeys) - 1)] == edgeKeys).any():
+                affected.add(pair)
+                continue
+            if not cheaper.any():
+                continue
+            if not bounded:
+                affected.add(pair)
+                continue
+            sourceIndex, targetIndex = self._nodeIndex(pair[0]), self._nodeIndex(pair[1])
+            toU = self._octileBound(self.cells[cheapSrc], pair[0])
+            fromV = self._octileBound(self.cells[cheapDst], pair[1])
+            if toPortal is not None:
+                toU = np.minimum(toU, toPortal[sourceIndex] + fromPortal[cheapSrc])
+                fromV = np.minimum(fromV, toPortal[cheapDst] + fromPortal[targetIndex])
+            if (toU + cheapWeight + fromV < weight - 1e-9 * max(abs(weight), 1.0)).any():
+                affected.add(pair)
+        return affected
+
+    def _searchFrom(self, source):
+        #full search tree from source, returns the nodes it settled (0 when the last tree is reused)
+        self._flush()
+        settled = 0
+        if self.treeSource != source:
+            self.treeDist, self.treePred = dijkstra(self.graph, directed=True, indices=self._nodeIndex(source),
+                                                    return_predecessors=True)
+            self.treeSource = source
+            self.searches += 1
+            settled = int(np.isfinite(self.treeDist).sum())
+        return settled
+
+    def _octileBound(self, cells, target):
+        #cheapest cost of crossing the grid from cells to target with the minimum step costs
+        rows, cols = np.divmod(np.asarray(cells, dtype=np.int64) - 1, self.gridWidth)
+        targetRow, targetCol = divmod(int(target) - 1, self.gridWidth)
+        dr = np.abs(rows - targetRow)
+        dc = np.abs(cols - targetCol)
+        far, near = np.maximum(dr, dc), np.minimum(dr, dc)
+        straight, diagonal = self.stepMin
+        return np.minimum.reduce([straight * (far - near) + diagonal * near, diagonal * far, straight * (far + near)])
+
+    def _getHeuristicBase(self):
+        """Lower bound distances to and from the portal cells on the step bound graph, and the portal
+        cells. A path that uses a portal costs at least toPortal[u] + fromPortal[target], which keeps
+        the heuristic admissible next to zero cost pipelines."""
+        if self.heuristicBase is None:
+            row = np.repeat(np.arange(len(self.cells)), np.diff(self.graph.indptr))
+            portal = self.graph.data < self.stepBound
+            portal |= self.stepBound == 0
+            if self.landmarkTable is not None:
+                portal |= self.graph.data < self.landmarkBound - self.landmarkSlack
+            portalCells = np.unique(np.concatenate((row[portal], self.graph.indices[portal])))
+            if len(portalCells) == 0:
+                self.heuristicBase = (None, None, portalCells)
+            else:
+                keep = ~portal
+                bounds = csr_matrix((self.stepBound[keep], (row[keep], self.graph.indices[keep])), shape=self.graph.shape)
+                toPortal = dijkstra(bounds.T.tocsr(), directed=True, indices=portalCells, min_only=True)
+                fromPortal = dijkstra(bounds, directed=True, indices=portalCells, min_only=True)
+                self.heuristicBase = (toPortal, fromPortal, portalCells)
+        return self.heuristicBase
+
+    def _landmarkBound(self, targetIndex):
+        #ALT lower bound to the target: d(u, L) - d(target, L) and d(L, target) - d(L, u) for every landmark
+        with np.errstate(invalid='ignore'):
+            bound = np.maximum(self.toLandmark - self.toLandmark[:, targetIndex:targetIndex + 1],
+                               self.fromLandmark[:, targetIndex:targetIndex + 1] - self.fromLandmark)
+        return np.nan_to_num(bound, nan=0.0, posinf=np.inf, neginf=0.0).max(axis=0) - self.landmarkSlack
+
+    def _landmarkBoundFrom(self, sourceIndex):
+        #ALT lower bound from the source: d(L, u) - d(L, source) and d(source, L) - d(u, L) for every landmark
+        with np.errstate(invalid='ignore'):
+            bound = np.maximum(self.fromLandmark - self.fromLandmark[:, sourceIndex:sourceIndex + 1],
+                               self.toLandmark[:, sourceIndex:sourceIndex + 1] - self.toLandmark)
+        return np.nan_to_num(bound, nan=0.0, posinf=np.inf, neginf=0.0).max(axis=0) - self.landmarkSlack
+
+    def _boundTo(self, targetIndex):
+        #lower bound of the cost from every cell to the target: octile or ALT bound, or through a portal
+        bound = self._octileBound(self.cells, self.cells[targetIndex])
+        if self.landmarkTable is not None:
+            bound = np.maximum(bound, self._landmarkBound(targetIndex))
+        toPortal, fromPortal, _ = self._getHeuristicBase()
+        if toPortal is not None:
+            bound = np.minimum(bound, toPortal + fromPortal[targetIndex])
+        return bound
+
+    def _boundFrom(self, sourceIndex):
+        #lower bound of the cost from the source to every cell
+        bound = self._octileBound(self.cells, self.cells[sourceIndex])
+        if self.landmarkTable is not None:
+            bound = np.maximum(bound, self._landmarkBoundFrom(sourceIndex))
+        toPortal, fromPortal, _ = self._getHeuristicBase()
+        if toPortal is not None:
+            bound = np.minimum(bound, toPortal[sourceIndex] + fromPortal)
+        return bound
+
+    def _heuristic(self, targetIndex):
+        #_boundTo of a target, kept for the last HEURISTIC_TARGETS targets until the weights change
+        if targetIndex in self.heuristics:
+            self.heuristics.move_to_end(targetIndex)
+        else:
+            self.heuristics[targetIndex] = self._boundTo(targetIndex)
+            while len(self.heuristics) > HEURISTIC_TARGETS:
+                self.heuristics.popitem(last=False)
+        return self.heuristics[targetIndex]
+
+    def _astar(self, source, target):
+        """A* on the CSR with h = min(octile step bound or ALT bound to target, portal bound). h is
+        admissible but not consistent across portals, so improved nodes are reopened and the first
+        time the target is taken from the heap its cost is optimal."""
+        sourceIndex = self._nodeIndex(source)
+        targetIndex = self._nodeIndex(target)
+        #item() reads one python float, no list of the whole surface is built per query
+        heuristic = self._heuristic(targetIndex).item
+
+        indptr, indices, data = self.graph.indptr, self.graph.indices, self.graph.data
+        cost = {sourceIndex: 0.0}
+        pred = {sourceIndex: -1}
+        heap = [(heuristic(sourceIndex), sourceIndex)]
+        settled = 0
+        while heap:
+            f, u = heappop(heap)
+            g = cost[u]
+            if f > g + heuristic(u):
+                continue
+            settled += 1
+            if u == targetIndex:
+                break
+            lo, hi = indptr[u], indptr[u + 1]
+            for v, w in zip(indices[lo:hi].tolist(), data[lo:hi].tolist()):
+                nd = g + w
+                if nd < cost.get(v, np.inf):
+                    cost[v] = nd
+                    pred[v] = u
+                    heappush(heap, (nd + heuristic(v), v))
+
+        self.searches += 1
+        if targetIndex not in pred:
+            raise nx.NetworkXNoPath("No path between %s and %s." %(source, target))
+        path = [targetIndex]
+        while pred[path[-1]] >= 0:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return cost[targetIndex], self.cells[path].tolist(), settled
+
+    def _corridorMask(self, source, target, slack, buffer):
+        #cells inside the ellipse with foci at source and target, in cell units
+        rows, cols = np.divmod(self.cells - 1, self.gridWidth)
+        sourceRow, sourceCol = divmod(int(source) - 1, self.gridWidth)
+        targetRow, targetCol = divmod(int(target) - 1, self.gridWidth)
+        toSource = np.hypot(rows - sourceRow, cols - sourceCol)
+        toTarget = np.hypot(rows - targetRow, cols - targetCol)
+        span = np.hypot(targetRow - sourceRow, targetCol - sourceCol)
+        return toSource + toTarget <= (1 + slack) * span + 2 * buffer
+
+    def _searchInMask(self, source, target, mask):
+        """Shortest path restricted to the cells in mask. Returns (weight, path, settled) with weight
+        inf and path None when the target cannot be reached inside the mask."""
+        sourceIndex = self._nodeIndex(source)
+        targetIndex = self._nodeIndex(target)
+        mask[[sourceIndex, targetIndex]] = True
+        inside = np.flatnonzero(mask)
+        local = np.full(len(self.cells), -1, dtype=np.int64)
+        local[inside] = np.arange(len(inside))
+        dist, pred = dijkstra(self.graph[inside][:, inside], directed=True, indices=local[sourceIndex],
+                              return_predecessors=True)
+        self.searches += 1
+        settled = int(np.isfinite(dist).sum())
+        if not np.isfinite(dist[local[targetIndex]]):
+            return np.inf, None, settled
+
+        path = [local[targetIndex]]
+        while pred[path[-1]] >= 0:
+            path.append(pred[path[-1]])
+        path = inside[path[::-1]]
+        return float(dist[local[targetIndex]]), self.cells[path].tolist(), settled
+
+    def _corridorSearch(self, source, target):
+        """Route inside the ellipse around the endpoints plus the portal cells (pipelines, tie-ins),
+        then check it against the lower bound of the paths leaving the corridor: a path through a
+        cell c costs at least bound(source, c) + bound(c, target). When a cell outside has a bound
+        below the route weight the corridor is widened once to every such cell, so the route is
+        exact in both cases and only the number of cells searched depends on the bounds."""
+        sourceIndex = self._nodeIndex(source)
+        targetIndex = self._nodeIndex(target)
+        mask = self._corridorMask(source, target, self.corridorSlack, self.corridorBuffer)
+        mask[self._getHeuristicBase()[2]] = True
+        weight, path, settled = self._searchInMask(source, target, mask)
+
+        through = self._boundFrom(sourceIndex) + self._boundTo(targetIndex)
+        cheaper = through < weight - 1e-9 * max(abs(weight), 1.0) if np.isfinite(weight) else np.isfinite(through)
+        expansions = 0
+        if (cheaper & ~mask).any():
+            weight, path, searched = self._searchInMask(source, target, mask | cheaper)
+            settled += searched
+            expansions = 1
+        if path is None:
+            raise nx.NetworkXNoPath("No path between %s and %s." %(source, target))
+        return weight, path, settled, expansions
+
+    def _getPyramidLevels(self):
+        """(factor, coarseWidth, engine) of every pyramid level. The portal edges of the full surface
+        (pipelines, tie-ins, anything cheaper than a grid step) are carried up to each level between
+        the coarse cells of their ends, so the coarse route can follow them. A coarse edge whose fine
+        edges are all blocked (BLOCKED_WEIGHT or more) is dropped, so the coarse route avoids it."""
+        if self.pyramidLevels is None:
+            row = np.repeat(np.arange(len(self.cells)), np.diff(self.graph.indptr))
+            fineSrc, fineDst = self.cells[row], self.cells[self.graph.indices]
+            portal = (self.graph.data < self.stepBound) | (self.stepBound == 0)
+            blocked = self.graph.data >= BLOCKED_WEIGHT
+            self.pyramidLevels = []
+            for factor, coarseWidth, src, dst, weight in self.pyramid:
+                rows, cols = np.divmod(fineSrc - 1, self.gridWidth)
+                coarseSrc = (rows // factor) * coarseWidth + cols // factor + 1
+                rows, cols = np.divmod(fineDst - 1, self.gridWidth)
+                coarseDst = (rows // factor) * coarseWidth + cols // factor + 1
+                between = coarseSrc != coarseDst
+
+                #coarse edges crossed only by blocked fine edges
+                keyBase = int(max(coarseSrc.max(initial=0), coarseDst.max(initial=0), src.max(initial=0), dst.max(initial=0))) + 1
+                keys, inverse = np.unique(coarseSrc[between] * keyBase + coarseDst[between], return_inverse=True)
+                passable = np.bincount(inverse, weights=~blocked[between], minlength=len(keys))
+                keep = ~np.isin(src * keyBase + dst, keys[passable == 0])
+                src, dst, weight = src[keep], dst[keep], weight[keep]
+
+                carried = between & portal
+                src = np.concatenate((src, coarseSrc[carried]))
+                dst = np.concatenate((dst, coarseDst[carried]))
+                weight = np.concatenate((weight, self.graph.data[carried]))
+                #the last weight of an edge wins, so the cheapest goes last
+                order = np.argsort(-weight, kind='stable')
+                self.pyramidLevels.append((factor, coarseWidth, routingEngine(src[order], dst[order], weight[order],
+                                                                              gridWidth=coarseWidth)))
+        return self.pyramidLevels
+
+    def _pyramidMask(self, cells, cellWidth, cellFactor, path, pathWidth, pathFactor, buffer):
+        #cells (cellFactor x cellFactor fine cells each) whose pathFactor cell is within buffer of the coarser path
+        pathRows, pathCols = np.divmod(np.asarray(path, dtype=np.int64) - 1, pathWidth)
+        offsets = np.arange(-buffer, buffer + 1)
+        rows = (pathRows[:, None, None] + offsets[None, :, None]).repeat(len(offsets), axis=2).ravel()
+        cols = (pathCols[:, None, None] + offsets[None, None, :]).repeat(len(offsets), axis=1).ravel()
+        valid = (rows >= 0) & (cols >= 0) & (cols < pathWidth)
+        near = np.unique(rows[valid] * pathWidth + cols[valid])
+        cellRows, cellCols = np.divmod(cells - 1, cellWidth)
+        parent = (cellRows * cellFactor // pathFactor) * pathWidth + cellCols * cellFactor // pathFactor
+        return np.isin(parent, near)
+
+    def _pyramidSearch(self, source, target):
+        """Route on the coarsest level, then on every finer level and finally the full surface only
+        inside a buffer around the route of the level above. The buffer doubles while no route is
+        found in it or the route found crosses a block (BLOCKED_WEIGHT), up to the whole level, and
+        a level without the endpoints is skipped. The result is approximate: the route can miss a
+        cheaper path outside the buffer."""
+        settled = 0
+        expansions = 0
+        path, pathWidth, pathFactor = None, None, None
+        sourceRow, sourceCol = divmod(int(source) - 1, self.gridWidth)
+        targetRow, targetCol = divmod(int(target) - 1, self.gridWidth)
+        for factor, coarseWidth, engine in self._getPyramidLevels() + [(1, self.gridWidth, self)]:
+            levelSource = (sourceRow // factor) * coarseWidth + sourceCol // factor + 1
+            levelTarget = (targetRow // factor) * coarseWidth + targetCol // factor + 1
+            if factor != 1 and (not engine.has_node(levelSource) or not engine.has_node(levelTarget)):
+                continue
+            buffer = self.pyramidBuffer
+            levelPath = None
+            while True:
+                if path is None:
+                    mask = np.ones(len(engine.cells), dtype=bool)
+                else:
+                    mask = self._pyramidMask(engine.cells, coarseWidth, factor, path, pathWidth, pathFactor, buffer)
+                if mask.all():
+                    engine._searchFrom(levelSource)
+                    levelIndex = engine._nodeIndex(levelTarget)
+                    settled += int(np.isfinite(engine.treeDist).sum())
+                    if not np.isfinite(engine.treeDist[levelIndex]):
+                        if factor == 1:
+                            raise nx.NetworkXNoPath("No path between %s and %s." %(source, target))
+                        break
+                    levelPath = [levelIndex]
+                    while engine.treePred[levelPath[-1]] >= 0:
+                        levelPath.append(engine.treePred[levelPath[-1]])
+                    weight, levelPath = float(engine.treeDist[levelIndex]), engine.cells[levelPath[::-1]].tolist()
+                    break
+                weight, levelPath, searched = engine._searchInMask(levelSource, levelTarget, mask)
+                settled += searched
+                if (levelPath is not None) and (weight < BLOCKED_WEIGHT):
+                    break
+                levelPath = None
+                buffer *= 2
+                expansions += 1
+            if levelPath is not None:
+                path, pathWidth, pathFactor = levelPath, coarseWidth, factor
+        return weight, path, settled, expansions
+
+    def _stepDistance(self, cells, root):
+        #octile distance in grid steps between cells and root
+        dr, dc = np.divmod(np.asarray(cells, dtype=np.int64) - 1, self.gridWidth)
+        rootRow, rootCol = divmod(int(root) - 1, self.gridWidth)
+        dr = np.abs(dr - rootRow)
+        dc = np.abs(dc - rootCol)
+        return np.maximum(dr, dc) + (np.sqrt(2) - 1) * np.minimum(dr, dc)
+
+    def _boundedTree(self, root, targets, reverse=False):
+        """Single source search from root (towards root on the reversed graph when reverse) that
+        stops once every target is settled. csgraph cannot stop on targets, so the search runs
+        with a distance limit that grows until all targets are inside it; every node within the
+        limit has its exact distance and predecessor. Returns (dist, pred, settled), settled counts
+        the nodes of every attempt."""
+        if reverse and self.reverseGraph is None:
+            self.reverseGraph = self.graph.T.tocsr()
+        graph = self.reverseGraph if reverse else self.graph
+        rootIndex = self._nodeIndex(root)
+        targetIndex = np.array([self._nodeIndex(target) for target in targets])
+
+        limit = np.inf
+        if self.gridWidth is not None:
+            limit = 2 * self.meanStepCost * max(float(self._stepDistance(targets, root).max()), 1.0)
+        settled = 0
+        for attempt in range(4):
+            dist, pred = dijkstra(graph, directed=True, indices=rootIndex, return_predecessors=True, limit=limit)
+            self.searches += 1
+            settled += int(np.isfinite(dist).sum())
+            if np.isfinite(dist[targetIndex]).all() or not np.isfinite(limit):
+                return dist, pred, settled
+            limit *= 4
+        dist, pred = dijkstra(graph, directed=True, indices=rootIndex, return_predecessors=True)
+        self.searches += 1
+        return dist, pred, settled + int(np.isfinite(dist).sum())
+
+    def _groupPairs(self, pairs):
+        #greedy cover of the pairs by shared endpoints: a (u, 'forward') group routes every pair
+        #starting at u from one tree, a (v, 'reverse') group every pair ending at v
+        groups = defaultdict(set)
+        for pair in pairs:
+            groups[(pair[0], 'forward')].add(pair)
+            groups[(pair[1], 'reverse')].add(pair)
+        remaining = set(pairs)
+        chosen = []
+        while remaining:
+            key = max(groups, key=lambda key: len(groups[key] & remaining))
+            members = groups.pop(key) & remaining
+            chosen.append((key[0], key[1] == 'reverse', members))
+            remaining -= members
+        return chosen
+
+    def _routeGroup(self, root, reverse, members):
+        #(weight, path) of the pairs of one endpoint group from a single bounded tree, the tree is one queryStats entry
+        start_time = time.time()
+        ends = [pair[0] if reverse else pair[1] for pair in members]
+        dist, pred, settled = self._boundedTree(root, ends, reverse)
+        routes = {}
+        for pair, end in zip(members, ends):
+            endIndex = self._nodeIndex(end)
+            if not np.isfinite(dist[endIndex]):
+                raise nx.NetworkXNoPath("No path between %s and %s." %(pair[0], pair[1]))
+            path = [endIndex]
+            while pred[path[-1]] >= 0:
+                path.append(pred[path[-1]])
+            if not reverse:
+                path.reverse()
+            path = self.cells[path].tolist()
+            weights = self.path_weights(path)
+            routes[pair] = (float(np.cumsum(weights)[-1]) if len(weights) else 0.0, path)
+        self.queryStats.append({"source": None if reverse else root, "target": root if reverse else None, "method": 'tree',
+                                "pairs": len(members), "settled": settled, "seconds": time.time() - start_time})
+        return routes
+
+    def shortest_paths(self, pairs, workers=1, exact=False):
+        """Shortest (weight, path) for every (source, target) in pairs, one search per shared endpoint,
+        returned in the order of pairs. With method='astar' an endpoint shared by no other pair is
+        routed with a single A* query, with 'corridor' and 'pyramid' every pair gets its own search. Weights are summed along the path from the source, as a
+        single query would.
+        workers > 1 (None for all cores) routes the endpoint groups in a process pool that reads
+        the CSR from one shared memory block, every group then uses a bounded tree.
+        exact=True routes every group with bounded trees whatever the method, for reference costs."""
+        method = 'dijkstra' if exact else self.method
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self._flush()
+        order = {pair: i for i, pair in enumerate(dict.fromkeys((pair[0], pair[1]) for pair in pairs))}
+        groups = [(root, reverse, sorted(members, key=order.get)) for root, reverse, members in self._groupPairs(list(order))]
+        routes = {}
+        if workers > 1 and len(groups) > 1:
+            routes = self._routeGroupsParallel(groups, workers)
+        else:
+            for root, reverse, members in groups:
+                if (method == 'astar' and len(members) == 1) or method in ('corridor', 'pyramid'):
+                    for pair in members:
+                        path = self.shortest_path(*pair)[1]
+                        weights = self.path_weights(path)
+                        routes[pair] = (float(np.cumsum(weights)[-1]) if len(weights) else 0.0, path)
+                else:
+                    routes.update(self._routeGroup(root, reverse, members))
+        return {pair: routes[pair] for pair in order}
+
+    def _routeGroupsParallel(self, groups, workers):
+        #largest groups first, dealt round robin so every batch gets a similar share of the searches
+        groups = sorted(groups, key=lambda group: -len(group[2]))
+        nBatches = min(len(groups), workers * BATCHES_PER_WORKER)
+        batches = [groups[i::nBatches] for i in range(nBatches)]
+        block, layout = _shareGraph(self.cells, self.graph)
+        routes = {}
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, nBatches)) as executor:
+                futures = [executor.submit(_routeGroupsWorker, layout, self.gridWidth, batch) for batch in batches]
+                for future in futures:
+                    batchRoutes, searches, stats = future.result()
+                    routes.update(batchRoutes)
+                    self.searches += searches
+                    self.queryStats.extend(stats)
+        finally:
+            block.close()
+            block.unlink()
+        return routes
+
+    def shortest_path(self, source, target):
+        start_time = time.time()
+        stats = {}
+        if self.method == 'astar':
+            self._flush()
+            weight, path, settled = self._astar(source, target)
+        elif self.method == 'corridor':
+            self._flush()
+            weight, path, settled, stats["expansions"] = self._corridorSearch(source, target)
+        elif self.method == 'pyramid':
+            self._flush()
+            weight, path, settled, stats["expansions"] = self._pyramidSearch(source, target)
+        else:
+            settled = self._searchFrom(source)
+            targetIndex = self._nodeIndex(target)
+            if not np.isfinite(self.treeDist[targetIndex]):
+                raise nx.NetworkXNoPath("No path between %s and %s." %(source, target))
+            path = [targetIndex]
+            while self.treePred[path[-1]] >= 0:
+                path.append(self.treePred[path[-1]])
+            path.reverse()
+            weight, path = float(self.treeDist[targetIndex]), self.cells[path].tolist()
+        stats.update({"source": source, "target": target, "method": self.method, "pairs": 1,
+                      "settled": settled, "seconds": time.time() - start_time})
+        self.queryStats.append(stats)
+        return weight, path
+
+
+def _sharedGraphArrays(block, layout):
+    #cells, indptr, indices and data of a CSR packed one after the other in a shared memory block
+    arrays = []
+    offset = 0
+    for dtype, size in layout["arrays"]:
+        arrays.append(np.ndarray(size, dtype=dtype, buffer=block.buf, offset=offset))
+        offset += np.dtype(dtype).itemsize * size
+    return arrays
+
+
+def _shareGraph(cells, graph):
+    arrays = [cells, graph.indptr, graph.indices, graph.data]
+    layout = {"arrays": [(array.dtype.str, len(array)) for array in arrays]}
+    block = shared_memory.SharedMemory(create=True, size=max(sum(array.nbytes for array in arrays), 1))
+    for shared, array in zip(_sharedGraphArrays(block, layout), arrays):
+        shared[:] = array
+    layout["name"] = block.name
+    return block, layout
+
+
+def _routeGroupsWorker(layout, gridWidth, groups):
+    #runs in a routing worker: attach to the shared CSR without copying it and route a batch of endpoint groups
+    block = shared_memory.SharedMemory(name=layout["name"])
+    #attaching registers the name with the resource tracker shared with the parent, which unlinks the block
+    cells, indptr, indices, data = _sharedGraphArrays(block, layout)
+    engine = routingEngine([], [], [], gridWidth=gridWidth)
+    engine._setGraph(cells, csr_matrix((data, indices, indptr), shape=(len(cells), len(cells)), copy=False))
+    routes = {}
+    for root, reverse, members in groups:
+        routes.update(engine._routeGroup(root, reverse, members))
+    searches, stats = engine.searches, engine.queryStats
+    del engine, cells, indptr, indices, data
+    block.close()
+    return routes, searches, stats
@@ -0,0 +1,100 @@
+from geotransformation import DEFAULT_TILE_SIZE, DEFAULT_PYRAMID_FACTORS
+from costTiles import DEFAULT_MAX_TILES
+from compactCost import COMPACT_DTYPES
+from routeCache import DEFAULT_MAX_ROUTES
+from routingEngine import ROUTING_METHODS, DEFAULT_CORRIDOR_SLACK, DEFAULT_CORRIDOR_BUFFER
+
+
+REGION_SHAPES = ('bbox', 'hull')
+
+
+class costSurfaceOptions:
+    """Settings of alternateNetworkGeo.initialize_cost_surface, checked together on construction.
+    The options of a mode left as None take their default when the mode is on and raise a
+    ValueError when it is off, so a setting that would be ignored is never silently dropped.
+    region_points, asset_points, buffer_km, buffer_factor, region_shape: the subset window
+    tiled, tile_size, max_tiles, workers: the out-of-core tile store and the csv parse
+    compact, raster: the in-memory store, at most one of them and neither with tiled
+    routing, landmarks, routing_workers: the routing engine (landmarks for astar and corridor only)
+    corridor_slack, corridor_buffer: routing='corridor' only
+    pyramid_factors: routing='pyramid' only
+    route_cache, route_cache_size: the on-disk route cache"""
+    def __init__(self, region_points=None, asset_points=None, buffer_km=None, buffer_factor=1.0, region_shape='bbox',
+                 tiled=False, tile_size=None, max_tiles=None, workers=1, compact=None, raster=False,
+                 routing='dijkstra', landmarks=0, routing_workers=1, corridor_slack=None, corridor_buffer=None,
+                 pyramid_factors=None, route_cache=False, route_cache_size=None):
+        self.region_points = region_points
+        self.asset_points = asset_points
+        self.buffer_km = buffer_km
+        self.buffer_factor = buffer_factor
+        self.region_shape = region_shape
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.workers = workers
+        self.compact = compact
+        self.raster = raster
+        self.routing = routing
+        self.landmarks = landmarks
+        self.routing_workers = routing_workers
+        self.corridor_slack = corridor_slack
+        self.corridor_buffer = corridor_buffer
+        self.pyramid_factors = pyramid_factors
+        self.route_cache = route_cache
+        self.route_cache_size = route_cache_size
+        self._validate()
+        self._fillDefaults()
+
+    def _validate(self):
+        if self.routing not in ROUTING_METHODS:
+            raise ValueError("routing must be one of %s, got %s" %(ROUTING_METHODS, self.routing))
+        if self.region_shape not in REGION_SHAPES:
+            raise ValueError("region_shape must be one of %s, got %s" %(REGION_SHAPES, self.region_shape))
+        if (self.compact is not None) and (self.compact not in COMPACT_DTYPES):
+            raise ValueError("compact must be one of %s, got %s" %(COMPACT_DTYPES, self.compact))
+        if self.buffer_factor <= 0:
+            raise ValueError("buffer_factor must be positive, got %s" %(self.buffer_factor))
+        if self.landmarks < 0:
+            raise ValueError("landmarks must be 0 or more, got %s" %(self.landmarks))
+
+        #the window options need the points the window is built around
+        if self.region_points is None:
+            given = [name for name, unset in (("asset_points", self.asset_points is None), ("buffer_km", self.buffer_km is None),
+                                              ("region_shape", self.region_shape == 'bbox')) if not unset]
+            if given:
+                raise ValueError("%s need region_points" %(", ".join(given)))
+
+        #one store per surface
+        if self.raster and (self.compact is not None):
+            raise ValueError("raster and compact are exclusive, pick one in-memory store")
+        if self.tiled:
+            if self.raster or (self.compact is not None):
+                raise ValueError("the tiled store is out-of-core, it cannot be raster or compact")
+            if (self.routing != 'dijkstra') or self.landmarks or (self.routing_workers != 1):
+                raise ValueError("the tiled store routes on its own, routing, landmarks and routing_workers need an in-memory surface")
+        elif (self.tile_size is not None) or (self.max_tiles is not None):
+            raise ValueError("tile_size and max_tiles need tiled=True")
+
+        #the options of one routing method
+        if self.landmarks and self.routing not in ('astar', 'corridor'):
+            raise ValueError("landmarks need routing='astar' or 'corridor', got %s" %(self.routing))
+        if (self.routing != 'corridor') and ((self.corridor_slack is not None) or (self.corridor_buffer is not None)):
+            raise ValueError("corridor_slack and corridor_buffer need routing='corridor', got %s" %(self.routing))
+        if (self.routing != 'pyramid') and (self.pyramid_factors is not None):
+            raise ValueError("pyramid_factors need routing='pyramid', got %s" %(self.routing))
+        if (self.routing == 'pyramid') and (self.pyramid_factors is not None) and not len(self.pyramid_factors):
+            raise ValueError("routing='pyramid' needs at least one pyramid factor")
+        if (self.route_cache_size is not None) and not self.route_cache:
+            raise ValueError("route_cache_size needs route_cache=True")
+
+    def _fillDefaults(self):
+        if self.tiled:
+            self.tile_size = DEFAULT_TILE_SIZE if self.tile_size is None else self.tile_size
+            self.max_tiles = DEFAULT_MAX_TILES if self.max_tiles is None else self.max_tiles
+        if self.routing == 'corridor':
+            self.corridor_slack = DEFAULT_CORRIDOR_SLACK if self.corridor_slack is None else self.corridor_slack
+            self.corridor_buffer = DEFAULT_CORRIDOR_BUFFER if self.corridor_buffer is None else self.corridor_buffer
+        if self.routing == 'pyramid':
+            self.pyramid_factors = tuple(DEFAULT_PYRAMID_FACTORS if self.pyramid_factors is None else self.pyramid_factors)
+        if self.route_cache:
+            self.route_cache_size = DEFAULT_MAX_ROUTES if self.route_cache_size is None else self.route_cache_size
@@ -0,0 +1,1070 @@
+"""
+Cost surface tests on a small synthetic CostMAP style surface (cost_edges, written
+to a temporary file by cost_file), so they run without construction-costs-subset.csv.
+"""
+
+import sys
+import os
+import time
+import json
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+from geopy.distance import distance
+from geotransformation import geoTransformation, lambertDistance
+from costTiles import costTileStore
+from compactCost import compactCostStore
+from rasterCost import rasterCostStore
+from routingEngine import routingEngine, buildLandmarks
+from routeCache import routeCache, routeKey
+from alternateNetworkGeo import alternateNetworkGeo, get_shared_surface, sharedRouters
+from pipelineRegistry import pipelineRegistry
+from surfaceOptions import costSurfaceOptions
+
+
+WIDTH = 12
+HEIGHT = 10
+LOWER_LEFT_X = -98.0
+LOWER_LEFT_Y = 35.0
+CELL_SIZE = 0.008333
+
+
+def neighbors(cell, width=WIDTH, height=HEIGHT):
+    """8-connected neighbours of a 1-based, row-major cell."""
+    row, col = divmod(cell - 1, width)
+    result = []
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if (dr, dc) == (0, 0):
+                continue
+            r, c = row + dr, col + dc
+            if 0 <= r < height and 0 <= c < width:
+                result.append(r * width + c + 1)
+    return result
+
+
+def cost_edges(seed=0, width=WIDTH, height=HEIGHT):
+    """Return the {(start, end): cost} dict of the synthetic surface write_cost_file writes."""
+    rng = np.random.default_rng(seed)
+    expected = {}
+    for cell in range(1, width * height + 1):
+        nbrs = neighbors(cell, width, height)
+        costs = np.round(rng.uniform(1, 60, len(nbrs)), 4)
+        for n, c in zip(nbrs, costs):
+            expected[(cell, n)] = float(c)
+    return expected
+
+
+def write_cost_file(path, seed=0, width=WIDTH, height=HEIGHT):
+    """
+    Write a CostMAP construction cost file: 8 header lines followed by
+    alternating neighbour / cost lines for every cell.
+
+    Returns the {(start, end): cost} dict the file encodes.
+    """
+    expected = cost_edges(seed, width, height)
+    with open(path, 'w') as f:
+        f.write("CostMAP construction costs\n")
+        f.write("synthetic test surface\n")
+        f.write(f"gridWidth,{width}\n")
+        f.write(f"gridHeight,{height}\n")
+        f.write(f"lowerLeftX,{LOWER_LEFT_X}\n")
+        f.write(f"lowerLeftY,{LOWER_LEFT_Y}\n")
+        f.write(f"cellSize,{CELL_SIZE}\n")
+        f.write("noDataValue,-9999\n")
+        for cell in range(1, width * height + 1):
+            nbrs = neighbors(cell, width, height)
+            f.write(",".join(str(n) for n in [cell] + nbrs) + "\n")
+            f.write(",".join(repr(expected[(cell, n)]) for n in nbrs) + "\n")
+    return expected
+
+
+@contextmanager
+def cost_file(**kwargs):
+    #temporary folder with a written cost file, yields its path and the edges written (see write_cost_file)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "costs.csv")
+        yield path, write_cost_file(path, **kwargs)
+
+
+def make_gt(path):
+    gt = geoTransformation()
+    gt.costFilePath = Path(path)
+    #window covering the whole synthetic grid
+    gt.north = LOWER_LEFT_Y + (HEIGHT - 0.5) * CELL_SIZE
+    gt.south = LOWER_LEFT_Y + 0.5 * CELL_SIZE
+    gt.west = LOWER_LEFT_X + 0.5 * CELL_SIZE
+    gt.east = LOWER_LEFT_X + (WIDTH - 0.5) * CELL_SIZE
+    return gt
+
+
+def run_test():
+    with cost_file() as (path, expected):
+        #csv path
+        gt_csv = make_gt(path)
+        gt_csv.processGeoCost(useCache=False)
+        assert gt_csv.getEdegsDict() == expected, "csv parse does not match the written surface"
+
+        #first cached run converts, second run only memory maps
+        gt = make_gt(path)
+        gt.processGeoCost()
+        assert gt._getCachePath().joinpath("header.json").exists(), "cache was not written"
+        assert gt.getEdegsDict() == expected, "cached surface does not match the csv"
+
+        gt = make_gt(path)
+        assert gt._cacheIsCurrent(), "fresh cache reported as stale"
+        gt.processGeoCost()
+        assert isinstance(gt.costData, np.memmap), "cache was not memory mapped"
+        assert gt.edgeSrc is None and gt.getEdgeArrays()[0] is not None, "window edges not sliced on first use"
+        assert (gt.getWidth(), gt.getHeight(), gt.getCellSize()) == (WIDTH, HEIGHT, CELL_SIZE)
+
+        #touching the file without changing it keeps the cache
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        assert gt._cacheIsCurrent(), "unchanged content should not invalidate the cache"
+
+        #new content invalidates it
+        expected = write_cost_file(path, seed=1)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 2 * 10**9))
+        gt = make_gt(path)
+        assert not gt._cacheIsCurrent(), "changed content not detected"
+        gt.processGeoCost()
+        assert gt.getEdegsDict() == expected, "rebuilt cache does not match the new csv"
+
+        #the cache is written block by block, a file out of cell order gets the same rows from a second pass
+        with open(path) as f:
+            lines = f.read().splitlines()
+        pairs = [lines[i:i + 2] for i in range(8, len(lines), 2)]
+        shuffled = os.path.join(os.path.dirname(path), "shuffled.csv")
+        with open(shuffled, 'w') as f:
+            f.write("\n".join(lines[:8] + [line for pair in pairs[::-1] for line in pair]) + "\n")
+        reordered = make_gt(shuffled)
+        reordered._loadcost = None
+        reordered.processGeoCost()
+        assert reordered.getEdegsDict() == expected
+        assert np.array_equal(reordered.costIndices, gt.costIndices) and np.array_equal(reordered.costData, gt.costData)
+
+    print("PASS -- cost surface cache")
+
+
+def run_window_test():
+    with cost_file() as (path, expected):
+        gt = make_gt(path)
+        gt.north = LOWER_LEFT_Y + 6.5 * CELL_SIZE
+        gt.south = LOWER_LEFT_Y + 2.5 * CELL_SIZE
+        gt.west = LOWER_LEFT_X + 3.5 * CELL_SIZE
+        gt.east = LOWER_LEFT_X + 8.5 * CELL_SIZE
+        gt._loadgeogrid()
+        gt._subsetGrid()
+        assert (gt.rowMin, gt.rowMax, gt.colMin, gt.colMax) == (3, 7, 3, 8)
+        windowed = {key: value for key, value in expected.items()
+                    if all(3 <= (cell - 1) // WIDTH <= 7 and 3 <= (cell - 1) % WIDTH <= 8 for cell in key)}
+        assert windowed == {key: value for key, value in expected.items() if gt._checkBound(key)}
+
+        #compact renumbering is dense and round trips
+        cells = np.arange(1, WIDTH * HEIGHT + 1)
+        local = gt._toLocalIndex(cells)
+        inside = local >= 0
+        assert np.array_equal(np.sort(local[inside]), np.arange(gt.windowHeight * gt.windowWidth))
+        assert np.array_equal(gt._toGlobalCell(local[inside]), cells[inside])
+
+        #tiny blocks force pairs to straddle block boundaries
+        for blockSize in (64, 257, 1 << 20):
+            src, dst, cost = gt._loadcost(blockSize=blockSize)
+            parsed = dict(zip(zip(src.tolist(), dst.tolist()), cost.tolist()))
+            assert parsed == windowed, f"windowed parse differs for blockSize={blockSize}"
+
+        src, dst, cost = gt._loadcost(subset=False, blockSize=100)
+        assert dict(zip(zip(src.tolist(), dst.tolist()), cost.tolist())) == expected
+
+    print("PASS -- windowed cost parse")
+
+
+def run_transform_test():
+    with cost_file() as (path, _):
+        gt = make_gt(path)
+        gt._loadgeogrid()
+
+        cells = np.arange(1, WIDTH * HEIGHT + 1)
+        lat, lon = gt._cellToLatLonArray(cells)
+        assert [(a, b) for a, b in zip(lat.tolist(), lon.tolist())] == [gt._cellToLatLon(c) for c in cells]
+        x, y = gt._cellToXYArray(cells)
+        assert [[a, b] for a, b in zip(x.tolist(), y.tolist())] == [gt._cellToXY(c) for c in cells]
+        assert np.array_equal(gt._xyToCellArray(x, y), cells)
+
+        rng = np.random.default_rng(0)
+        lat = LOWER_LEFT_Y + rng.uniform(0, HEIGHT * CELL_SIZE, 200)
+        lon = LOWER_LEFT_X + rng.uniform(0, WIDTH * CELL_SIZE, 200)
+        assert gt._latlonToCellArray(lat, lon).tolist() == [gt._latlonToCell(a, b) for a, b in zip(lat, lon)]
+        x, y = gt._latlonToXYArray(lat, lon)
+        assert [[a, b] for a, b in zip(x.tolist(), y.tolist())] == [gt._latlonToXY(a, b) for a, b in zip(lat, lon)]
+
+        #polylines become 8-connected cell chains through every vertex
+        vertices = gt._latlonToCellArray(lat[:20], lon[:20])
+        line = gt._rasterizePolyline(vertices)
+        rows, cols = gt._cellToRowCol(line)
+        assert np.maximum(np.abs(np.diff(rows)), np.abs(np.diff(cols))).tolist() == [1] * (len(line) - 1)
+        assert set(vertices.tolist()) <= set(line.tolist()) and line[0] == vertices[0] and line[-1] == vertices[-1]
+        assert gt._rasterizePolyline([5, 5, 5 + 3 * WIDTH]).tolist() == [5, 5 + WIDTH, 5 + 2 * WIDTH, 5 + 3 * WIDTH]
+
+    print("PASS -- array coordinate transforms")
+
+
+def run_region_test():
+    width, height = 80, 70
+    with cost_file(width=width, height=height) as (path, _):
+        #three assets a few km apart in the middle of a ~70 x 60 km grid
+        assets = [(LOWER_LEFT_Y + 30.5 * CELL_SIZE, LOWER_LEFT_X + 30.5 * CELL_SIZE),
+                  (LOWER_LEFT_Y + 36.5 * CELL_SIZE, LOWER_LEFT_X + 40.5 * CELL_SIZE),
+                  (LOWER_LEFT_Y + 30.5 * CELL_SIZE, LOWER_LEFT_X + 44.5 * CELL_SIZE)]
+
+        gt = geoTransformation()
+        gt.costFilePath = Path(path)
+        gt.processGeoCost(regionPoints=assets, bufferKm=10)
+        #10 km is ~11 cells of latitude and ~13 cells of longitude at 35N
+        assert 38 <= gt.windowWidth <= 44 and 26 <= gt.windowHeight <= 30, gt.getWindowShape()
+        src, dst, cost = gt.getEdgeArrays()
+        assert gt._windowMask(src).all() and gt._windowMask(dst).all()
+        asset_cells = [gt._latlonToCell(lat, lon) for lat, lon in assets]
+        assert gt._windowMask(asset_cells).all()
+        bbox_edges = len(src)
+
+        #an explicit buffer under the floor of the derived one is kept as given
+        narrow = geoTransformation()
+        narrow.costFilePath = Path(path)
+        narrow.processGeoCost(regionPoints=assets, bufferKm=3)
+        assert narrow.windowWidth < gt.windowWidth - 10 and narrow.windowHeight < gt.windowHeight - 10, narrow.getWindowShape()
+
+        #the hull drops the corners of the box but keeps the assets
+        hull = geoTransformation()
+        hull.costFilePath = Path(path)
+        hull.processGeoCost(regionPoints=assets, bufferKm=10, regionShape='hull')
+        assert hull.getWindowShape() == gt.getWindowShape()
+        assert hull._windowMask(asset_cells).all()
+        assert 0 < len(hull.getEdgeArrays()[0]) < bbox_edges
+
+        #the cache and the csv parse cut the same hull, on both ends of every edge, and so do the stores
+        parsed = geoTransformation()
+        parsed.costFilePath = Path(path)
+        parsed.processGeoCost(useCache=False, regionPoints=assets, bufferKm=10, regionShape='hull')
+        src, dst, cost = hull.getEdgeArrays()
+        assert hull._windowMask(src).all() and hull._windowMask(dst).all()
+        assert parsed.getEdegsDict() == hull.getEdegsDict()
+        windowed = hull.getEdegsDict()
+        for store in (rasterCostStore(hull), compactCostStore(hull)):
+            stored = {(u, v): w for u in np.unique(src) for v, w in store.out_edges(int(u))}
+            assert stored.keys() == windowed.keys(), type(store).__name__
+
+        #the default buffer follows the asset spacing, densely sampled pipeline vertices do not shrink it
+        points = np.array(assets)
+        brute = np.array([[distance(a, b).km for b in assets] for a in assets])
+        np.fill_diagonal(brute, np.inf)
+        assert abs(gt._meanAssetSpacing(points) - brute.min(axis=1).mean()) < 0.01 * brute.min(axis=1).mean()
+        pipeline = [(LOWER_LEFT_Y + 33.5 * CELL_SIZE, LOWER_LEFT_X + (30.5 + 0.1 * k) * CELL_SIZE) for k in range(100)]
+        spaced = geoTransformation()
+        spaced.costFilePath = Path(path)
+        spaced.processGeoCost(regionPoints=assets + pipeline, bufferFactor=3, assetPoints=assets)
+        dense = geoTransformation()
+        dense.costFilePath = Path(path)
+        dense.processGeoCost(regionPoints=assets + pipeline, bufferFactor=3)
+        assert spaced.windowWidth > dense.windowWidth and spaced.windowHeight > dense.windowHeight
+
+    print("PASS -- asset driven region of interest")
+
+
+def run_tile_test():
+    width, height = 40, 30
+    with cost_file(width=width, height=height) as (path, expected):
+        gt = geoTransformation()
+        gt.costFilePath = Path(path)
+        gt.processGeoCost(tiled=True, tileSize=8)
+        assert gt._tilesAreCurrent(8) and not gt._tilesAreCurrent(16)
+
+        G = nx.DiGraph()
+        G.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+        store = costTileStore(gt.getTilePath(), maxTiles=3)
+        for source, target in [(1, width * height), (width, (height - 1) * width + 1), (15 * width + 20, 17 * width + 22)]:
+            cost, path_cells = store.shortest_path(source, target)
+            assert abs(cost - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9
+            assert abs(cost - sum(expected[edge] for edge in zip(path_cells[:-1], path_cells[1:]))) < 1e-9
+            assert len(store.tiles) <= 3, "LRU cap exceeded"
+
+        #the tiles hand out every stored edge without touching the LRU
+        resident = list(store.tiles)
+        src, dst, weight = store.edge_arrays()
+        assert dict(zip(zip(src.tolist(), dst.tolist()), weight.tolist())) == expected
+        assert list(store.tiles) == resident
+
+        #overrides sit on top of the tiles
+        store.set_weight(1, 2, 0)
+        assert store.get_weight(1, 2) == 0 and store.get_weight(2, 1) == expected[(2, 1)]
+        store.set_weight(1, 3, 0.5)
+        assert store.has_edge(1, 3) and (3, 1) not in store.edges_touching([1])
+        assert (1, 3) in store.edges_touching([3])
+
+    print("PASS -- tiled cost surface")
+
+
+def run_distance_test():
+    rng = np.random.default_rng(0)
+    lat1 = rng.uniform(25, 49, 200)
+    lon1 = rng.uniform(-125, -67, 200)
+    for spread in (0.01, 1.0, 15.0):
+        lat2 = lat1 + rng.uniform(-spread, spread, 200)
+        lon2 = lon1 + rng.uniform(-spread, spread, 200)
+        reference = np.array([distance((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+        error = np.abs(lambertDistance(lat1, lon1, lat2, lon2) - reference) / reference
+        assert error.max() < 1e-3, f"lambert distance off by {error.max():.2%} at spread {spread}"
+
+    with cost_file() as (path, expected):
+        gt = make_gt(path)
+        gt._loadgeogrid()
+
+        cells = [1, 2, WIDTH + 3, 2 * WIDTH + 3, 3 * WIDTH + 4, 4 * WIDTH + 4]
+        cum = gt._getCumulativeLength(cells)
+        assert cum[0] == 0 and np.all(np.diff(cum) > 0)
+        assert abs(cum[-1] - sum(gt._getDistance(a, b) for a, b in zip(cells[:-1], cells[1:]))) < 1e-9
+        assert abs((cum[4] - cum[1]) - gt._getPathDistances(cells[1:5]).sum()) < 1e-9
+        assert gt._getPathDistances([cells[0]]).size == 0
+
+        #per-row edge length table matches the cell centre distance of every raster edge
+        src, dst = np.array(list(expected)).T
+        table = gt._getEdgeLengthArray(src, dst)
+        direct = np.array([gt._getDistance(u, v) for u, v in zip(src, dst)])
+        assert np.allclose(table, direct, rtol=1e-9), "edge length table differs from the direct distance"
+        assert abs(gt._getEdgeLength(1, 3 * WIDTH + 5) - gt._getDistance(1, 3 * WIDTH + 5)) < 1e-9
+
+    print("PASS -- vectorised path length")
+
+
+def run_parallel_test():
+    width, height = 30, 25
+    with cost_file(width=width, height=height) as (path, expected):
+        #text after the blank line that closes the edge list must be ignored
+        with open(path, 'a') as f:
+            f.write("\ntrailing notes,not,part of the edge list\n1,2,3\n")
+
+        gt = geoTransformation()
+        gt.costFilePath = Path(path)
+        gt._loadgeogrid()
+        for rangeSize in (97, 1000, 1 << 20):
+            for _, stop in gt._splitCostRanges(3, rangeSize)[:-1]:
+                with open(path, 'rb') as f:
+                    f.seek(stop)
+                    line, nextLine = f.readline(), f.readline()
+                assert line == b'\n' or gt._isNeighbourLine(line.strip(), nextLine.strip()), \
+                    f"range boundary {stop} is not on a neighbour line"
+            src, dst, cost = gt._loadcost(subset=False, workers=3, rangeSize=rangeSize, blockSize=128)
+            parsed = dict(zip(zip(src.tolist(), dst.tolist()), cost.tolist()))
+            assert parsed == expected, f"parallel parse differs for rangeSize={rangeSize}"
+
+        #windowed ingest and the cache build give the same result as one process
+        gt.north = LOWER_LEFT_Y + 15.5 * CELL_SIZE
+        gt.south = LOWER_LEFT_Y + 4.5 * CELL_SIZE
+        gt.west = LOWER_LEFT_X + 6.5 * CELL_SIZE
+        gt.east = LOWER_LEFT_X + 20.5 * CELL_SIZE
+        gt._subsetGrid()
+        serial = gt._loadcost()
+        parallel = gt._loadcost(workers=2, rangeSize=500)
+        assert all(np.array_equal(a, b) for a, b in zip(serial, parallel))
+
+        cached = geoTransformation()
+        cached.costFilePath = Path(path)
+        cached._buildCostCache(workers=2)
+        cached._loadCostCache()
+        assert int(cached.costIndptr[-1]) == len(expected)
+
+    print("PASS -- parallel cost ingest")
+
+
+def run_compact_test():
+    width, height = 40, 36
+    with cost_file(width=width, height=height) as (path, expected):
+        #make most edges symmetric, keep a few asymmetric ones and drop some one way
+        symmetric = {}
+        for (u, v), c in sorted(expected.items()):
+            if (v, u) in symmetric and (u * v) % 7 != 0:
+                c = symmetric[(v, u)]
+            symmetric[(u, v)] = c
+        dropped = [(u, v) for (u, v) in symmetric if (u + 3 * v) % 29 == 0]
+        for edge in dropped:
+            del symmetric[edge]
+
+        gt = geoTransformation()
+        gt.costFilePath = Path(path)
+        gt._loadgeogrid()
+        gt.north = LOWER_LEFT_Y + (height - 0.5) * CELL_SIZE
+        gt.south = LOWER_LEFT_Y + 0.5 * CELL_SIZE
+        gt.west = LOWER_LEFT_X + 0.5 * CELL_SIZE
+        gt.east = LOWER_LEFT_X + (width - 0.5) * CELL_SIZE
+        gt._subsetGrid()
+        edges = np.array(list(symmetric))
+        gt.edgeSrc, gt.edgeDst = edges[:, 0], edges[:, 1]
+        gt.edgeCost = np.array(list(symmetric.values()))
+
+        G = nx.DiGraph()
+        G.add_weighted_edges_from((u, v, w) for (u, v), w in symmetric.items())
+        for dtype, bound in (('float32', 2.0**-24), ('uint16', None)):
+            store = compactCostStore(gt, dtype=dtype)
+            if bound is None:
+                bound = store.scale / 2 / min(symmetric.values())
+            assert store.maxRelativeError <= bound * (1 + 1e-9), (dtype, store.maxRelativeError, bound)
+            for (u, v), c in symmetric.items():
+                assert abs(store.get_weight(u, v) - c) <= bound * c * (1 + 1e-9)
+            for u, v in dropped:
+                assert not store.has_edge(u, v), f"dropped edge {(u, v)} came back"
+            cost, path_cells = store.shortest_path(1, width * height)
+            assert abs(cost - nx.shortest_path_length(G, 1, width * height, weight='weight')) <= 2 * bound * cost
+
+        #a fully symmetric surface needs no side table and is >10x smaller than the edge arrays
+        keep = gt.edgeSrc < gt.edgeDst
+        src, dst, cost = gt.edgeSrc[keep], gt.edgeDst[keep], gt.edgeCost[keep]
+        gt.edgeSrc, gt.edgeDst, gt.edgeCost = np.concatenate((src, dst)), np.concatenate((dst, src)), np.concatenate((cost, cost))
+        for dtype in ('float32', 'uint16'):
+            store = compactCostStore(gt, dtype=dtype)
+            assert len(store.sideKeys) == 0
+            assert store.nbytes() * 10 < gt.edgeSrc.nbytes + gt.edgeDst.nbytes + gt.edgeCost.nbytes, f"{dtype} store is not 10x smaller"
+
+    print("PASS -- compact cost store")
+
+
+def run_raster_test():
+    with cost_file() as (path, expected):
+        gt = make_gt(path)
+        gt.north = LOWER_LEFT_Y + 8.5 * CELL_SIZE
+        gt.west = LOWER_LEFT_X + 1.5 * CELL_SIZE
+        gt.processGeoCost(useCache=False)
+        windowed = gt.getEdegsDict().copy()
+        store = rasterCostStore(gt)
+        assert store.costs.shape == (gt.windowHeight, gt.windowWidth, 8)
+
+        cells = range(1, WIDTH * HEIGHT + 1)
+        stored = {(u, v): w for u in cells for v, w in store.out_edges(u)}
+        assert stored == windowed, "raster store edges differ from the window"
+        assert all(set(store.in_edges(v)) == {(u, w) for (u, x), w in windowed.items() if x == v} for v in cells)
+
+        G = nx.DiGraph()
+        G.add_weighted_edges_from((u, v, w) for (u, v), w in windowed.items())
+        source, target = min(G.nodes), max(G.nodes)
+        cost, path_cells = store.shortest_path(source, target)
+        assert abs(cost - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9
+
+        store.set_weight(path_cells[0], path_cells[1], 0)
+        assert store.get_weight(path_cells[0], path_cells[1]) == 0
+        assert store.shortest_path(source, target)[0] <= cost
+
+    print("PASS -- raster cost store")
+
+
+def run_routing_test():
+    width, height = 30, 24
+    expected = cost_edges(4, width, height)
+    G = nx.DiGraph()
+    G.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+    edges = np.array([(u, v, w) for (u, v), w in expected.items()])
+    router = routingEngine(edges[:, 0], edges[:, 1], edges[:, 2])
+
+    def same(source, target):
+        cost, path_cells = router.shortest_path(source, target)
+        assert path_cells == nx.shortest_path(G, source, target, weight='weight'), (source, target)
+        assert cost == nx.shortest_path_length(G, source, target, weight='weight'), (source, target)
+
+    pairs = [(1, width * height), (width, (height - 1) * width + 1), (1, 17), (5 * width + 3, 5 * width + 3)]
+    for source, target in pairs:
+        same(source, target)
+    same(1, 17)
+    searches = router.searches
+    same(1, 2 * width + 7)
+    assert router.searches == searches, "the tree of the last source was not reused"
+    cost, path_cells = router.shortest_path(1, width * height)
+    weights = router.path_weights(path_cells)
+    assert weights.tolist() == [expected[edge] for edge in zip(path_cells[:-1], path_cells[1:])]
+    assert np.cumsum(weights)[-1] == cost and router.searches == searches
+
+    #zero cost pipeline edges, an override in place and a new long edge
+    for u, v in [(1, 2), (2, 3), (3, width + 4)]:
+        G[u][v]['weight'] = 0
+        router.set_weight(u, v, 0)
+    G.add_edge(width + 4, 20 * width + 25, weight=0)
+    router.set_weight(width + 4, 20 * width + 25, 0)
+    assert router.has_edge(width + 4, 20 * width + 25)
+    for source, target in pairs:
+        same(source, target)
+
+    #batched queries share one bounded search per endpoint, in both directions
+    grid = routingEngine(*router._edgeArrays(), gridWidth=width)
+    hub, other = 12 * width + 15, 3 * width + 4
+    pairs = [(hub, t) for t in (1, width, 5 * width + 20, 13 * width + 16)] + \
+        [(s, other) for s in (width * height, 20 * width + 2, 4 * width + 5)] + [(7, 9 * width + 9)]
+    routes = grid.shortest_paths(pairs)
+    assert grid.searches < len(pairs), "pairs with a shared endpoint were searched separately"
+    for source, target in pairs:
+        weight, path_cells = routes[(source, target)]
+        assert path_cells == nx.shortest_path(G, source, target, weight='weight'), (source, target)
+        assert abs(weight - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9
+    assert list(routes) == pairs
+
+    #worker processes routing over the shared memory CSR give the same routes in the same order
+    parallel = grid.shortest_paths(pairs, workers=2)
+    assert list(parallel) == pairs and parallel == routes
+
+    #the bounded trees of the endpoint groups are searches in queryStats too, together they route every pair
+    counted = routingEngine(*router._edgeArrays(), gridWidth=width)
+    for workers in (1, 2):
+        counted.queryStats = []
+        counted.shortest_paths(pairs, workers=workers)
+        assert sum(stat["pairs"] for stat in counted.queryStats) == len(set(pairs)), counted.queryStats
+        assert all(stat["method"] == 'tree' and stat["settled"] > 0 for stat in counted.queryStats)
+
+    #A* stays optimal next to the zero cost pipeline and settles less than a full tree
+    star = routingEngine(*router._edgeArrays(), gridWidth=width, method='astar')
+    for source, target in pairs + [(1, width * height), (20 * width + 25, 1), (5 * width + 6, 7 * width + 9)]:
+        cost, path_cells = star.shortest_path(source, target)
+        assert abs(cost - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9, (source, target)
+        assert cost == sum(G[u][v]['weight'] for u, v in zip(path_cells[:-1], path_cells[1:]))
+    assert star.queryStats[-1]["settled"] < len(G) // 4, star.queryStats[-1]
+    #the heuristic of a target is computed once until a weight changes
+    bound = star._heuristic(star._nodeIndex(7 * width + 9))
+    star.shortest_path(1, 7 * width + 9)
+    assert star._heuristic(star._nodeIndex(7 * width + 9)) is bound
+    star.set_weight(1, 2, G[1][2]['weight'])
+    assert not star.heuristics
+    routes = star.shortest_paths([(1, width * height), (width, 15 * width + 3)])
+    assert abs(routes[(width, 15 * width + 3)][0] - nx.shortest_path_length(G, width, 15 * width + 3, weight='weight')) < 1e-9
+    #a narrow corridor widens to the cells whose lower bound beats its route and stays exact
+    corridor = routingEngine(*router._edgeArrays(), gridWidth=width, method='corridor', corridorSlack=0.05, corridorBuffer=1)
+    routes = corridor.shortest_paths(pairs + [(width + 1, 21 * width + 25)])
+    for (source, target), (weight, path_cells) in routes.items():
+        assert abs(weight - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9, (source, target)
+    assert len(corridor.queryStats) == len(routes)
+    assert any(stat["expansions"] for stat in corridor.queryStats), "the corridor was never widened"
+    #on a larger surface the landmark bounds accept the routes of the first corridor without widening
+    large = cost_edges(4, 60, 50)
+    large = np.array([(u, v, w) for (u, v), w in large.items()])
+    tight = routingEngine(large[:, 0], large[:, 1], large[:, 2], gridWidth=60, method='corridor', corridorBuffer=4,
+                          landmarks=buildLandmarks(large[:, 0], large[:, 1], large[:, 2], k=8))
+    exact = routingEngine(large[:, 0], large[:, 1], large[:, 2])
+    for (source, target), (weight, path_cells) in tight.shortest_paths([(605, 1230), (1525, 1725), (303, 2755)]).items():
+        assert abs(weight - exact.shortest_path(source, target)[0]) < 1e-9, (source, target)
+    assert not any(stat["expansions"] for stat in tight.queryStats)
+    assert min(stat["settled"] for stat in tight.queryStats) < len(large) // 8 // 4
+
+    #blocked tie-in edges do not count as steps, the bounded search still stops near its targets
+    blocked = large.copy()
+    blocked[::10, 2] = 1e9
+    bounded = routingEngine(blocked[:, 0], blocked[:, 1], blocked[:, 2], gridWidth=60)
+    assert abs(bounded.meanStepCost - large[:, 2].mean()) < 0.05 * large[:, 2].mean()
+    dist, _, settled = bounded._boundedTree(1525, [1526])
+    assert np.isfinite(dist).sum() == settled < len(bounded.cells) // 10
+
+    try:
+        routingEngine(*router._edgeArrays(), gridWidth=width, method='bfs')
+        assert False, "unknown routing method accepted"
+    except ValueError:
+        pass
+
+    try:
+        router.shortest_path(1, width * height + 5)
+        assert False, "unknown node accepted"
+    except nx.NodeNotFound:
+        pass
+
+    #stores hand the engine the same edges they route on
+    with cost_file() as (path, _):
+        gt = make_gt(path)
+        gt.processGeoCost(useCache=False)
+        for store in (rasterCostStore(gt), compactCostStore(gt, dtype='uint16')):
+            store.set_weight(1, 2, 0)
+            store.set_weight(1, 40, 0.5)
+            src, dst, weight = store.edge_arrays()
+            arrays = dict(zip(zip(src.tolist(), dst.tolist()), weight.tolist()))
+            assert arrays == {(u, v): w for u in range(1, WIDTH * HEIGHT + 1) for v, w in store.out_edges(u)}
+
+    print("PASS -- CSR routing engine")
+
+
+def run_landmark_test():
+    width, height = 30, 24
+    expected = cost_edges(5, width, height)
+    edges = np.array([(u, v, w) for (u, v), w in expected.items()])
+    table = buildLandmarks(edges[:, 0], edges[:, 1], edges[:, 2], k=4)
+    assert len(set(table["landmarks"].tolist())) == 4
+
+    G = nx.DiGraph()
+    G.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+    lengths = nx.single_source_dijkstra_path_length(G, int(table["landmarks"][0]))
+    assert np.allclose(table["fromLandmark"][0], [lengths[cell] for cell in table["nodes"].tolist()])
+
+    plain = routingEngine(edges[:, 0], edges[:, 1], edges[:, 2], gridWidth=width, method='astar')
+    alt = routingEngine(edges[:, 0], edges[:, 1], edges[:, 2], gridWidth=width, method='astar', landmarks=table)
+    pairs = [(1, width * height), (width, (height - 1) * width + 1), (5 * width + 6, 18 * width + 27), (40, 41)]
+    for engine in (plain, alt):
+        for source, target in pairs:
+            cost, path_cells = engine.shortest_path(source, target)
+            assert abs(cost - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9, (source, target)
+    settled = [sum(stat["settled"] for stat in engine.queryStats) for engine in (plain, alt)]
+    assert 2 * settled[1] < settled[0], settled
+
+    #cheaper and new edges after preprocessing become portals, the bound stays admissible
+    for u, v, w in [(1, 2, 0), (2, width + 3, 0), (width + 3, 20 * width + 25, 0), (8 * width + 8, 8 * width + 9, 0.5)]:
+        G.add_edge(u, v, weight=w)
+        alt.set_weight(u, v, w)
+    alt.set_weight(12 * width + 12, 12 * width + 13, 500)
+    G[12 * width + 12][12 * width + 13]['weight'] = 500
+    for source, target in pairs + [(width * height, 1), (2, 21 * width + 2)]:
+        cost, path_cells = alt.shortest_path(source, target)
+        assert abs(cost - nx.shortest_path_length(G, source, target, weight='weight')) < 1e-9, (source, target)
+
+    #tables are kept per window next to the cache and dropped when the surface changes
+    with cost_file() as (path, _):
+        gt = make_gt(path)
+        gt.processGeoCost()
+        src, dst, cost = gt.getEdgeArrays()
+        nodes = np.unique(np.concatenate((src, dst)))
+        assert gt.loadLandmarks(3, nodes) is None
+        table = buildLandmarks(src, dst, cost, k=3)
+        gt.saveLandmarks(3, table)
+        stored = gt.loadLandmarks(3, nodes)
+        assert all(np.array_equal(stored[key], table[key]) for key in table)
+        assert gt.loadLandmarks(2, nodes) is None and gt.loadLandmarks(3, nodes[1:]) is None
+
+        write_cost_file(path, seed=2)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        gt = make_gt(path)
+        gt.processGeoCost()
+        assert gt.loadLandmarks(3, nodes) is None, "landmarks of the old surface were reused"
+
+    print("PASS -- ALT landmarks")
+
+
+def run_pyramid_test():
+    width, height = 64, 48
+    with cost_file(width=width, height=height, seed=6) as (path, expected):
+        gt = make_gt(path)
+        gt.north = LOWER_LEFT_Y + (height - 0.5) * CELL_SIZE
+        gt.east = LOWER_LEFT_X + (width - 0.5) * CELL_SIZE
+        gt.processGeoCost(useCache=False, pyramid=(8, 2))
+        assert gt._pyramidIsCurrent((8, 2)) and gt._pyramidIsCurrent((8,)) and not gt._pyramidIsCurrent((4,))
+
+        #the east edge of coarse cell (1, 2) at factor 8 is 8 times the mean east step inside it
+        level = np.load(gt.getPyramidPath().joinpath("level_8.npy"))
+        assert level.shape == (6, 8, 8)
+        east = [expected[(r * width + c + 1, r * width + c + 2)] for r in range(8, 16) for c in range(16, 24)]
+        assert abs(level[1, 2, 4] - 8 * np.mean(east)) < 1e-9
+        assert np.isinf(level[0, :, 1]).all() and np.isinf(level[:, -1, 4]).all()
+
+        #a solve asking for another factor adds its level to the ones on disk
+        gt.processGeoCost(useCache=False, pyramid=(4,))
+        assert gt._pyramidIsCurrent((8, 4, 2))
+        assert np.array_equal(np.load(gt.getPyramidPath().joinpath("level_8.npy")), level)
+
+        levels = gt.loadCostPyramid((2, 8))
+        src, dst, cost = gt.getEdgeArrays()
+
+    assert [level[0] for level in levels] == [2, 8] and levels[1][1] == 8
+    coarse = {(u, v): w for u, v, w in zip(levels[1][2].tolist(), levels[1][3].tolist(), levels[1][4].tolist())}
+    assert coarse[(1 * 8 + 2 + 1, 1 * 8 + 3 + 1)] == level[1, 2, 4]
+
+    exact = routingEngine(src, dst, cost, gridWidth=width)
+    pyramid = routingEngine(src, dst, cost, gridWidth=width, method='pyramid', pyramid=levels)
+    pairs = [(1, width * height), (width, (height - 1) * width + 1), (10 * width + 5, 40 * width + 60), (33, 34)]
+    for source, target in pairs:
+        weight, path_cells = pyramid.shortest_path(source, target)
+        best = exact.shortest_path(source, target)[0]
+        assert path_cells[0] == source and path_cells[-1] == target
+        assert abs(weight - sum(expected[edge] for edge in zip(path_cells[:-1], path_cells[1:]))) < 1e-9
+        assert best - 1e-9 <= weight < 1.1 * best, (source, target, weight, best)
+    assert sum(stat["settled"] for stat in pyramid.queryStats[:3]) < 3 * len(exact.cells)
+    routes = pyramid.shortest_paths(pairs, exact=True)
+    assert all(abs(routes[pair][0] - exact.shortest_path(*pair)[0]) < 1e-9 for pair in pairs)
+
+    #a blocked wall with a gap at the bottom, the coarse levels do not see it
+    wall = [(u, v) for (u, v) in expected if (v - 1) % width == 30 and (v - 1) // width <= 40]
+    for engine in (exact, pyramid):
+        engine.set_weights(*zip(*wall), [1e9] * len(wall))
+    source, target = 20 * width + 1, 20 * width + width
+    weight, path_cells = pyramid.shortest_path(source, target)
+    best = exact.shortest_path(source, target)[0]
+    assert best < 1e9 and best - 1e-9 <= weight < 1.1 * best, (weight, best)
+
+    print("PASS -- cost pyramid routing")
+
+
+def run_route_cache_test():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "routes")
+        keys = [routeKey("surface", "overrides", start, start + 1) for start in range(4)]
+        assert routeKey("surface", "other", 0, 1) != keys[0]
+
+        cache = routeCache(path, maxEntries=3)
+        assert cache.get(keys[0]) is None and cache.misses == 1
+        for i, key in enumerate(keys[:3]):
+            cache.put(key, [i + 1, i + 2, i + 3], 10.0 * i, 0.5 * i)
+        assert cache.get(keys[0]) == ([1, 2, 3], 0.0, 0.0) and cache.hits == 1
+        assert np.load(os.path.join(path, keys[0] + ".npy")).dtype == np.int32
+
+        #keys[1] is now the least recently used
+        cache.put(keys[3], [7, 8], 1.5, 2.5)
+        assert cache.get(keys[1]) is None and not os.path.exists(os.path.join(path, keys[1] + ".npy"))
+        cache.save()
+
+        cache = routeCache(path, maxEntries=3)
+        assert list(cache.index) == [keys[2], keys[0], keys[3]]
+        assert cache.get(keys[3]) == ([7, 8], 1.5, 2.5)
+        cache.put(keys[1], [2 ** 40, 2 ** 40 + 1], 1.0, 1.0)
+        assert cache.get(keys[1])[0] == [2 ** 40, 2 ** 40 + 1]
+
+        #a second solve on the same surface reads every route from the cache without searching
+        costPath = os.path.join(tmp, "costs.csv")
+        write_cost_file(costPath, seed=9)
+        gt = make_gt(costPath)
+        gt.processGeoCost(useCache=False)
+        store = rasterCostStore(gt)
+        pairs = [(1, WIDTH * HEIGHT), (WIDTH, 5 * WIDTH + 1), (2 * WIDTH + 3, 7 * WIDTH + 9)]
+        solves = []
+        for solve in range(2):
+            g = alternateNetworkGeo()
+            g.gt = gt
+            g.costStore = store.scenario()
+            g.surfaceKey = "surface"
+            g.routeCache = routeCache(os.path.join(tmp, "solve_routes"))
+            solves.append(g.get_shortest_routes(pairs))
+            g.get_shortest_routes(pairs)
+            if solve == 0:
+                assert (g.routeCache.hits, g.routeCache.misses) == (0, 3)
+                assert (g.routeReuse["recomputed"], g.routeReuse["reused"]) == (3, 3)
+            else:
+                assert (g.routeCache.hits, g.routeCache.misses) == (3, 0)
+                assert (g.routeReuse["recomputed"], g.routeReuse["reused"]) == (0, 3)
+        assert all(solves[0][pair][1] == solves[1][pair][1] for pair in pairs)
+
+    print("PASS -- route cache")
+
+
+def run_incremental_test():
+    width, height = 30, 24
+    expected = cost_edges(5, width, height)
+    #a cheap route far from the pipeline added below, no path through the pipeline can beat it
+    expected[(22 * width + 2, 22 * width + 3)] = 1.0
+
+    G = nx.DiGraph()
+    G.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+    edges = np.array([(u, v, w) for (u, v), w in expected.items()])
+    pairs = [(1, width * height), (width, 5 * width + 1), (3 * width + 4, 4 * width + 9), (22 * width + 2, 22 * width + 3)]
+
+    for method in ('dijkstra', 'astar', 'corridor'):
+        graph = G.copy()
+        router = routingEngine(edges[:, 0], edges[:, 1], edges[:, 2], gridWidth=width, method=method)
+        routes = router.shortest_paths(pairs)
+        assert router.affected_routes(routes, {}) == set()
+
+        #dearer edges away from every route leave all routes shortest
+        used = {edge for weight, cells in routes.values() for edge in zip(cells[:-1], cells[1:])}
+        changes = {}
+        for edge in list(expected)[::37]:
+            if edge not in used:
+                changes[edge] = graph.edges[edge]['weight']
+                graph.edges[edge]['weight'] *= 3
+                router.set_weight(*edge, graph.edges[edge]['weight'])
+        assert router.affected_routes(routes, changes) == set(), method
+        for pair, (weight, cells) in routes.items():
+            assert abs(weight - nx.shortest_path_length(graph, *pair, weight='weight')) < 1e-9
+
+        #a dearer edge on a route flags that route only
+        weight, cells = routes[pairs[0]]
+        edge = (cells[1], cells[2])
+        changes = {edge: graph.edges[edge]['weight']}
+        graph.edges[edge]['weight'] += 100
+        router.set_weight(*edge, graph.edges[edge]['weight'])
+        assert router.affected_routes(routes, changes) == {pairs[0]}, method
+
+        #a zero cost pipeline next to a route flags it, unchanged routes far from it stay
+        pipeline = (3 * width + 5, 4 * width + 8)
+        changes = {pipeline: np.inf}
+        graph.add_edge(*pipeline, weight=0)
+        router.set_weight(*pipeline, 0)
+        affected = router.affected_routes(routes, changes)
+        stale = {pair for pair, (weight, cells) in routes.items()
+                 if nx.shortest_path_length(graph, *pair, weight='weight') < weight - 1e-9}
+        assert pairs[2] in stale and stale <= affected, method
+        if method != 'corridor':
+            assert pairs[3] not in affected, method
+
+    #two consecutive solves on one shared surface, the second starts from the route memo of the first
+    with cost_file(seed=10) as (path, _):
+        gt = make_gt(path)
+        gt.processGeoCost(useCache=False)
+        store = rasterCostStore(gt)
+    pairs = [(1, WIDTH * HEIGHT), (WIDTH, 5 * WIDTH + 1), (2 * WIDTH + 3, 7 * WIDTH + 9), (9 * WIDTH + 1, 9 * WIDTH + 4)]
+    pipeline = [(WIDTH + 2, 8 * WIDTH + 10)]
+    solves = []
+    for solve in range(2):
+        g, exact = alternateNetworkGeo(), alternateNetworkGeo()
+        key = (("raster", "incremental test"), g.routing, g.corridor, 0, None)
+        g.costStore = get_shared_surface(key[0], lambda: store)
+        g.routerKey = key
+        g._attach_route_memo(key)
+        exact.costStore = store.scenario()
+        for graph in (g, exact):
+            graph.gt = gt
+            if solve == 0:
+                graph.add_existing_zero_cost_path("pipeline", pipeline, 'unidirectional')
+        routes = g.get_shortest_routes(pairs)
+        assert all(abs(routes[pair][1] - exact.get_shortest_route(*pair)[1]) < 1e-9 for pair in pairs), solve
+        solves.append(g)
+    assert solves[1].routeMemo is solves[0].routeMemo
+    assert solves[1].routeReuse["reused"] > 0 and solves[1].routeReuse["invalidated"] > 0, solves[1].routeReuse
+
+    print("PASS -- incremental routing")
+
+
+def run_override_test():
+    with cost_file(seed=6) as (path, expected):
+        gt = make_gt(path)
+        gt.processGeoCost(useCache=False)
+        store = rasterCostStore(gt)
+    assert not store.costs.flags.writeable
+
+    #scenarios share the stored costs, overrides stay in their own view
+    view = store.scenario()
+    assert view.costs is store.costs
+    view.set_weight(1, 2, 0)
+    view.set_weight(1, 3 * WIDTH + 3, 0)
+    assert view.get_weight(1, 2) == 0 and view.has_edge(1, 3 * WIDTH + 3)
+    assert store.get_weight(1, 2) == expected[(1, 2)] and not store.has_edge(1, 3 * WIDTH + 3)
+    view.reset_weight(1, 2)
+    view.reset_weight(1, 3 * WIDTH + 3)
+    assert view.get_weight(1, 2) == expected[(1, 2)] and not view.has_edge(1, 3 * WIDTH + 3)
+
+    source, target = 1, WIDTH * HEIGHT
+    pipeline = [(WIDTH + 2, 2 * WIDTH + 3), (2 * WIDTH + 3, 8 * WIDTH + 10)]
+    stored = alternateNetworkGeo()
+    stored.costStore = store.scenario()
+    loaded = alternateNetworkGeo()
+    loaded.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+    for g in (stored, loaded):
+        g.gt = gt
+        base = g.get_shortest_route(source, target)
+        key = g.get_override_key()
+
+        g.push_overrides()
+        g.add_existing_zero_cost_path("pipeline", pipeline, 'unidirectional')
+        assert g.get_override_key() != key
+        piped = g.get_shortest_route(source, target)
+        assert piped[1] < base[1]
+        g.push_overrides()
+        g._set_edge_weight(*pipeline[0], 5.0)
+        g.pop_overrides()
+        assert g.get_shortest_route(source, target) == piped
+        g.pop_overrides()
+
+        assert g.get_override_key() == key and not g.weightOverrides
+        assert g.get_shortest_route(source, target) == base
+        assert not g._has_edge(*pipeline[1])
+    assert all(loaded.edges[edge]['weight'] == weight for edge, weight in expected.items())
+    assert store.get_weight(*pipeline[0]) == expected[pipeline[0]] and not store.has_edge(*pipeline[1])
+
+    #scenarios of a shared store route on copies of one engine, overrides never reach the shared weights
+    key = ("raster", "override test")
+    routes = []
+    for solve in range(2):
+        g = alternateNetworkGeo()
+        g.gt = gt
+        g.costStore = get_shared_surface(key, lambda: store)
+        g.routerKey = (key, 'dijkstra', g.corridor, 0, None)
+        if solve == 0:
+            g.add_existing_zero_cost_path("pipeline", pipeline, 'unidirectional')
+        routes.append(g.get_shortest_route(source, target))
+    assert np.shares_memory(g.router.graph.indices, sharedRouters[g.routerKey].graph.indices)
+    assert routes[0][1] < routes[1][1] and routes[1] == stored.get_shortest_route(source, target)
+    assert sharedRouters[g.routerKey].path_weights(pipeline[0]).tolist() == [expected[pipeline[0]]]
+
+    print("PASS -- weight override layer")
+
+
+def run_tie_in_test():
+    with cost_file(seed=7) as (path, expected):
+        gt = make_gt(path)
+        gt.processGeoCost(useCache=False)
+        store = rasterCostStore(gt)
+
+    #pipeline along row 4 with a jump back to row 2
+    vertices = [3 * WIDTH + col for col in range(2, 10)] + [WIDTH + 11]
+    pipeline = list(zip(vertices[:-1], vertices[1:]))
+    point1, point2 = gt._cellToLatLon(vertices[2]), gt._cellToLatLon(vertices[5])
+    rules = [dict(point1=point1, point2=point2, onlyin=True), dict(point1=point1, point2=point2, exclusion=True, onlyout=True),
+             dict(point1=point1, onlyin=True, onlyout=True), dict(point1=point2, exclusion=True, etype='after', onlyin=True)]
+
+    def enforce(g, rule):
+        g.gt = gt
+        g.add_existing_zero_cost_path("pipeline", pipeline, 'bidirectional')
+        g.enforce_pipeline_tie_point(**rule)
+        return g.weightOverrides
+
+    overrides = []
+    for rule in rules:
+        stored = alternateNetworkGeo()
+        stored.costStore = store.scenario()
+        loaded = alternateNetworkGeo()
+        loaded.add_weighted_edges_from((u, v, w) for (u, v), w in expected.items())
+        overrides.append(enforce(stored, rule))
+        assert enforce(loaded, rule) == overrides[-1], rule
+
+    #case 1 against a scan of every edge of the surface
+    pathset, ties = set(vertices), {vertices[2], vertices[5]}
+    blocked = {(u, v) for (u, v) in list(expected) + pipeline
+               if ((v in pathset) != (u in pathset)) and not ((v in pathset and v in ties) or (u in pathset and u in ties))}
+    blocked |= {(u, v) for (u, v) in expected if (u in ties) and (v not in pathset)}
+    assert {edge for edge, weight in overrides[0].items() if weight == 1e9} == blocked
+
+    print("PASS -- tie-in enforcement")
+
+
+def run_pipeline_registry_test():
+    with cost_file(seed=8) as (path, _):
+        tmp = os.path.dirname(path)
+        gt = make_gt(path)
+        gt.north = LOWER_LEFT_Y + 8.5 * CELL_SIZE
+        gt.processGeoCost(useCache=False)
+        store = rasterCostStore(gt)
+
+        #row 3 east to west, column 7 from the northern edge (outside the window) down, one on row 0 only,
+        #row-3 collides with row_3 once underscores are replaced
+        lines = {"row_3": [3 * WIDTH + 2, 3 * WIDTH + 11], "col-7": [8, 8 * WIDTH + 8], "far": [3, 6], "row-3": [5 * WIDTH + 2, 5 * WIDTH + 4]}
+        #template layout, Name and capacities on the first vertex of each pipeline only
+        rows = []
+        for name, cells in lines.items():
+            for k, cell in enumerate(cells):
+                lat, lon = gt._cellToLatLon(cell)
+                first = (k == 0)
+                rows.append({"Lat": lat, "Long": lon, "Name": name if first else None,
+                             "Lower Cap": 0 if first else None, "Upper Cap": 5 if first else None})
+        pipePath = os.path.join(tmp, "pipelines.csv")
+        pd.DataFrame(rows).to_csv(pipePath, index=False)
+        pd.DataFrame(rows[:1] + [{"Lat": 35.0, "Long": -98.0, "Name": "single", "Lower Cap": 0, "Upper Cap": 1}]).to_csv(
+            os.path.join(tmp, "single.csv"), index=False)
+        try:
+            pipelineRegistry().read(os.path.join(tmp, "single.csv"))
+            assert False, "a single vertex pipeline was registered"
+        except ValueError:
+            pass
+
+        geoPath = os.path.join(tmp, "pipelines.geojson")
+        with open(geoPath, 'w') as write_obj:
+            json.dump({"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"Name": "multi", "Upper Cap": 2},
+                 "geometry": {"type": "MultiLineString", "coordinates": [[[-98.0, 35.0], [-97.9, 35.1]], [[-90.0, 30.0], [-89.9, 30.0]]]}},
+                {"type": "Feature", "properties": {"Name": "site"}, "geometry": {"type": "Point", "coordinates": [-98.0, 35.0]}}]},
+                write_obj)
+        template = Path(__file__).resolve().parents[1].joinpath("input_data", "SPETEST", "Enid Purdy pipeline.xlsx")
+        if template.exists():
+            registry = pipelineRegistry().read(template)
+            assert list(registry.pipelines) == ["enid-purdy-pipeline"] and len(registry.pipelines["enid-purdy-pipeline"]["Lat"]) == 79
+            assert registry.pipelines["enid-purdy-pipeline"]["Upper Cap"] == 2
+
+        registry = pipelineRegistry(indexCell=0.05).read(geoPath)
+        assert list(registry.pipelines) == ["multi-1", "multi-2"] and registry.pipelines["multi-1"]["Upper Cap"] == 2
+        assert registry.query(34.9, -98.1, 35.05, -97.95) == ["multi-1"]
+        assert registry.query(29.0, -91.0, 31.0, -89.0) == ["multi-2"] and registry.query(0, 0, 1, 1) == []
+
+        g = alternateNetworkGeo()
+        g.gt = gt
+        g.costStore = store.scenario()
+        assert g.import_pipelines(pipePath, index_cell=0.02) == ["row-3", "col-7", "row-3-2"]
+        assert len(g.pipelineRegistry) == 4
+
+        #a step without an edge is filled by a direct search, it is not a network route and stays out of the memo
+        gapStore = rasterCostStore(gt)
+        gapStore.costs = gapStore.costs.copy()
+        gapStore.costs[3 - gapStore.rowMin, 4 - gapStore.colMin, gapStore.slotFromOffset[1]] = np.inf
+        gapped = alternateNetworkGeo()
+        gapped.gt = gt
+        gapped.costStore = gapStore
+        lat, lon = zip(*(gt._cellToLatLon(cell) for cell in (3 * WIDTH + 2, 3 * WIDTH + 8)))
+        gapped._embed_pipeline("gap", np.array(lat), np.array(lon), 0, 5, 'bidirectional')
+        vertices = gapped.existingPathVertices["gap"]
+        assert vertices[0] == 3 * WIDTH + 2 and vertices[-1] == 3 * WIDTH + 8 and (3 * WIDTH + 5, 3 * WIDTH + 6) not in zip(vertices, vertices[1:])
+        assert len(vertices) > 7 and gapped.routeMemo == {} and gapped.routeReuse["recomputed"] == 0
+    assert g.existingPathVertices["row-3"] == list(range(3 * WIDTH + 2, 3 * WIDTH + 12))
+    assert g.existingPathVertices["col-7"] == [row * WIDTH + 8 for row in range(1, 9)]
+    assert g.existingPathVertices["row-3-2"] == [5 * WIDTH + 2, 5 * WIDTH + 3, 5 * WIDTH + 4]
+    assert g.pipelineCells[3 * WIDTH + 8] == ["row-3", "col-7"] and g.pipelineCells[6 * WIDTH + 8] == ["col-7"]
+    assert g.get_shortest_route(3 * WIDTH + 2, 8 * WIDTH + 8)[1] == 0
+
+    #a tie-in point on the second pipeline picks it without a pathname
+    g.enforce_pipeline_tie_point(point1=gt._cellToLatLon(6 * WIDTH + 8))
+    assert g._edge_weight(5 * WIDTH + 7, 5 * WIDTH + 8) == 1e9
+    assert g._edge_weight(2 * WIDTH + 4, 3 * WIDTH + 4) != 1e9
+
+    #transshipment nodes are matched to their pipeline by the exact name, not a prefix of another one
+    g = alternateNetworkGeo()
+    g.existingPath = {"Line-1": [], "Line-10": []}
+    g.existingPathBounds = {"Line-1": (0, 5), "Line-10": (2, 8)}
+    g.existingPathType = {"Line-1": "bidirectional", "Line-10": "unidirectional"}
+    g.assetNameFromPT = {1: "Line-10 from A to B node1", 2: "Line-10 from A to B node2", 3: "A"}
+    g.spathsCost, g.spathsLength, g.spathsWeight, g.spaths = {(1, 2): 0}, {(1, 2): 1.0}, {(1, 2): 1.0}, {(1, 2): [1, 2]}
+    nodes, arcs, info, paths, b = g.export_network()
+    assert nodes == ["Line-10_TS1", "Line-10_TS2", "A"]
+    assert arcs == [("Line-10_TS1", "Line-10_TS2")] and info[arcs[0]][3:] == [2, 8]
+
+    print("PASS -- pipeline registry")
+
+
+def run_options_test():
+    #defaults are filled only for the modes that are on
+    options = costSurfaceOptions(routing='corridor', landmarks=4)
+    assert options.corridor_slack is not None and options.pyramid_factors is None and options.tile_size is None
+    assert costSurfaceOptions(routing='pyramid').pyramid_factors
+    assert costSurfaceOptions(tiled=True, max_tiles=3).max_tiles == 3
+
+    #settings another setting would silently ignore or contradict are rejected
+    invalid = [dict(routing='bidirectional'), dict(compact='float16'), dict(region_shape='circle'),
+               dict(raster=True, compact='uint16'), dict(tiled=True, raster=True), dict(tiled=True, compact='float32'),
+               dict(tiled=True, routing='astar'), dict(tiled=True, routing_workers=2), dict(tile_size=64),
+               dict(pyramid_factors=(4,)), dict(routing='astar', pyramid_factors=(4,)), dict(routing='pyramid', pyramid_factors=()),
+               dict(corridor_slack=1.5), dict(routing='pyramid', corridor_buffer=2), dict(landmarks=4),
+               dict(routing='pyramid', landmarks=4), dict(landmarks=-1), dict(route_cache_size=10),
+               dict(buffer_km=5), dict(region_shape='hull'), dict(asset_points=[(0, 0)]),
+               dict(region_points=[(0, 0)], buffer_factor=0)]
+    for kwargs in invalid:
+        try:
+            costSurfaceOptions(**kwargs)
+        except ValueError:
+            continue
+        raise AssertionError("costSurfaceOptions accepted %s" %(kwargs))
+
+    #options and keywords are not mixed
+    try:
+        alternateNetworkGeo().initialize_cost_surface(costSurfaceOptions(), raster=True)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("initialize_cost_surface accepted options and keywords")
+
+    print("PASS -- cost surface options")
+
+
+if __name__ == '__main__':
+    run_test()
+    run_window_test()
+    run_transform_test()
+    run_region_test()
+    run_tile_test()
+    run_distance_test()
+    run_parallel_test()
+    run_compact_test()
+    run_raster_test()
+    run_routing_test()
+    run_landmark_test()
+    run_pyramid_test()
+    run_route_cache_test()
+    run_incremental_test()
+    run_override_test()
+    run_tie_in_test()
+    run_pipeline_registry_test()
+    run_options_test()